@@ -2,3 +2,32 @@ host = "localhost"
 user = "komronsodiqov"
 password = ""          
 db_name = "my_db"    
+
+# connection pool
+pool_min_size = 1
+pool_max_size = 10
+pool_timeout = 5.0                  # seconds to wait for a free connection
+pool_health_check_interval = 30.0   # probe connections idle longer than this
+connect_retries = 5
+connect_backoff = 0.2               # first retry delay, doubled each attempt
+
+# rows fetched per round trip when streaming large result sets
+fetch_itersize = 2000
+
+# read replicas (db.py); each entry overrides the settings above, e.g.
+# [{'host': 'replica1.local'}, {'host': 'localhost', 'port': 5433}].
+# Empty: every query goes to the primary. To try it locally, start a
+# streaming replica with `pg_basebackup -h localhost -D /tmp/replica -R`
+# and `pg_ctl -D /tmp/replica -o "-p 5433" start`, then list {'port': 5433}.
+read_replicas = []
+replica_sticky_seconds = 2.0        # reads stay on the primary this long after a write
+replica_retry_after = 30.0          # skip a replica this long after it failed
+
+# rows sent per multi-row INSERT when adding contacts from the console
+insert_batch_size = 1000
+
+# statement metrics and slow-query log (metrics.py)
+slow_query_ms = 200                 # statements at least this slow are logged
+slow_query_log = "slow_queries.log"
+explain_slow_queries = False        # also log EXPLAIN (ANALYZE, BUFFERS); re-runs the statement
+metrics_file = "phone_book_metrics.prom"
@@ -0,0 +1,149 @@
+"""Streaming, validated CSV import into the phone_book table.
+
+The file is parsed on the client and sent in chunks with COPY into an
+unlogged staging table, so memory use does not depend on the file size.
+Rows with a bad name or phone number are removed from staging in SQL and
+written to a side file together with lines that could not be parsed at
+all. What is left is merged into phone_book with a single statement.
+"""
+import csv
+import io
+import os
+import time
+
+from psycopg2 import sql
+
+from db import transaction
+
+# Same rule as bulk_insert_users in sql_functions.sql
+PHONE_PATTERN = r'^\+?[0-9]{1,3}[-\s]?[0-9]{3,}[-\s0-9]*$'
+CHUNK_ROWS = 50000
+
+# Merges the validated staging rows: phone_book has no unique key, so add
+# the (name, phone) pairs not present yet, comparing phones by their digits
+# (phone_digits column)
+MERGE_APPEND_NEW = """
+    INSERT INTO phone_book(user_name, phone_num)
+    SELECT DISTINCT ON (s.user_name, d.digits) s.user_name, s.phone_num
+    FROM {staging} s
+    CROSS JOIN LATERAL (SELECT regexp_replace(s.phone_num, '[^0-9]', '', 'g') AS digits) d
+    WHERE NOT EXISTS (
+        SELECT 1 FROM phone_book pb
+        WHERE pb.user_name = s.user_name AND pb.phone_digits = d.digits
+    )
+    ORDER BY s.user_name, d.digits, s.line_no
+"""
+
+REJECT_REASON = """
+    CASE
+        WHEN user_name IS NULL OR length(trim(user_name)) = 0 THEN 'Empty name'
+        WHEN length(user_name) > 150 THEN 'Name longer than 150 characters'
+        WHEN phone_num IS NULL OR NOT phone_num ~ {pattern} THEN 'Invalid phone format'
+        WHEN length(phone_num) > 15 THEN 'Phone longer than 15 characters'
+    END
+"""
+
+
+def _copy_chunk(cur, staging, buf):
+    """Send one buffered chunk of staging rows with COPY."""
+    buf.seek(0)
+    cur.copy_expert(
+        sql.SQL("COPY {} (line_no, user_name, phone_num) FROM STDIN WITH CSV")
+        .format(staging).as_string(cur),
+        buf
+    )
+
+
+def stage_csv(cur, path, staging, reject_writer, chunk_rows=CHUNK_ROWS, has_header=True):
+    """Stream `path` into the staging table; returns (staged, rejected) counts.
+
+    Lines that do not have exactly two columns are written to
+    `reject_writer` straight away and never reach the server.
+    """
+    staged = rejected = 0
+    started = time.perf_counter()
+
+    with open(path, 'r', newline='') as src:
+        reader = csv.reader(src)
+        if has_header:
+            next(reader, None)
+
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        pending = 0
+        for row in reader:
+            if len(row) != 2:
+                reject_writer.writerow([reader.line_num, ','.join(row), '',
+                                        f'Expected 2 columns, got {len(row)}'])
+                rejected += 1
+                continue
+
+            writer.writerow([reader.line_num, row[0], row[1]])
+            pending += 1
+            if pending == chunk_rows:
+                _copy_chunk(cur, staging, buf)
+                staged += pending
+                rate = staged / (time.perf_counter() - started)
+                print(f"[INFO] {staged} rows staged ({rate:,.0f} rows/s).")
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                pending = 0
+
+        if pending:
+            _copy_chunk(cur, staging, buf)
+            staged += pending
+
+    return staged, rejected
+
+
+def reject_invalid(cur, staging, rejects_file):
+    """Move rows that fail validation from staging into the rejects file."""
+    reason = sql.SQL(REJECT_REASON).format(pattern=sql.Literal(PHONE_PATTERN))
+    cur.copy_expert(
+        sql.SQL("COPY (DELETE FROM {staging} WHERE {reason} IS NOT NULL "
+                "RETURNING line_no, user_name, phone_num, {reason}) TO STDOUT WITH CSV")
+        .format(staging=staging, reason=reason).as_string(cur),
+        rejects_file
+    )
+    return cur.rowcount
+
+
+def import_csv(conn, path, merge_sql=MERGE_APPEND_NEW, reject_path=None,
+               chunk_rows=CHUNK_ROWS, has_header=True):
+    """Validate and merge a contacts CSV (user_name,phone_num) into phone_book.
+
+    Returns a dict with the number of data rows read, rejected and merged,
+    the elapsed time and the path of the rejects file.
+    """
+    if reject_path is None:
+        reject_path = os.path.splitext(path)[0] + '.rejected.csv'
+    staging = sql.Identifier(f"phone_book_staging_{os.getpid()}_{time.time_ns()}")
+    started = time.perf_counter()
+
+    # One transaction from staging to merge: a failed import leaves neither
+    # a half-merged phone_book nor a staging table behind, and every COPY
+    # chunk is not a commit of its own
+    with transaction(conn), conn.cursor() as cur:
+        cur.execute(sql.SQL(
+            "CREATE UNLOGGED TABLE {} (line_no BIGINT, user_name TEXT, phone_num TEXT)"
+        ).format(staging))
+        with open(reject_path, 'w', newline='') as rejects:
+            reject_writer = csv.writer(rejects)
+            reject_writer.writerow(['line_no', 'user_name', 'phone_num', 'reason'])
+            staged, unparsed = stage_csv(cur, path, staging, reject_writer,
+                                         chunk_rows, has_header)
+            rejects.flush()
+            rejected = unparsed + reject_invalid(cur, staging, rejects)
+
+        cur.execute(sql.SQL(merge_sql).format(staging=staging))
+        merged = cur.rowcount
+        cur.execute(sql.SQL("DROP TABLE {}").format(staging))
+
+    elapsed = time.perf_counter() - started
+    return {
+        'rows': staged + unparsed,
+        'rejected': rejected,
+        'merged': merged,
+        'seconds': elapsed,
+        'reject_path': reject_path
+    }
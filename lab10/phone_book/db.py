@@ -0,0 +1,394 @@
+import atexit
+import hashlib
+import itertools
+import random
+import re
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from config import (host, user, password, db_name,
+                    pool_min_size, pool_max_size, pool_timeout,
+                    pool_health_check_interval, connect_retries, connect_backoff,
+                    fetch_itersize, read_replicas, replica_sticky_seconds, replica_retry_after)
+from metrics import InstrumentedCursor, register_prepared
+
+
+class PoolError(Exception):
+    """Raised when the pool cannot hand out a connection."""
+
+
+class PoolTimeout(PoolError):
+    """Raised when no connection became free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """A small thread-safe pool of PostgreSQL connections.
+
+    Keeps between `minconn` and `maxconn` connections open, checks idle
+    connections before handing them out again and reconnects with
+    exponential backoff when the server is unreachable. Cursors of pooled
+    connections are timed (see metrics.py).
+    """
+
+    def __init__(self, minconn, maxconn, timeout=5.0, health_check_interval=30.0,
+                 retries=5, backoff=0.2, **dsn):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Pool sizes must satisfy 0 <= minconn <= maxconn, maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.dsn = dsn
+
+        self._idle = []       # [(conn, time it was returned)]
+        self._size = 0        # idle + checked out + being opened
+        self._closed = False
+        self._cond = threading.Condition()
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        """Open a new connection, retrying with exponential backoff."""
+        delay = self.backoff
+        for attempt in range(1, self.retries + 1):
+            try:
+                conn = psycopg2.connect(cursor_factory=InstrumentedCursor, **self.dsn)
+                conn.autocommit = True
+                return conn
+            except psycopg2.OperationalError as e:
+                if attempt == self.retries:
+                    raise
+                print(f"[WARN] Connection attempt {attempt} failed: {e}".rstrip())
+                time.sleep(delay + random.uniform(0, delay / 2))
+                delay = min(delay * 2, 10.0)
+
+    def _is_healthy(self, conn):
+        """Cheap liveness probe for a connection that sat idle for a while."""
+        if conn.closed:
+            return False
+        try:
+            # Plain cursor: probes are not statements worth measuring
+            with conn.cursor(cursor_factory=extensions.cursor) as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting at most `timeout` seconds."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("Connection pool is closed")
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, idle_since = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No connection available after {timeout:.1f}s "
+                                      f"(max {self.maxconn} in use)")
+                self._cond.wait(remaining)
+
+        # Connecting and probing happen outside the lock so other threads
+        # are not blocked behind network round trips.
+        try:
+            if conn is not None:
+                stale = time.monotonic() - idle_since > self.health_check_interval
+                if conn.closed or (stale and not self._is_healthy(conn)):
+                    conn.close()
+                    conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool (or drop it if it is broken)."""
+        if not conn.closed and not close:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.autocommit = True
+            except psycopg2.Error:
+                close = True
+
+        with self._cond:
+            if self._closed or close or conn.closed or len(self._idle) >= self.maxconn:
+                if not conn.closed:
+                    conn.close()
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager that checks a connection out and back in."""
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        """Close every idle connection and refuse further checkouts."""
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+
+
+class ReplicaSet:
+    """Pools for the read replicas, used round-robin.
+
+    After a write (mark_write) reads stay on the primary for
+    `sticky_seconds`, so a process sees its own changes even while the
+    replicas are still catching up. A replica that cannot be reached is
+    skipped for `retry_after` seconds.
+    """
+
+    def __init__(self, replicas, sticky_seconds=2.0, retry_after=30.0, **dsn):
+        self.pools = [ConnectionPool(0, pool_max_size, timeout=pool_timeout,
+                                     health_check_interval=pool_health_check_interval,
+                                     retries=1, **{**dsn, **replica})
+                      for replica in replicas]
+        self.sticky_seconds = sticky_seconds
+        self.retry_after = retry_after
+        self._down_until = [0.0] * len(self.pools)
+        self._next = itertools.count()
+        self._last_write = None
+
+    def mark_write(self):
+        self._last_write = time.monotonic()
+
+    def sticky(self):
+        """True while reads must go to the primary after a recent write."""
+        return (self._last_write is not None
+                and time.monotonic() - self._last_write < self.sticky_seconds)
+
+    def getconn(self):
+        """Return (pool, connection) of the next reachable replica, or (None, None)."""
+        start = next(self._next)
+        for i in range(len(self.pools)):
+            index = (start + i) % len(self.pools)
+            if self._down_until[index] > time.monotonic():
+                continue
+            pool = self.pools[index]
+            try:
+                return pool, pool.getconn()
+            except PoolTimeout:
+                continue
+            except psycopg2.OperationalError as e:
+                print(f"[WARN] Read replica {index + 1} is unavailable: {e}".rstrip())
+                self._down_until[index] = time.monotonic() + self.retry_after
+        return None, None
+
+    def closeall(self):
+        for pool in self.pools:
+            pool.closeall()
+
+
+_savepoint_ids = itertools.count(1)
+
+
+@contextmanager
+def transaction(conn):
+    """Run the block as one transaction, or as a savepoint inside one.
+
+    On an autocommit connection (what the pool hands out) the block gets
+    its own transaction: committed when it ends, rolled back if it
+    raises. Inside such a block a nested `with transaction(conn)` becomes
+    a savepoint, so one failing row can be rolled back and reported
+    while the rest of the outer transaction carries on.
+    """
+    if not conn.autocommit:
+        name = f"sp_{next(_savepoint_ids)}"
+        with conn.cursor() as cur:
+            cur.execute(f"SAVEPOINT {name}")
+        try:
+            yield conn
+        except Exception:
+            with conn.cursor() as cur:
+                cur.execute(f"ROLLBACK TO SAVEPOINT {name}")
+            raise
+        with conn.cursor() as cur:
+            cur.execute(f"RELEASE SAVEPOINT {name}")
+        return
+
+    conn.autocommit = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+
+
+_prepared = weakref.WeakKeyDictionary()     # connection -> names prepared on it
+_PLACEHOLDER_RE = re.compile(r'%(s|%)')
+
+
+def _numbered(query):
+    """Turn psycopg2 %s placeholders into PREPARE's $1, $2, ..."""
+    numbers = itertools.count(1)
+    return _PLACEHOLDER_RE.sub(lambda m: f"${next(numbers)}" if m.group(1) == 's' else '%', query)
+
+
+def execute_prepared(cur, query, params=()):
+    """cur.execute(query, params), but planned only once per connection.
+
+    The first call on a connection sends PREPARE; later calls send just
+    EXECUTE with the parameters, so the server neither parses nor
+    re-plans the text again (after five runs it may keep a generic plan).
+    `query` takes positional %s placeholders only. Pooled connections
+    stay open, so a statement is prepared once per pooled connection.
+    """
+    conn = cur.connection
+    names = _prepared.setdefault(conn, set())
+    name = 'ps_' + hashlib.sha1(query.encode()).hexdigest()[:16]
+    if name not in names:
+        register_prepared(name, query)
+        cur.execute(f"PREPARE {name} AS {_numbered(query)}")
+        names.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name}({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+_cursor_ids = itertools.count(1)
+
+
+def iter_query(conn, query, params=None, itersize=None):
+    """Yield the rows of `query` through a named (server-side) cursor.
+
+    Rows are fetched `itersize` at a time instead of being materialized
+    all at once by fetchall(). Named cursors only live inside a
+    transaction: on an autocommit connection one is opened for the read
+    and rolled back afterwards; inside the caller's transaction the
+    cursor simply joins it, and the transaction is left as it was.
+    """
+    was_autocommit = conn.autocommit
+    if was_autocommit:
+        conn.autocommit = False
+    try:
+        with conn.cursor(name=f"stream_{next(_cursor_ids)}") as cur:
+            cur.itersize = itersize or fetch_itersize
+            cur.execute(query, params)
+            yield from cur
+    finally:
+        if was_autocommit:
+            conn.rollback()
+            conn.autocommit = True
+
+
+_pool = None
+_replicas = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                pool_min_size,
+                pool_max_size,
+                timeout=pool_timeout,
+                health_check_interval=pool_health_check_interval,
+                retries=connect_retries,
+                backoff=connect_backoff,
+                host=host,
+                user=user,
+                password=password,
+                database=db_name
+            )
+        return _pool
+
+
+def get_replicas():
+    """Return the process-wide ReplicaSet, or None without read_replicas."""
+    global _replicas
+    if not read_replicas:
+        return None
+    with _pool_lock:
+        if _replicas is None:
+            _replicas = ReplicaSet(read_replicas, replica_sticky_seconds, replica_retry_after,
+                                   host=host, user=user, password=password, database=db_name)
+        return _replicas
+
+
+def mark_write():
+    """Note that this process just wrote to the primary (see ReplicaSet)."""
+    replicas = get_replicas()
+    if replicas is not None:
+        replicas.mark_write()
+
+
+@contextmanager
+def read_connection(conn):
+    """Connection for a read-only query: a replica when one can serve it.
+
+    `conn` (a primary connection) is used instead when no replicas are
+    configured or reachable, shortly after a write, and while `conn` is
+    inside a transaction, whose own changes only the primary can see.
+    """
+    replicas = get_replicas()
+    if (replicas is None or replicas.sticky() or not conn.autocommit
+            or conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE):
+        yield conn
+        return
+    pool, replica = replicas.getconn()
+    if replica is None:
+        yield conn
+        return
+    try:
+        yield replica
+    finally:
+        pool.putconn(replica)
+
+
+def connection(timeout=None):
+    """Shortcut for `get_pool().connection()`."""
+    return get_pool().connection(timeout)
+
+
+def close_pool():
+    """Close the process-wide pool (and replica pools) if they were ever opened."""
+    global _pool, _replicas
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+        if _replicas is not None:
+            _replicas.closeall()
+            _replicas = None
+
+
+atexit.register(close_pool)
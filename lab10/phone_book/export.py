@@ -0,0 +1,60 @@
+"""Streaming export of the phone_book table to CSV or NDJSON files.
+
+Rows are produced by COPY ... TO STDOUT on the server and written to the
+output file as they arrive, so memory use stays flat no matter how many
+rows are exported. Files ending in .gz (or compress=True) are gzipped.
+"""
+import gzip
+import time
+
+FORMATS = ('csv', 'ndjson')
+
+CONTACTS = "SELECT user_id, user_name, phone_num FROM phone_book ORDER BY user_id"
+CONTACTS_MATCHING = """
+    SELECT user_id, user_name, phone_num FROM phone_book
+    WHERE user_name ILIKE '%%' || %(pattern)s || '%%' OR phone_num ILIKE '%%' || %(pattern)s || '%%'
+    ORDER BY user_id
+"""
+
+
+def _open_output(path, compress):
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def export_query(conn, query, params, path, fmt='csv', compress=None):
+    """Stream the rows of `query` into `path`; returns (rows, seconds).
+
+    csv    - header line plus one CSV line per row
+    ndjson - one JSON object per line, keyed by column name
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    if compress is None:
+        compress = path.endswith('.gz')
+
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        # COPY does not take bind parameters, so inline them safely first
+        query = cur.mogrify(query, params).decode()
+        if fmt == 'csv':
+            copy_sql = f"COPY ({query}) TO STDOUT WITH CSV HEADER"
+        else:
+            # One json column per row. CSV mode with control characters as
+            # quote and delimiter writes the JSON text through unescaped;
+            # row_to_json already escapes those characters itself.
+            copy_sql = (f"COPY (SELECT row_to_json(t) FROM ({query}) t) TO STDOUT "
+                        "WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')")
+        with _open_output(path, compress) as out:
+            cur.copy_expert(copy_sql, out)
+        rows = cur.rowcount
+
+    return rows, time.perf_counter() - started
+
+
+def export_contacts(conn, path, fmt='csv', pattern=None):
+    """Export every contact, or those whose name or phone contains `pattern`."""
+    if pattern:
+        return export_query(conn, CONTACTS_MATCHING, {'pattern': pattern}, path, fmt)
+    return export_query(conn, CONTACTS, None, path, fmt)
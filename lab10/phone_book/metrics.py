@@ -0,0 +1,278 @@
+"""Latency metrics and slow-query log for phone book statements.
+
+Connections from the pool (db.py) create InstrumentedCursor objects, so
+every execute(), CALL and COPY is timed without changes at the call
+sites. Statements are grouped by operation: which of the phone book's
+statements they are (search_name, update_phone, bulk_delete, ...) or
+else their first keyword (select, insert, copy, ...). Per operation we keep a latency
+histogram, the number of rows affected and the number of errors.
+
+Statements slower than `slow_query_ms` are appended to `slow_query_log`.
+With explain_slow enabled their plan is captured as well, by re-running
+them under EXPLAIN (ANALYZE, BUFFERS) in a transaction that is rolled
+back. On exit the counters are written to `metrics_file` in the
+Prometheus text format.
+"""
+import atexit
+import os
+import re
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions, extras, sql
+
+from config import slow_query_ms, slow_query_log, explain_slow_queries, metrics_file
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Operations of the statements phone_book.py runs, matched in this order
+STATEMENTS = [
+    (r'\bFROM phone_book WHERE user_name LIKE\b', 'search_name'),
+    (r'\bFROM phone_book WHERE phone_num LIKE\b', 'search_phone'),
+    (r'\bunnest\(', 'bulk_delete'),
+    (r'^\s*DELETE FROM phone_book WHERE user_name\b', 'delete_by_name'),
+    (r'^\s*DELETE FROM phone_book WHERE phone_digits\b', 'delete_by_phone'),
+    (r'^\s*UPDATE phone_book SET user_name\b', 'update_name'),
+    (r'^\s*UPDATE phone_book SET phone_num\b', 'update_phone'),
+]
+_STATEMENT_RES = [(re.compile(pattern, re.IGNORECASE), label) for pattern, label in STATEMENTS]
+_KEYWORD_RE = re.compile(r'\s*(\w+)')
+# Whitespace and comments in front of the first keyword, as migrations have
+_LEADING_RE = re.compile(r'(?:\s+|--[^\n]*|/\*.*?\*/)*', re.DOTALL)
+# Statements that can be re-run under EXPLAIN ANALYZE and rolled back
+_EXPLAINABLE = ('select', 'insert', 'update', 'delete', 'with', 'execute')
+
+explain_slow = explain_slow_queries
+
+# Operation of each prepared statement (db.execute_prepared), by name
+_prepared = {}
+_EXECUTE_RE = re.compile(r'\s*EXECUTE\s+(\w+)', re.IGNORECASE)
+
+
+class _Operation:
+    __slots__ = ('buckets', 'count', 'total', 'max', 'rows', 'errors', 'slow')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)    # the last one is +Inf
+        self.count = self.rows = self.errors = self.slow = 0
+        self.total = self.max = 0.0
+
+
+_operations = {}
+_lock = threading.Lock()
+
+
+def _text(query, context=None):
+    """The statement as a str; sql.Composable ones are rendered with `context`."""
+    if isinstance(query, bytes):
+        return query.decode('utf-8', 'replace')
+    if isinstance(query, sql.Composable):
+        try:
+            return query.as_string(context)
+        except (psycopg2.Error, TypeError):
+            # No usable connection or cursor: the SQL parts still name the statement
+            return _skeleton(query)
+    return query if isinstance(query, str) else str(query)
+
+
+def _skeleton(query):
+    if isinstance(query, sql.Composed):
+        return ''.join(_skeleton(part) for part in query.seq)
+    return query.string if isinstance(query, sql.SQL) else '?'
+
+
+def _statement(text):
+    """`text` from its first keyword on, without the comments in front of it."""
+    return text[_LEADING_RE.match(text).end():]
+
+
+def _keyword(query, context=None):
+    match = _KEYWORD_RE.match(_statement(_text(query, context)))
+    return match.group(1).lower() if match else 'other'
+
+
+def operation_of(query, context=None):
+    """The operation label for a statement; `context` renders sql.Composable ones."""
+    text = _statement(_text(query, context))
+    keyword = _keyword(text)
+    if keyword == 'prepare':
+        return keyword      # planning, kept apart from the executions
+    if keyword == 'execute':
+        match = _EXECUTE_RE.match(text)
+        return _prepared.get(match.group(1), keyword) if match else keyword
+    for pattern, label in _STATEMENT_RES:
+        if pattern.search(text):
+            return label
+    return keyword
+
+
+def register_prepared(name, query):
+    """Label EXECUTEs of prepared statement `name` like `query` itself."""
+    _prepared[name] = operation_of(query)
+
+
+def record(operation, seconds, rows=0, error=False):
+    """Add one statement to the metrics of `operation`."""
+    with _lock:
+        op = _operations.get(operation)
+        if op is None:
+            op = _operations[operation] = _Operation()
+        index = 0
+        while index < len(BUCKETS) and seconds > BUCKETS[index]:
+            index += 1
+        op.buckets[index] += 1
+        op.count += 1
+        op.total += seconds
+        op.max = max(op.max, seconds)
+        if rows > 0:
+            op.rows += rows
+        if error:
+            op.errors += 1
+        if seconds * 1000 >= slow_query_ms:
+            op.slow += 1
+
+
+def _estimate(op, pct):
+    """Bucket upper bound that covers `pct` percent of the calls."""
+    wanted = op.count * pct / 100
+    seen = 0
+    for bound, count in zip(BUCKETS, op.buckets):
+        seen += count
+        if seen >= wanted:
+            return min(bound, op.max)
+    return op.max
+
+
+def summary():
+    """Per-operation dicts with calls, errors, rows and latencies in ms."""
+    with _lock:
+        return {
+            name: {
+                'calls': op.count,
+                'errors': op.errors,
+                'rows': op.rows,
+                'slow': op.slow,
+                'avg_ms': round(op.total / op.count * 1000, 3) if op.count else 0.0,
+                'p50_ms': round(_estimate(op, 50) * 1000, 3),
+                'p99_ms': round(_estimate(op, 99) * 1000, 3),
+                'max_ms': round(op.max * 1000, 3)
+            }
+            for name, op in sorted(_operations.items())
+        }
+
+
+def format_summary():
+    """The summary as a text table."""
+    lines = [f"{'Operation':<12}{'Calls':>8}{'Errors':>8}{'Rows':>10}{'Slow':>6}"
+             f"{'Avg ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'Max ms':>10}"]
+    for name, s in summary().items():
+        lines.append(f"{name:<12}{s['calls']:>8}{s['errors']:>8}{s['rows']:>10}{s['slow']:>6}"
+                     f"{s['avg_ms']:>10.2f}{s['p50_ms']:>10.2f}{s['p99_ms']:>10.2f}"
+                     f"{s['max_ms']:>10.2f}")
+    return '\n'.join(lines)
+
+
+def write_prometheus(path=metrics_file):
+    """Write all metrics to `path` in the Prometheus text exposition format."""
+    prefix = 'phone_book_query'
+    with _lock:
+        ops = sorted(_operations.items())
+        lines = [f"# HELP {prefix}_duration_seconds Statement latency by operation.",
+                 f"# TYPE {prefix}_duration_seconds histogram"]
+        for name, op in ops:
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), op.buckets):
+                cumulative += count
+                lines.append(f'{prefix}_duration_seconds_bucket{{operation="{name}",le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'{prefix}_duration_seconds_sum{{operation="{name}"}} {op.total:.6f}')
+            lines.append(f'{prefix}_duration_seconds_count{{operation="{name}"}} {op.count}')
+        for metric, attr, help_text in (
+            ('rows_total', 'rows', 'Rows returned or affected by operation.'),
+            ('errors_total', 'errors', 'Failed statements by operation.'),
+            ('slow_total', 'slow', f'Statements slower than {slow_query_ms} ms by operation.'),
+        ):
+            lines.append(f"# HELP {prefix}_{metric} {help_text}")
+            lines.append(f"# TYPE {prefix}_{metric} counter")
+            for name, op in ops:
+                lines.append(f'{prefix}_{metric}{{operation="{name}"}} {getattr(op, attr)}')
+
+    # Written next to the target and renamed, so a scraper never sees half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
+
+
+def _explain(conn, query, params):
+    """EXPLAIN (ANALYZE, BUFFERS) `query` and roll back whatever it changed."""
+    with conn.cursor(cursor_factory=extensions.cursor) as cur:
+        if conn.autocommit:
+            cur.execute("BEGIN")
+            end = "ROLLBACK"
+        else:
+            cur.execute("SAVEPOINT explain_slow_query")
+            end = "ROLLBACK TO SAVEPOINT explain_slow_query"
+        try:
+            cur.execute(b"EXPLAIN (ANALYZE, BUFFERS) " + cur.mogrify(query, params))
+            return '\n'.join(row[0] for row in cur.fetchall())
+        finally:
+            cur.execute(end)
+
+
+def _log_slow(cursor, operation, seconds, query, params):
+    text = _text(cursor.query if cursor.query is not None else query, cursor)
+    entry = (f"{time.strftime('%Y-%m-%d %H:%M:%S')} {operation} {seconds * 1000:.1f} ms "
+             f"rows={cursor.rowcount}: {' '.join(text.split())[:2000]}\n")
+
+    if explain_slow and _keyword(query, cursor) in _EXPLAINABLE:
+        try:
+            entry += _explain(cursor.connection, query, params) + '\n'
+        except Exception as e:
+            entry += f"(EXPLAIN failed: {e})\n"
+    with _lock, open(slow_query_log, 'a') as f:
+        f.write(entry)
+
+
+class _Timed:
+    """Mixin that times execute() and copy_expert() on a cursor class."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            self._record(query, vars, time.perf_counter() - started, failed)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().copy_expert(sql, file, size)
+            failed = False
+            return result
+        finally:
+            self._record(sql, None, time.perf_counter() - started, failed)
+
+    def _record(self, query, params, seconds, failed):
+        operation = operation_of(query, self)
+        # Named cursors only DECLARE here; their rows arrive with each fetch
+        record(operation, seconds, 0 if failed else self.rowcount, failed)
+        if not failed and seconds * 1000 >= slow_query_ms:
+            _log_slow(self, operation, seconds, query, params)
+
+
+class InstrumentedCursor(_Timed, extensions.cursor):
+    """Default cursor for pooled connections."""
+
+
+class InstrumentedDictCursor(_Timed, extras.DictCursor):
+    """DictCursor with the same timing."""
+
+
+atexit.register(lambda: _operations and write_prometheus())
@@ -0,0 +1,160 @@
+"""Versioned schema migrations for the phone book.
+
+Migrations are the numbered files in `migrations/` (001_phone_book.sql,
+002_...); each one runs once, in order, and is never edited afterwards.
+Files passed as `repeatable` are re-run whenever their contents change
+instead; this phone book has none. What has been applied, with a checksum
+of each file, is recorded in the schema_migrations table, so a start-up
+against a current schema costs a single query.
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # list applied and pending migrations
+"""
+import argparse
+import hashlib
+import os
+import time
+
+from db import get_pool, close_pool, transaction
+
+MIGRATIONS_DIR = 'migrations'
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version      TEXT PRIMARY KEY,
+        checksum     TEXT NOT NULL,
+        applied_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+        execution_ms INT NOT NULL
+    )
+"""
+
+RECORD = """
+    INSERT INTO schema_migrations(version, checksum, execution_ms)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (version) DO UPDATE
+    SET checksum = EXCLUDED.checksum, applied_at = now(), execution_ms = EXCLUDED.execution_ms
+"""
+
+
+class MigrationError(Exception):
+    """Raised when an applied versioned migration was changed afterwards."""
+
+
+def _checksum(path):
+    with open(path, 'rb') as f:
+        # Line endings depend on the checkout, not on the migration
+        return hashlib.sha256(f.read().replace(b'\r\n', b'\n')).hexdigest()
+
+
+def load_migrations(directory=MIGRATIONS_DIR, repeatable=()):
+    """Return [(version, path, checksum, is_repeatable)] in the order they run."""
+    versioned = sorted(name for name in os.listdir(directory)
+                       if name.endswith('.sql') and name[:1].isdigit())
+    migrations = [(os.path.splitext(name)[0], os.path.join(directory, name), False)
+                  for name in versioned]
+    migrations += [(path, path, True) for path in repeatable]
+    return [(version, path, _checksum(path), is_repeatable)
+            for version, path, is_repeatable in migrations]
+
+
+def applied_migrations(conn):
+    """Return {version: checksum} for the current schema ({} before the first run)."""
+    with conn.cursor() as cur:
+        # Look only in current_schema(): with search_path "bench, public" a
+        # table in public must not count as this schema's history
+        cur.execute("""
+            SELECT 1 FROM pg_tables
+            WHERE schemaname = current_schema() AND tablename = 'schema_migrations'
+        """)
+        if cur.fetchone() is None:
+            return {}
+        cur.execute("SELECT version, checksum FROM schema_migrations")
+        return dict(cur.fetchall())
+
+
+def _pending(migrations, applied):
+    pending = []
+    for version, path, checksum, is_repeatable in migrations:
+        recorded = applied.get(version)
+        if recorded == checksum:
+            continue
+        if recorded is not None and not is_repeatable:
+            raise MigrationError(f"Migration {version} was changed after it was applied; "
+                                 f"add a new migration instead of editing {path}")
+        pending.append((version, path, checksum))
+    return pending
+
+
+def migrate(conn, directory=MIGRATIONS_DIR, repeatable=()):
+    """Apply pending migrations; returns the versions that were applied.
+
+    Each migration runs in its own transaction together with its
+    schema_migrations row. A session advisory lock keeps two processes
+    starting at once from applying the same migration twice.
+    """
+    migrations = load_migrations(directory, repeatable)
+    if not _pending(migrations, applied_migrations(conn)):
+        return []
+
+    was_autocommit = conn.autocommit
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(hashtext('schema_migrations.' || current_schema()))")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(CREATE_TABLE)
+        # Another process may have migrated while we waited for the lock
+        pending = _pending(migrations, applied_migrations(conn))
+
+        done = []
+        for version, path, checksum in pending:
+            with open(path, 'r') as f:
+                sql = f.read()
+            started = time.perf_counter()
+            with transaction(conn), conn.cursor() as cur:
+                cur.execute(sql)
+                cur.execute(RECORD, (version, checksum,
+                                     round((time.perf_counter() - started) * 1000)))
+            done.append(version)
+        return done
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(hashtext('schema_migrations.' || current_schema()))")
+        conn.autocommit = was_autocommit
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply phone book schema migrations.")
+    parser.add_argument('--status', action='store_true', help='only list migrations')
+    parser.add_argument('--dir', default=MIGRATIONS_DIR)
+    parser.add_argument('--repeatable', nargs='*', default=[],
+                        help='files re-run when they change (default: none)')
+    args = parser.parse_args()
+
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        if args.status:
+            applied = applied_migrations(conn)
+            for version, _, checksum, _ in load_migrations(args.dir, args.repeatable):
+                recorded = applied.get(version)
+                state = ('pending' if recorded is None
+                         else 'applied' if recorded == checksum else 'changed')
+                print(f"{state:8} {version}")
+        else:
+            started = time.perf_counter()
+            done = migrate(conn, args.dir, args.repeatable)
+            for version in done:
+                print(f"[OK] Applied {version}")
+            print(f"[OK] Schema is up to date ({(time.perf_counter() - started) * 1000:.0f} ms).")
+    except MigrationError as e:
+        print(f"[ERROR] {e}")
+        return 1
+    finally:
+        pool.putconn(conn)
+        close_pool()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,11 @@
+-- Migration 001: the phone_book table and its lookup indexes.
+-- Idempotent, so databases created by the old create_table() take it as a no-op.
+
+CREATE TABLE IF NOT EXISTS phone_book (
+    user_id SERIAL PRIMARY KEY,
+    user_name VARCHAR(150) NOT NULL,
+    phone_num VARCHAR(15) NOT NULL
+);
+
+-- Exact-match lookups used by the update and delete operations
+CREATE INDEX IF NOT EXISTS phone_book_user_name_idx ON phone_book (user_name);
@@ -0,0 +1,11 @@
+-- Migration 002: digits-only phone column for exact phone lookups
+
+-- Filled in by the server on every write, so "+1-555-123-4567" and
+-- "15551234567" are the same number
+ALTER TABLE phone_book ADD COLUMN IF NOT EXISTS phone_digits TEXT
+    GENERATED ALWAYS AS (regexp_replace(phone_num, '[^0-9]', '', 'g')) STORED;
+
+CREATE INDEX IF NOT EXISTS phone_book_phone_digits_idx ON phone_book (phone_digits);
+
+-- Update and delete by phone match on phone_digits now
+DROP INDEX IF EXISTS phone_book_phone_num_idx;
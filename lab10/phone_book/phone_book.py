@@ -1,35 +1,63 @@
-import psycopg2
-from config import host, user, password, db_name
+from db import get_pool, close_pool, iter_query, read_connection, mark_write, execute_prepared
+from csv_import import import_csv, MERGE_APPEND_NEW
+from export import export_contacts as export_to_file
+from migrate import migrate
+import metrics
+from config import metrics_file
+
+
+# The statements below run through execute_prepared: parsed and planned
+# once per pooled connection, not on every call.
+
+# Matches a stored phone_digits value; NULL (no match) when the input has no digits
+PHONE_DIGITS = "NULLIF(regexp_replace(%s, '[^0-9]', '', 'g'), '')"
+
+# Deletes every key in an array with one join. One row per distinct value,
+# in input order, with the rows it deleted; values that map to the same key
+# (two spellings of a number) are counted once, for the first of them.
+DELETE_MANY = """
+    WITH keys AS (
+        SELECT k.value, {key} AS key, min(k.ord) AS ord
+        FROM unnest(%s::TEXT[]) WITH ORDINALITY AS k(value, ord)
+        GROUP BY k.value
+    ),
+    deleted AS (
+        DELETE FROM phone_book pb
+        USING (SELECT DISTINCT key FROM keys) d
+        WHERE pb.{column} = d.key
+        RETURNING d.key
+    ),
+    counts AS (
+        SELECT key, count(*) AS n FROM deleted GROUP BY key
+    )
+    SELECT keys.value,
+           CASE WHEN keys.ord = min(keys.ord) OVER (PARTITION BY keys.key)
+                THEN coalesce(counts.n, 0) ELSE 0 END
+    FROM keys LEFT JOIN counts ON counts.key = keys.key
+    ORDER BY keys.ord
+"""
 
 
 def connect_db():
-    """Establish and return a PostgreSQL connection."""
+    """Check out a PostgreSQL connection from the shared pool."""
     try:
-        conn = psycopg2.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=db_name
-        )
-        conn.autocommit = True
-        return conn
+        return get_pool().getconn()
     except Exception as e:
         print(f"[ERROR] Database connection failed: {e}")
         exit(1)
 
 
+def release_db(conn):
+    """Hand the connection back to the pool and shut the pool down."""
+    get_pool().putconn(conn)
+    close_pool()
+
+
 def create_table(conn):
-    """Create the phone_book table if it doesn't exist."""
-    sql = """
-        CREATE TABLE IF NOT EXISTS phone_book (
-            user_id SERIAL PRIMARY KEY,
-            user_name VARCHAR(150) NOT NULL,
-            phone_num VARCHAR(15) NOT NULL
-        )
-    """
+    """Create or upgrade the phone_book table by applying pending migrations."""
     try:
-        with conn.cursor() as cur:
-            cur.execute(sql)
+        for version in migrate(conn):
+            print(f"[OK] Applied migration {version}.")
         print("[OK] Table `phone_book` is ready.")
     except Exception as e:
         print(f"[ERROR] Failed to create table: {e}")
@@ -57,6 +85,21 @@ def insert_from_csv(conn):
         print(f"[ERROR] CSV import failed: {e}")
 
 
+def import_csv_validated(conn):
+    """Stream a large CSV file through a staging table with validation."""
+    path = input("Enter path to CSV file: ")
+    try:
+        result = import_csv(conn, path, merge_sql=MERGE_APPEND_NEW)
+        rate = result['rows'] / result['seconds'] if result['seconds'] else 0
+        print(f"[OK] Imported {path}: {result['rows']} rows read, {result['merged']} new, "
+              f"{result['rejected']} rejected in {result['seconds']:.1f}s ({rate:,.0f} rows/s).")
+        if result['rejected']:
+            print(f"[INFO] Rejected rows were written to {result['reject_path']}.")
+    except FileNotFoundError:
+        print(f"[ERROR] File {path} not found. Please check the file path.")
+    except Exception as e:
+        print(f"[ERROR] CSV import failed: {e}")
+
 def insert_from_console(conn):
     """Insert a single user from console input."""
     try:
@@ -70,7 +113,7 @@ def insert_from_console(conn):
             
         sql = "INSERT INTO phone_book(user_name, phone_num) VALUES (%s, %s)"
         with conn.cursor() as cur:
-            cur.execute(sql, (name, phone))
+            execute_prepared(cur, sql, (name, phone))
         print(f"[OK] Added {name} -> {phone}.")
     except Exception as e:
         print(f"[ERROR] Insert failed: {e}")
@@ -84,18 +127,14 @@ def update_name_by_phone(conn):
         phone = input("Enter phone number to find user: ")
         new_name = input("Enter new user name: ")
         
-        # Check if the phone exists
-        check_sql = "SELECT COUNT(*) FROM phone_book WHERE phone_num = %s"
-        with conn.cursor() as cur:
-            cur.execute(check_sql, (phone,))
-            if cur.fetchone()[0] == 0:
-                print(f"[ERROR] No user found with phone number {phone}.")
-                return
-                
-        sql = "UPDATE phone_book SET user_name = %s WHERE phone_num = %s"
+        sql = f"UPDATE phone_book SET user_name = %s WHERE phone_digits = {PHONE_DIGITS}"
         with conn.cursor() as cur:
-            cur.execute(sql, (new_name, phone))
+            execute_prepared(cur, sql, (new_name, phone))
             rows_updated = cur.rowcount
+            
+        if rows_updated == 0:
+            print(f"[ERROR] No user found with phone number {phone}.")
+            return
         print(f"[OK] Updated {rows_updated} record(s). Name for phone '{phone}' is now '{new_name}'.")
     except Exception as e:
         print(f"[ERROR] Update failed: {e}")
@@ -107,18 +146,14 @@ def update_phone_by_name(conn):
         name = input("Enter user name to find: ")
         new_phone = input("Enter new phone number: ")
         
-        # Check if the name exists
-        check_sql = "SELECT COUNT(*) FROM phone_book WHERE user_name = %s"
-        with conn.cursor() as cur:
-            cur.execute(check_sql, (name,))
-            if cur.fetchone()[0] == 0:
-                print(f"[ERROR] No user found with name {name}.")
-                return
-                
         sql = "UPDATE phone_book SET phone_num = %s WHERE user_name = %s"
         with conn.cursor() as cur:
-            cur.execute(sql, (new_phone, name))
+            execute_prepared(cur, sql, (new_phone, name))
             rows_updated = cur.rowcount
+            
+        if rows_updated == 0:
+            print(f"[ERROR] No user found with name {name}.")
+            return
         print(f"[OK] Updated {rows_updated} record(s). Phone for '{name}' is now '{new_phone}'.")
     except Exception as e:
         print(f"[ERROR] Update failed: {e}")
@@ -132,17 +167,21 @@ def query_by_name_pattern(conn):
         pattern = input("Enter name pattern (use % as wildcard): ")
         sql = "SELECT user_id, user_name, phone_num FROM phone_book WHERE user_name LIKE %s ORDER BY user_id"
         
-        with conn.cursor() as cur:
-            cur.execute(sql, (pattern,))
-            rows = cur.fetchall()
-            
-        if rows:
-            print("\nResults:")
-            print("ID\tName\t\tPhone")
-            print("-" * 40)
+        # Rows are streamed from a server-side cursor (on a read replica
+        # if configured) and printed as they arrive
+        count = 0
+        with read_connection(conn) as reader:
+            rows = iter_query(reader, sql, (pattern,))
             for uid, name, phone in rows:
+                if count == 0:
+                    print("\nResults:")
+                    print("ID\tName\t\tPhone")
+                    print("-" * 40)
                 print(f"{uid}\t{name}\t\t{phone}")
-            print(f"\n[OK] {len(rows)} record(s) found.")
+                count += 1
+            
+        if count:
+            print(f"\n[OK] {count} record(s) found.")
         else:
             print("[INFO] No matching records found.")
     except Exception as e:
@@ -155,17 +194,21 @@ def query_by_phone_pattern(conn):
         pattern = input("Enter phone pattern (use % as wildcard): ")
         sql = "SELECT user_id, user_name, phone_num FROM phone_book WHERE phone_num LIKE %s ORDER BY user_id"
         
-        with conn.cursor() as cur:
-            cur.execute(sql, (pattern,))
-            rows = cur.fetchall()
-            
-        if rows:
-            print("\nResults:")
-            print("ID\tName\t\tPhone")
-            print("-" * 40)
+        # Rows are streamed from a server-side cursor (on a read replica
+        # if configured) and printed as they arrive
+        count = 0
+        with read_connection(conn) as reader:
+            rows = iter_query(reader, sql, (pattern,))
             for uid, name, phone in rows:
+                if count == 0:
+                    print("\nResults:")
+                    print("ID\tName\t\tPhone")
+                    print("-" * 40)
                 print(f"{uid}\t{name}\t\t{phone}")
-            print(f"\n[OK] {len(rows)} record(s) found.")
+                count += 1
+            
+        if count:
+            print(f"\n[OK] {count} record(s) found.")
         else:
             print("[INFO] No matching records found.")
     except Exception as e:
@@ -177,23 +220,45 @@ def query_all_records(conn):
     try:
         sql = "SELECT user_id, user_name, phone_num FROM phone_book ORDER BY user_id"
         
-        with conn.cursor() as cur:
-            cur.execute(sql)
-            rows = cur.fetchall()
-            
-        if rows:
-            print("\nAll Phone Book Records:")
-            print("ID\tName\t\tPhone")
-            print("-" * 40)
+        # Rows are streamed from a server-side cursor (on a read replica
+        # if configured) and printed as they arrive
+        count = 0
+        with read_connection(conn) as reader:
+            rows = iter_query(reader, sql)
             for uid, name, phone in rows:
+                if count == 0:
+                    print("\nAll Phone Book Records:")
+                    print("ID\tName\t\tPhone")
+                    print("-" * 40)
                 print(f"{uid}\t{name}\t\t{phone}")
-            print(f"\n[OK] Total {len(rows)} record(s).")
+                count += 1
+            
+        if count:
+            print(f"\n[OK] Total {count} record(s).")
         else:
             print("[INFO] Phone book is empty.")
     except Exception as e:
         print(f"[ERROR] Query failed: {e}")
 
 
+# --- EXPORT OPERATIONS ---
+
+def export_contacts(conn):
+    """Stream contacts, optionally filtered by a pattern, to a CSV or NDJSON file."""
+    try:
+        path = input("Enter output file path (end with .gz to compress): ")
+        fmt = input("Format (csv/ndjson, default: csv): ").lower() or 'csv'
+        pattern = input("Filter pattern (leave empty to export everything): ")
+        
+        with read_connection(conn) as reader:
+            rows, seconds = export_to_file(reader, path, fmt, pattern)
+        print(f"[OK] Exported {rows} record(s) to {path} in {seconds:.1f}s.")
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+    except Exception as e:
+        print(f"[ERROR] Export failed: {e}")
+
+
 # --- DELETE OPERATIONS ---
 
 def delete_by_name(conn):
@@ -201,18 +266,14 @@ def delete_by_name(conn):
     try:
         name = input("Enter user name to delete: ")
         
-        # Check if the name exists
-        check_sql = "SELECT COUNT(*) FROM phone_book WHERE user_name = %s"
-        with conn.cursor() as cur:
-            cur.execute(check_sql, (name,))
-            if cur.fetchone()[0] == 0:
-                print(f"[ERROR] No user found with name {name}.")
-                return
-                
         sql = "DELETE FROM phone_book WHERE user_name = %s"
         with conn.cursor() as cur:
-            cur.execute(sql, (name,))
+            execute_prepared(cur, sql, (name,))
             rows_deleted = cur.rowcount
+            
+        if rows_deleted == 0:
+            print(f"[ERROR] No user found with name {name}.")
+            return
         print(f"[OK] Deleted {rows_deleted} record(s) with name '{name}'.")
     except Exception as e:
         print(f"[ERROR] Delete failed: {e}")
@@ -223,23 +284,58 @@ def delete_by_phone(conn):
     try:
         phone = input("Enter phone number to delete: ")
         
-        # Check if the phone exists
-        check_sql = "SELECT COUNT(*) FROM phone_book WHERE phone_num = %s"
+        sql = f"DELETE FROM phone_book WHERE phone_digits = {PHONE_DIGITS}"
         with conn.cursor() as cur:
-            cur.execute(check_sql, (phone,))
-            if cur.fetchone()[0] == 0:
-                print(f"[ERROR] No user found with phone number {phone}.")
-                return
-                
-        sql = "DELETE FROM phone_book WHERE phone_num = %s"
-        with conn.cursor() as cur:
-            cur.execute(sql, (phone,))
+            execute_prepared(cur, sql, (phone,))
             rows_deleted = cur.rowcount
+            
+        if rows_deleted == 0:
+            print(f"[ERROR] No user found with phone number {phone}.")
+            return
         print(f"[OK] Deleted {rows_deleted} record(s) with phone number '{phone}'.")
     except Exception as e:
         print(f"[ERROR] Delete failed: {e}")
 
 
+def delete_many(conn):
+    """Delete every name or phone number listed in a file, one per line."""
+    try:
+        path = input("Enter file path (one value per line): ")
+        by_phone = input("Values are (1) names or (2) phone numbers? ") == '2'
+        with open(path, 'r') as f:
+            values = [line.rstrip('\r\n') for line in f if line.strip()]
+        
+        if by_phone:
+            sql = DELETE_MANY.format(key="NULLIF(regexp_replace(k.value, '[^0-9]', '', 'g'), '')",
+                                     column='phone_digits')
+        else:
+            sql = DELETE_MANY.format(key='k.value', column='user_name')
+        with conn.cursor() as cur:
+            execute_prepared(cur, sql, (values,))
+            counts = cur.fetchall()
+        
+        total = sum(deleted for _, deleted in counts)
+        missing = [value for value, deleted in counts if not deleted]
+        print(f"[OK] Deleted {total} record(s) for {len(counts)} value(s).")
+        if missing:
+            print(f"[INFO] {len(missing)} value(s) matched nothing, e.g. {', '.join(missing[:5])}")
+    except Exception as e:
+        print(f"[ERROR] Delete failed: {e}")
+
+
+# --- STATISTICS ---
+
+def show_query_stats(conn):
+    """Show statement latencies of this session and write the metrics file."""
+    try:
+        print("\nQuery statistics (this session):")
+        print(metrics.format_summary())
+        metrics.write_prometheus()
+        print(f"\n[OK] Metrics written to {metrics_file}.")
+    except Exception as e:
+        print(f"[ERROR] Failed to write metrics: {e}")
+
+
 def main():
     conn = None
     try:
@@ -260,13 +356,24 @@ def main():
             '5': (query_by_name_pattern, 'Search by name pattern'),
             '6': (query_by_phone_pattern, 'Search by phone pattern'),
             '7': (query_all_records, 'View all records'),
+            '11': (export_contacts, 'Export records to CSV/NDJSON file'),
             
             # Delete operations
             '8': (delete_by_name, 'Delete by user name'),
             '9': (delete_by_phone, 'Delete by phone number'),
+            '13': (delete_many, 'Delete names or phone numbers listed in a file'),
+            
+            # Streaming import with validation
+            '10': (import_csv_validated, 'Import large CSV file with validation'),
+            
+            # Statistics
+            '12': (show_query_stats, 'Show query statistics'),
             
             '0': (None, 'Exit')
         }
+        # Options that change the table; reads stay on the primary for a
+        # moment after them (see read_replicas in config.py)
+        writes = {'1', '2', '3', '4', '8', '9', '10', '13'}
 
         while True:
             print("\n" + "=" * 40)
@@ -277,6 +384,7 @@ def main():
             print("\nINSERT OPERATIONS:")
             print("1. Import from CSV file")
             print("2. Add single user from console")
+            print("10. Import large CSV file with validation")
             
             print("\nUPDATE OPERATIONS:")
             print("3. Update name by phone number")
@@ -286,10 +394,15 @@ def main():
             print("5. Search by name pattern")
             print("6. Search by phone pattern")
             print("7. View all records")
+            print("11. Export records to CSV/NDJSON file")
             
             print("\nDELETE OPERATIONS:")
             print("8. Delete by user name")
             print("9. Delete by phone number")
+            print("13. Delete names or phone numbers listed in a file")
+            
+            print("\nSTATISTICS:")
+            print("12. Show query statistics")
             
             print("\n0. Exit")
             
@@ -302,6 +415,8 @@ def main():
             action = menu.get(choice)
             if action:
                 action[0](conn)
+                if choice in writes:
+                    mark_write()
             else:
                 print("[ERROR] Invalid option.")
 
@@ -309,7 +424,7 @@ def main():
         print(f"[ERROR] {e}")
     finally:
         if conn:
-            conn.close()
+            release_db(conn)
             print("[INFO] Database connection closed.")
 
 
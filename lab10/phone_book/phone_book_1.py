@@ -1,5 +1,10 @@
 import psycopg2
-from config import host, user, password, db_name
+import psycopg2.extras
+from config import host, user, password, db_name, insert_batch_size
+from csv_import import import_csv, MERGE_APPEND_NEW
+from db import transaction
+from metrics import InstrumentedCursor
+from migrate import migrate
 
 
 def connect_db():
@@ -8,49 +13,76 @@ def connect_db():
         host=host,
         user=user,
         password=password,
-        database=db_name
+        database=db_name,
+        cursor_factory=InstrumentedCursor
     )
     conn.autocommit = True
     return conn
 
 
 def create_table(conn):
-    """Create the phone_book table if it doesn't exist."""
-    sql = (
-        """
-        CREATE TABLE IF NOT EXISTS phone_book (
-            user_id SERIAL PRIMARY KEY,
-            user_name VARCHAR(150) NOT NULL,
-            phone_num VARCHAR(15) NOT NULL
-        )
-        """
-    )
-    with conn.cursor() as cur:
-        cur.execute(sql)
+    """Create or upgrade the phone_book table (see migrations/)."""
+    migrate(conn)
     print("[OK] Table `phone_book` is ready.")
 
 
 def insert_from_csv(conn):
-    """Bulk-load data from a CSV file into the table."""
+    """Bulk-load data from a client-side CSV file into the table."""
     path = input("Enter path to CSV file: ")
-    sql = "COPY phone_book(user_name, phone_num) FROM %s DELIMITER ',' CSV HEADER"
-    with conn.cursor() as cur:
-        cur.execute(sql, (path,))
-    print(f"[OK] Imported data from {path}.")
+    result = import_csv(conn, path, merge_sql=MERGE_APPEND_NEW)
+    print(f"[OK] Imported data from {path}: {result['merged']} new, "
+          f"{result['rejected']} rejected (see {result['reject_path']}).")
+
+
+def insert_rows(conn, rows, page_size=insert_batch_size):
+    """Insert (line_no, name, phone) rows in one transaction.
+
+    Each page of `page_size` rows is one multi-row INSERT. If a page
+    fails, its rows are retried one by one under savepoints so a single
+    bad row is reported instead of losing the whole batch.
+    Returns (inserted, [(line_no, error), ...]).
+    """
+    sql = "INSERT INTO phone_book(user_name, phone_num) VALUES %s"
+    inserted, errors = 0, []
+    with transaction(conn), conn.cursor() as cur:
+        for start in range(0, len(rows), page_size):
+            page = rows[start:start + page_size]
+            try:
+                with transaction(conn):   # savepoint
+                    psycopg2.extras.execute_values(
+                        cur, sql, [(name, phone) for _, name, phone in page], page_size=page_size
+                    )
+                inserted += len(page)
+                continue
+            except psycopg2.Error:
+                pass
+
+            for line_no, name, phone in page:
+                try:
+                    with transaction(conn):
+                        cur.execute(sql, ((name, phone),))
+                    inserted += 1
+                except psycopg2.Error as e:
+                    errors.append((line_no, str(e).strip()))
+    return inserted, errors
 
 
 def insert_multiple_console(conn):
-    """Insert multiple users from console input."""
+    """Insert multiple users from console input in batched INSERTs."""
     n = int(input("How many users to add? "))
     print("Enter USER NAME and PHONE NUMBER separated by space:")
-    with conn.cursor() as cur:
-        for _ in range(n):
-            name, phone = input().split()
-            cur.execute(
-                "INSERT INTO phone_book(user_name, phone_num) VALUES (%s, %s)",
-                (name, phone)
-            )
-    print("[OK] Batch insert complete.")
+    rows, errors = [], []
+    for line_no in range(1, n + 1):
+        parts = input().split()
+        if len(parts) != 2:
+            errors.append((line_no, f"expected NAME PHONE, got {' '.join(parts)!r}"))
+            continue
+        rows.append((line_no, parts[0], parts[1]))
+
+    inserted, failed = insert_rows(conn, rows)
+    for line_no, error in sorted(errors + failed):
+        print(f"[WARN] Line {line_no} skipped: {error}")
+    print(f"[OK] Batch insert complete: {inserted} added, {len(errors) + len(failed)} skipped.")
 
 
 def update_phone_by_name(conn):
@@ -67,7 +99,9 @@ def update_name_by_phone(conn):
     """Update user name for a given phone number."""
     phone = input("Enter current phone number: ")
     new_name = input("Enter new user name: ")
-    sql = "UPDATE phone_book SET user_name = %s WHERE phone_num = %s"
+    # Compare digits only, so any spelling of the number finds the row
+    sql = ("UPDATE phone_book SET user_name = %s "
+           "WHERE phone_digits = NULLIF(regexp_replace(%s, '[^0-9]', '', 'g'), '')")
     with conn.cursor() as cur:
         cur.execute(sql, (new_name, phone))
     print(f"[OK] Name for phone '{phone}' updated.")
@@ -0,0 +1,45 @@
+import glob
+
+import psycopg2
+import pytest
+from psycopg2 import sql
+
+import metrics
+from config import host, user, password, db_name
+
+
+@pytest.fixture
+def conn():
+    try:
+        conn = psycopg2.connect(host=host, user=user, password=password, database=db_name)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"no database: {e}")
+    yield conn
+    conn.close()
+
+
+def test_leading_comments_are_skipped():
+    assert metrics.operation_of("-- Migration 003\nCREATE INDEX i ON phone_book (c)") == 'create'
+    assert metrics.operation_of("/* by name */\nDELETE FROM phone_book WHERE user_name = %s") \
+        == 'delete_by_name'
+    assert metrics.operation_of("-- nothing but a comment") == 'other'
+
+
+def test_migrations_are_labelled_by_their_first_statement():
+    for path in sorted(glob.glob('migrations/*.sql')):
+        with open(path) as f:
+            assert metrics.operation_of(f.read()) in ('create', 'alter'), path
+
+
+def test_composed_is_rendered_with_the_connection(conn):
+    query = sql.SQL("SELECT * FROM phone_book WHERE user_name LIKE {}").format(sql.Literal('A%'))
+    assert metrics.operation_of(query, conn) == 'search_name'
+    copy = sql.SQL("COPY {} (line_no, user_name, phone_num) FROM STDIN WITH CSV").format(
+        sql.Identifier('phone_book_staging'))
+    with conn.cursor() as cur:
+        assert metrics.operation_of(copy, cur) == 'copy'
+
+
+def test_composed_without_a_connection_uses_its_sql_parts():
+    query = sql.SQL("DROP TABLE {}").format(sql.Identifier('phone_book_staging'))
+    assert metrics.operation_of(query) == 'drop'
@@ -2,3 +2,11 @@ host = '127.0.0.1'
 user ='postgres'
 password = '825819237'
 db_name = 'lab_10_score_in_snake'
+
+# connection pool
+pool_min_size = 1
+pool_max_size = 4
+pool_timeout = 5.0
+pool_health_check_interval = 30.0
+connect_retries = 5
+connect_backoff = 0.2
@@ -0,0 +1,194 @@
+import atexit
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from config import (host, user, password, db_name,
+                    pool_min_size, pool_max_size, pool_timeout,
+                    pool_health_check_interval, connect_retries, connect_backoff)
+
+
+class PoolError(Exception):
+    """Raised when the pool cannot hand out a connection."""
+
+
+class PoolTimeout(PoolError):
+    """Raised when no connection became free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """A small thread-safe pool of PostgreSQL connections.
+
+    Keeps between `minconn` and `maxconn` connections open, checks idle
+    connections before handing them out again and reconnects with
+    exponential backoff when the server is unreachable.
+    """
+
+    def __init__(self, minconn, maxconn, timeout=5.0, health_check_interval=30.0,
+                 retries=5, backoff=0.2, **dsn):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Pool sizes must satisfy 0 <= minconn <= maxconn, maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.dsn = dsn
+
+        self._idle = []       # [(conn, time it was returned)]
+        self._size = 0        # idle + checked out + being opened
+        self._closed = False
+        self._cond = threading.Condition()
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        """Open a new connection, retrying with exponential backoff."""
+        delay = self.backoff
+        for attempt in range(1, self.retries + 1):
+            try:
+                conn = psycopg2.connect(**self.dsn)
+                conn.autocommit = True
+                return conn
+            except psycopg2.OperationalError as e:
+                if attempt == self.retries:
+                    raise
+                print(f"[WARN] Connection attempt {attempt} failed: {e}".rstrip())
+                time.sleep(delay + random.uniform(0, delay / 2))
+                delay = min(delay * 2, 10.0)
+
+    def _is_healthy(self, conn):
+        """Cheap liveness probe for a connection that sat idle for a while."""
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting at most `timeout` seconds."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("Connection pool is closed")
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, idle_since = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No connection available after {timeout:.1f}s "
+                                      f"(max {self.maxconn} in use)")
+                self._cond.wait(remaining)
+
+        # Connecting and probing happen outside the lock so other threads
+        # are not blocked behind network round trips.
+        try:
+            if conn is not None:
+                stale = time.monotonic() - idle_since > self.health_check_interval
+                if conn.closed or (stale and not self._is_healthy(conn)):
+                    conn.close()
+                    conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool (or drop it if it is broken)."""
+        if not conn.closed and not close:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.autocommit = True
+            except psycopg2.Error:
+                close = True
+
+        with self._cond:
+            if self._closed or close or conn.closed or len(self._idle) >= self.maxconn:
+                if not conn.closed:
+                    conn.close()
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager that checks a connection out and back in."""
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        """Close every idle connection and refuse further checkouts."""
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                pool_min_size,
+                pool_max_size,
+                timeout=pool_timeout,
+                health_check_interval=pool_health_check_interval,
+                retries=connect_retries,
+                backoff=connect_backoff,
+                host=host,
+                user=user,
+                password=password,
+                database=db_name
+            )
+        return _pool
+
+
+def connection(timeout=None):
+    """Shortcut for `get_pool().connection()`."""
+    return get_pool().connection(timeout)
+
+
+def close_pool():
+    """Close the process-wide pool if it was ever opened."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+atexit.register(close_pool)
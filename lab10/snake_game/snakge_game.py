@@ -1,5 +1,5 @@
-import pygame, time, random, psycopg2
-from config import  host, user, password, db_name
+import pygame, time, random
+from db import get_pool
 
 pygame.init()
 
@@ -52,13 +52,7 @@ def get_user_info(user_name, score, level):
     connection = None
     cursor = None
     try:
-        connection = psycopg2.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=db_name
-        )
-        connection.autocommit = True
+        connection = get_pool().getconn()
 
         cursor = connection.cursor()
 
@@ -101,9 +95,10 @@ def get_user_info(user_name, score, level):
     except Exception as _ex:
         print("[INFO] Error working with PostgreSQL", _ex)
     finally:
-        if connection:
-            connection.close()
+        if cursor:
             cursor.close()
+        if connection:
+            get_pool().putconn(connection)
 
 def show_user_info(user_name, score, level):
         connection = None
@@ -112,13 +107,7 @@ def show_user_info(user_name, score, level):
         user_level = level
 
         try:
-            connection = psycopg2.connect(
-                host=host,
-                user=user,
-                password=password,
-                database=db_name
-            )
-            connection.autocommit = True
+            connection = get_pool().getconn()
 
             cursor = connection.cursor()
 
@@ -150,9 +139,10 @@ def show_user_info(user_name, score, level):
         except Exception as _ex:
             print("[INFO] Error while connecting to PostgreSql", _ex)
         finally:
-            if connection:
-                connection.close()
+            if cursor:
                 cursor.close()
+            if connection:
+                get_pool().putconn(connection)
 
         return user_score, user_level
 
@@ -0,0 +1,713 @@
+"""Latency benchmark for the phone book database functions.
+
+Seeds a scratch `bench` schema with synthetic contacts shaped like
+contacs.csv, applies the migrations and sql_functions.sql there and, for
+each table size, times:
+
+    search          find_contacts_by_pattern for a set of patterns, and
+                    search_contacts_ranked (top 10) for typos and digits
+    paginate        get_contacts_paginated at a shallow and a deep offset,
+                    and get_contacts_keyset at the same positions
+    upsert          upsert_user, half updates of existing names, half new
+    bulk_insert     bulk_insert_users with batches of --bulk-size contacts
+    delete          delete_contact by name and by phone
+    bulk delete     delete_contacts with --bulk-size phones per call
+    prepared        planning time of the hot reads, and their latency sent
+                    as text vs through db.execute_prepared
+    static sql      get_contacts_paginated and get_contacts_keyset against
+                    their former EXECUTE format() bodies, call for call
+
+The real phone_book table is never touched, the functions measured are
+the ones in the working copy, and the data is the same on every run, so
+reports can be compared (--compare prints p50 changes against an
+earlier report).
+
+With --partitions N the bench table is hash-partitioned first
+(partition_phone_book), so both layouts can be compared; each run then
+also records how many partitions exact lookups read.
+
+It also hammers upsert_user from many threads at once and checks that no
+user name ends up in the table twice, and compares committing every
+upsert on its own with group commit (db.GroupCommitter).
+
+With --csv-rows N it loads a generated CSV of N contacts with the plain
+COPY of the menu's CSV import, with csv_import.import_csv and with
+import_csv_parallel over --csv-workers connections, and reports rows/s.
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --rows 10000 1000000 --compare baseline.json
+    python benchmark.py --rows 10000 --threads 32 --upserts 500
+    python benchmark.py --partitions 16 --compare baseline.json
+    python benchmark.py --rows 10000 --upserts 0 --csv-rows 1000000 --csv-workers 4
+"""
+import argparse
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from config import host, user, password, db_name
+from contacts import partition_pruning
+from csv_import import import_csv, import_csv_parallel
+from db import ConnectionPool, GroupCommitter, connection, execute_prepared
+from migrate import migrate
+
+BENCH_SCHEMA = "bench"
+
+FIRST_NAMES = ['John', 'Alice', 'Bob', 'Maria', 'David', 'Sarah', 'Michael',
+               'Jennifer', 'Robert', 'Emily', 'James', 'Linda', 'William',
+               'Patricia', 'Richard', 'Barbara', 'Thomas', 'Susan']
+LAST_NAMES = ['Smith', 'Johnson', 'Brown', 'Garcia', 'Lee', 'Wilson', 'Chen',
+              'Lopez', 'Taylor', 'Davis', 'Miller', 'Moore', 'Anderson',
+              'Martin', 'Clark', 'Lewis', 'Walker', 'Young']
+
+SEARCH_PATTERNS = ['Garcia 12', 'ohn', 'Emily Davis 99', '555-12', '4567', 'zzzz']
+# Hot reads timed with and without a prepared statement
+PREPARED_QUERIES = [
+    ('search', "SELECT * FROM find_contacts_by_pattern(%s)", ('Garcia 12',)),
+    ('ranked_phone', "SELECT * FROM search_contacts_ranked(%s, %s)", ('1555', 10)),
+    ('page_offset', "SELECT * FROM get_contacts_paginated(%s, %s, %s, %s)", (20, 100, 'user_name', 'ASC')),
+    ('page_keyset', "SELECT * FROM get_contacts_keyset(%s, %s, %s, %s, %s)",
+     (20, 'user_id', 'ASC', None, 100)),
+]
+# The paging functions as they were before their static rewrite, to time
+# against the current ones. (The old offset paging did not break ties by
+# user_id; its pages are otherwise the same.)
+DYNAMIC_PAGING_FUNCTIONS = """
+    CREATE OR REPLACE FUNCTION get_contacts_paginated_dynamic(
+        p_limit INT, p_offset INT, p_sort_by TEXT, p_sort_order TEXT
+    )
+    RETURNS TABLE (user_id INT, user_name VARCHAR(150), phone_num VARCHAR(15), total_count BIGINT)
+    AS $$
+    DECLARE
+        v_count BIGINT;
+    BEGIN
+        SELECT COUNT(*) INTO v_count FROM phone_book;
+        IF p_sort_by NOT IN ('user_id', 'user_name', 'phone_num') THEN
+            p_sort_by := 'user_id';
+        END IF;
+        IF p_sort_order NOT IN ('ASC', 'DESC') THEN
+            p_sort_order := 'ASC';
+        END IF;
+        RETURN QUERY EXECUTE format('
+            SELECT pb.user_id, pb.user_name, pb.phone_num, %L::BIGINT as total_count
+            FROM phone_book pb
+            ORDER BY %I %s
+            LIMIT %L OFFSET %L',
+            v_count, p_sort_by, p_sort_order, p_limit, p_offset
+        );
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION get_contacts_keyset_dynamic(
+        p_limit INT, p_sort_by TEXT, p_sort_order TEXT, p_after_value TEXT, p_after_id INT
+    )
+    RETURNS TABLE (user_id INT, user_name VARCHAR(150), phone_num VARCHAR(15), total_count BIGINT)
+    AS $$
+    DECLARE
+        v_where TEXT := '';
+        v_cmp TEXT := CASE p_sort_order WHEN 'ASC' THEN '>' ELSE '<' END;
+        v_count BIGINT := estimate_contact_count();
+    BEGIN
+        IF p_after_id IS NOT NULL THEN
+            IF p_sort_by = 'user_id' THEN
+                v_where := format('WHERE pb.user_id %s $2', v_cmp);
+            ELSE
+                v_where := format('WHERE (pb.%I, pb.user_id) %s ($1, $2)', p_sort_by, v_cmp);
+            END IF;
+        END IF;
+        RETURN QUERY EXECUTE format('
+            SELECT pb.user_id, pb.user_name, pb.phone_num, $4 as total_count
+            FROM phone_book pb
+            %s
+            ORDER BY pb.%I %s, pb.user_id %s
+            LIMIT $3',
+            v_where, p_sort_by, p_sort_order, p_sort_order
+        ) USING p_after_value, p_after_id, p_limit, v_count;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+# Calls timed with both bodies: {suffix} is '' or '_dynamic'
+STATIC_SQL_CALLS = [
+    ('offset_user_name', "SELECT * FROM get_contacts_paginated{suffix}(%s, %s, %s, %s)",
+     (20, 100, 'user_name', 'ASC')),
+    ('offset_user_id_desc', "SELECT * FROM get_contacts_paginated{suffix}(%s, %s, %s, %s)",
+     (20, 100, 'user_id', 'DESC')),
+    ('keyset_user_id', "SELECT * FROM get_contacts_keyset{suffix}(%s, %s, %s, %s, %s)",
+     (20, 'user_id', 'ASC', None, 100)),
+]
+# Typos and digit prefixes for search_contacts_ranked
+RANKED_PATTERNS = ['Jhon Smtih', 'Emiyl Davis 99', 'Garcai', '1458', '+1 555']
+# The name branch of search_contacts_ranked, explained on its own (EXPLAIN
+# of the function call does not show the plan of its body)
+RANKED_NAME_QUERY = """
+    SELECT pb.user_id, pb.user_name, pb.phone_num, word_similarity($1, pb.user_name)
+    FROM phone_book pb
+    WHERE $1 <% pb.user_name
+    ORDER BY $1 <<-> pb.user_name, pb.user_id
+    LIMIT $2
+"""
+
+
+def prepare_schema(conn, partitions=0):
+    """(Re)create the scratch schema and point the session at it."""
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+        cur.execute(f"SET search_path = {BENCH_SCHEMA}, public")
+    # Recorded in bench.schema_migrations, away from the real history
+    migrate(conn, repeatable=['sql_functions.sql'])
+    if partitions:
+        with conn.cursor() as cur:
+            cur.execute("CALL partition_phone_book(%s)", (partitions,))
+
+
+def seeded_contact(i):
+    """Name and phone of row `i`, as generated by seed()."""
+    n = str(2000000000 + (i * 2654435761) % 7999999999)
+    name = (f"{FIRST_NAMES[i % len(FIRST_NAMES)]} "
+            f"{LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]} {i}")
+    return name, f"+1-{n[:3]}-{n[3:6]}-{n[6:10]}"
+
+
+def seed(conn, rows):
+    """Fill bench.phone_book with `rows` unique synthetic contacts."""
+    sql = """
+        INSERT INTO phone_book(user_name, phone_num)
+        SELECT (%(first)s::text[])[1 + i %% %(n_first)s] || ' '
+               || (%(last)s::text[])[1 + (i / %(n_first)s) %% %(n_last)s] || ' ' || i,
+               '+1-' || substr(n, 1, 3) || '-' || substr(n, 4, 3) || '-' || substr(n, 7, 4)
+        FROM generate_series(1, %(rows)s) AS i,
+             LATERAL (SELECT (2000000000 + (i * 2654435761) %% 7999999999)::text AS n) AS digits
+    """
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        # Seeding is not a change anyone follows: keep it out of the change
+        # log (and away from the cache listeners)
+        cur.execute("ALTER TABLE phone_book DISABLE TRIGGER USER")
+        cur.execute("TRUNCATE phone_book RESTART IDENTITY")
+        cur.execute(sql, {
+            'first': FIRST_NAMES, 'n_first': len(FIRST_NAMES),
+            'last': LAST_NAMES, 'n_last': len(LAST_NAMES),
+            'rows': rows
+        })
+        cur.execute("ALTER TABLE phone_book ENABLE TRIGGER USER")
+        cur.execute("TRUNCATE phone_book_changes")
+        cur.execute("ANALYZE phone_book")
+    return time.perf_counter() - started
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Turn raw latencies (seconds) into a millisecond summary."""
+    return {
+        'calls': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'max_ms': round(max(samples) * 1000, 3),
+        'throughput_per_s': round(len(samples) / sum(samples), 1) if sum(samples) else None
+    }
+
+
+def time_calls(cur, sql, params_list, repeat=1, prepared=False):
+    """Run `sql` once per params tuple, `repeat` times over, fetching all rows."""
+    samples = []
+    for _ in range(repeat):
+        for params in params_list:
+            started = time.perf_counter()
+            if prepared:
+                execute_prepared(cur, sql, params)
+            else:
+                cur.execute(sql, params)
+            if cur.description is not None:
+                cur.fetchall()
+            samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_search(conn, repeat):
+    """Time find_contacts_by_pattern and search_contacts_ranked for each sample pattern."""
+    results = {}
+    with conn.cursor() as cur:
+        for pattern in SEARCH_PATTERNS:
+            samples = time_calls(cur, "SELECT * FROM find_contacts_by_pattern(%s)",
+                                 [(pattern,)], repeat)
+            results[pattern] = summarize(samples)
+        for pattern in RANKED_PATTERNS:
+            samples = time_calls(cur, "SELECT * FROM search_contacts_ranked(%s, 10)",
+                                 [(pattern,)], repeat)
+            results[f"ranked: {pattern}"] = summarize(samples)
+            results[f"ranked: {pattern}"]['matches'] = cur.rowcount
+    return results
+
+
+def _index_names(plan):
+    names = {plan['Index Name']} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', ()):
+        names |= _index_names(child)
+    return names
+
+
+def ranked_name_indexes(conn, query='Garcai'):
+    """Indexes read by the name branch of search_contacts_ranked, as a generic plan."""
+    with conn.cursor() as cur:
+        cur.execute("SET pg_trgm.word_similarity_threshold = 0.3")
+        cur.execute("SET plan_cache_mode = force_generic_plan")
+        cur.execute(f"PREPARE ranked_name_check(TEXT, INT) AS {RANKED_NAME_QUERY}")
+        try:
+            cur.execute("EXPLAIN (FORMAT JSON) EXECUTE ranked_name_check(%s, 10)", (query,))
+            return sorted(_index_names(cur.fetchone()[0][0]['Plan']))
+        finally:
+            cur.execute("DEALLOCATE ranked_name_check")
+            cur.execute("RESET plan_cache_mode")
+            cur.execute("RESET pg_trgm.word_similarity_threshold")
+
+
+def bench_prepared(conn, repeat):
+    """Planning time of the hot reads, and their p50 sent as text vs prepared.
+
+    planning_ms is the planning of the statement the client sends (what a
+    prepared statement saves); it does not include the statements inside
+    a PL/pgSQL body, which bench_static_sql measures.
+    """
+    results = {}
+    with conn.cursor() as cur:
+        for name, sql, params in PREPARED_QUERIES:
+            cur.execute(b"EXPLAIN (SUMMARY) " + cur.mogrify(sql, params))
+            planning_ms = next(float(line.split(':')[1].split()[0])
+                               for line, in cur.fetchall() if line.startswith('Planning Time'))
+            text = summarize(time_calls(cur, sql, [params], repeat))
+            prepared = summarize(time_calls(cur, sql, [params], repeat, prepared=True))
+            results[name] = {
+                'planning_ms': planning_ms,
+                'text_p50_ms': text['p50_ms'],
+                'prepared_p50_ms': prepared['p50_ms'],
+                'saved_ms_per_call': round(text['p50_ms'] - prepared['p50_ms'], 3)
+            }
+    return results
+
+
+def bench_static_sql(conn, repeat, calls=200):
+    """Current paging functions against their dynamic-SQL versions, end to end.
+
+    Each is called `calls` times per round, `repeat` rounds over, on one
+    session, so the static bodies run on cached plans while EXECUTE plans
+    its query string on every call. saved_ms_per_call is the mean difference.
+    """
+    rounds = max(1, repeat // 10)
+    results = {}
+    with conn.cursor() as cur:
+        cur.execute(DYNAMIC_PAGING_FUNCTIONS)
+        try:
+            for name, sql, params in STATIC_SQL_CALLS:
+                samples = {'static': [], 'dynamic': []}
+                for _ in range(rounds):
+                    # Alternated so that drift in the machine's load hits both
+                    for version, suffix in (('static', ''), ('dynamic', '_dynamic')):
+                        samples[version] += time_calls(cur, sql.format(suffix=suffix), [params], calls)
+                static, dynamic = (summarize(samples[v]) for v in ('static', 'dynamic'))
+                means = {v: sum(s) / len(s) * 1000 for v, s in samples.items()}
+                results[name] = {
+                    'static_p50_ms': static['p50_ms'],
+                    'dynamic_p50_ms': dynamic['p50_ms'],
+                    'static_mean_ms': round(means['static'], 3),
+                    'dynamic_mean_ms': round(means['dynamic'], 3),
+                    'saved_ms_per_call': round(means['dynamic'] - means['static'], 3)
+                }
+        finally:
+            cur.execute("DROP FUNCTION get_contacts_paginated_dynamic(INT, INT, TEXT, TEXT)")
+            cur.execute("DROP FUNCTION get_contacts_keyset_dynamic(INT, TEXT, TEXT, TEXT, INT)")
+    return results
+
+
+def bench_paginate(conn, rows, repeat, page_size=20):
+    """Offset and keyset pagination near the start and in the middle of the table."""
+    deep = max(rows // 2, 0)
+    results = {}
+    with conn.cursor() as cur:
+        for depth, offset in (('shallow', 0), ('deep', deep)):
+            results[f"offset_{depth}"] = summarize(time_calls(
+                cur, "SELECT * FROM get_contacts_paginated(%s, %s, 'user_name', 'ASC')",
+                [(page_size, offset)], repeat
+            ))
+            # The same position reached by key: user_name of the row at `offset`
+            cur.execute("SELECT user_name, user_id FROM phone_book "
+                        "ORDER BY user_name, user_id OFFSET %s LIMIT 1", (max(offset - 1, 0),))
+            after_value, after_id = cur.fetchone() if offset else (None, None)
+            results[f"keyset_{depth}"] = summarize(time_calls(
+                cur, "SELECT * FROM get_contacts_keyset(%s, 'user_name', 'ASC', %s, %s)",
+                [(page_size, after_value, after_id)], repeat
+            ))
+    return results
+
+
+def bench_writes(conn, rows, repeat, bulk_size):
+    """Time upsert_user, bulk_insert_users, delete_contact and delete_contacts on the seeded table.
+
+    Run after the read benchmarks: the table is changed. Upserts and bulk
+    batches mix names that exist (updates) with new ones (inserts);
+    deletes remove seeded rows, each one a different row.
+    """
+    results = {}
+    step = max(rows // max(repeat * 4, 1), 1)
+    existing = [seeded_contact(i) for i in range(1, rows + 1, step)]
+    with conn.cursor() as cur:
+        params = []
+        for i in range(repeat):
+            name, phone = existing[i % len(existing)]
+            params.append((name, phone[:-1] + '0'))
+            params.append((f"Bench New User {i}", phone))
+        results['upsert'] = summarize(time_calls(cur, "CALL upsert_user(%s, %s)", params))
+
+        batches = []
+        for b in range(max(repeat // 4, 1)):
+            batch = [seeded_contact(1 + (b * bulk_size + j) % rows) if j % 2 else
+                     (f"Bench Bulk User {b}-{j}", f"+1-555-{b % 1000:03d}-{j % 10000:04d}")
+                     for j in range(bulk_size)]
+            batches.append(([name for name, _ in batch], [phone for _, phone in batch]))
+        samples = time_calls(cur, "SELECT * FROM bulk_insert_users(%s, %s)", batches)
+        results['bulk_insert'] = summarize(samples)
+        results['bulk_insert']['contacts_per_s'] = round(len(samples) * bulk_size / sum(samples), 1)
+
+        # Every second sample row is deleted by name, the others by phone
+        by_name = [(name, 'name') for name, _ in existing[0::2][:repeat]]
+        by_phone = [(phone, 'phone') for _, phone in existing[1::2][:repeat]]
+        results['delete_by_name'] = summarize(
+            time_calls(cur, "CALL delete_contact(%s, NULL, %s)", by_name))
+        results['delete_by_phone'] = summarize(
+            time_calls(cur, "CALL delete_contact(%s, NULL, %s)", by_phone))
+
+        # delete_contacts removes bulk_size phones per call with one join
+        batches = [([seeded_contact(1 + (b * bulk_size + j) % rows)[1] for j in range(bulk_size)],
+                    'phone')
+                   for b in range(max(repeat // 4, 1))]
+        samples = time_calls(cur, "SELECT * FROM delete_contacts(%s, %s)", batches)
+        results['bulk_delete_by_phone'] = summarize(samples)
+        results['bulk_delete_by_phone']['keys_per_s'] = round(len(samples) * bulk_size / sum(samples), 1)
+    return results
+
+
+def compare(report, baseline_path):
+    """Print the p50 change of every measurement against an earlier report."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old_runs = {run['rows']: run for run in baseline.get('runs', [])}
+    for run in report['runs']:
+        old = old_runs.get(run['rows'])
+        if old is None:
+            continue
+        for group in ('search', 'paginate', 'writes'):
+            for name, new in run.get(group, {}).items():
+                before = old.get(group, {}).get(name)
+                if not before or not before['p50_ms']:
+                    continue
+                change = (new['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100
+                flag = '[WARN]' if change > 20 else '[INFO]'
+                print(f"{flag} {run['rows']} rows {group}/{name}: p50 {before['p50_ms']} -> "
+                      f"{new['p50_ms']} ms ({change:+.0f}%)")
+
+
+def bench_upsert_concurrency(threads, calls_per_thread, distinct_names=50):
+    """Run upsert_user from `threads` threads over a small set of names.
+
+    Every thread upserts the same names, so most calls collide on the
+    unique index. Afterwards each name must exist exactly once.
+    """
+    pool = ConnectionPool(threads, threads, host=host, user=user,
+                          password=password, database=db_name)
+    names = [f"Concurrent User {i}" for i in range(distinct_names)]
+    finished = []            # completion timestamps of every call
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(worker_id):
+        stamps = []
+        try:
+            with pool.connection() as conn, conn.cursor() as cur:
+                cur.execute(f"SET search_path = {BENCH_SCHEMA}, public")
+                barrier.wait()
+                for i in range(calls_per_thread):
+                    name = names[(worker_id + i) % distinct_names]
+                    cur.execute("CALL upsert_user(%s, %s)",
+                                (name, f"+1-555-{worker_id:03d}-{i % 10000:04d}"))
+                    stamps.append(time.perf_counter())
+                cur.execute("RESET search_path")
+        except Exception as e:
+            barrier.abort()      # do not leave the other threads waiting
+            with lock:
+                errors.append(str(e))
+        with lock:
+            finished.extend(stamps)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+    pool.closeall()
+
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(f"SET search_path = {BENCH_SCHEMA}, public")
+        cur.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT user_name FROM phone_book
+                WHERE user_name LIKE 'Concurrent User %%'
+                GROUP BY user_name HAVING COUNT(*) > 1
+            ) dup
+        """)
+        duplicates = cur.fetchone()[0]
+        cur.execute("RESET search_path")
+
+    # Calls completed in each whole second of the run, to spot stalls
+    per_second = Counter(int(stamp - started) for stamp in finished)
+    buckets = [per_second.get(i, 0) for i in range(int(elapsed) + 1)]
+    return {
+        'threads': threads,
+        'calls': len(finished),
+        'errors': errors[:10],
+        'duplicate_names': duplicates,
+        'seconds': round(elapsed, 2),
+        'throughput_per_s': round(len(finished) / elapsed, 1) if elapsed else None,
+        'calls_per_second': buckets
+    }
+
+
+def bench_group_commit(threads, calls_per_thread):
+    """Upsert throughput with one commit per call vs. group commit.
+
+    Each thread writes its own names, so the difference comes from the
+    number of commits (WAL flushes), not from lock waits.
+    """
+    def run(submit_for):
+        barrier = threading.Barrier(threads + 1)
+        errors = []
+
+        def worker(worker_id):
+            submit = submit_for(worker_id)
+            barrier.wait()
+            try:
+                for i in range(calls_per_thread):
+                    submit("CALL upsert_user(%s, %s)",
+                           (f"Group Commit User {worker_id}-{i}", f"+1-555-{worker_id:03d}-{i % 10000:04d}"))
+            except Exception as e:
+                errors.append(str(e))
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for t in workers:
+            t.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - started
+        calls = threads * calls_per_thread
+        return {'seconds': round(elapsed, 2),
+                'throughput_per_s': round(calls / elapsed, 1) if elapsed else None,
+                'errors': errors[:10]}
+
+    pool = ConnectionPool(threads, threads, host=host, user=user, password=password,
+                          database=db_name, options=f"-c search_path={BENCH_SCHEMA},public")
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT current_setting('synchronous_commit'), current_setting('fsync')")
+        synchronous_commit, fsync = cur.fetchone()
+        cur.execute("DELETE FROM phone_book WHERE user_name LIKE 'Group Commit User %%'")
+
+    conns = []
+
+    def single_commits(worker_id):
+        conn = pool.getconn()   # autocommit: every call is its own transaction
+        conns.append(conn)
+        return conn.cursor().execute
+
+    autocommit = run(single_commits)
+    for conn in conns:
+        pool.putconn(conn)
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM phone_book WHERE user_name LIKE 'Group Commit User %%'")
+
+    committer = GroupCommitter(pool)
+    grouped = run(lambda worker_id: committer.execute)
+    committer.close()
+    grouped['statements_per_commit'] = round(committer.statements / committer.batches, 1)
+    pool.closeall()
+
+    return {
+        'threads': threads,
+        'calls': threads * calls_per_thread,
+        'synchronous_commit': synchronous_commit,
+        'fsync': fsync,
+        'commit_per_call': autocommit,
+        'group_commit': grouped
+    }
+
+
+def bench_csv_load(rows, workers):
+    """Load the same CSV file of `rows` contacts three ways into an empty table.
+
+    copy      one COPY straight into phone_book, as insert_from_csv in
+              phone_book_v2.0.1.py does (no validation, fails on a
+              duplicate name)
+    import    csv_import.import_csv: staging, validation and merge over
+              one connection
+    parallel  csv_import.import_csv_parallel with `workers` connections
+    """
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['user_name', 'phone_num'])
+        writer.writerows(seeded_contact(i) for i in range(rows))
+
+    pool = ConnectionPool(1, workers + 1, host=host, user=user, password=password,
+                          database=db_name, options=f"-c search_path={BENCH_SCHEMA},public")
+
+    def empty_table():
+        with pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("TRUNCATE phone_book RESTART IDENTITY")
+            cur.execute("TRUNCATE phone_book_changes")
+
+    def copy_file():
+        with pool.connection() as conn, conn.cursor() as cur, open(path, 'r') as f:
+            next(f)
+            cur.copy_expert("COPY phone_book(user_name, phone_num) FROM STDIN WITH CSV", f)
+
+    def import_file():
+        with pool.connection() as conn:
+            import_csv(conn, path, reject_path=os.devnull)
+
+    def import_file_parallel():
+        with pool.connection() as conn:
+            import_csv_parallel(conn, pool, path, workers, reject_path=os.devnull)
+
+    loads = {
+        'copy': copy_file,
+        'import': import_file,
+        'parallel': import_file_parallel,
+    }
+    result = {'rows': rows, 'workers': workers, 'file_mb': round(os.path.getsize(path) / 2**20, 1)}
+    try:
+        for name, load in loads.items():
+            empty_table()
+            started = time.perf_counter()
+            load()
+            elapsed = time.perf_counter() - started
+            result[name] = {'seconds': round(elapsed, 2),
+                            'rows_per_s': round(rows / elapsed) if elapsed else None}
+        empty_table()
+    finally:
+        pool.closeall()
+        os.remove(path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 1000000, 10000000],
+                        help='table sizes to benchmark (default: 10k, 1M and 10M)')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='calls per pattern, page position and write type (default: 20)')
+    parser.add_argument('--bulk-size', type=int, default=1000,
+                        help='contacts per bulk_insert_users call (default: 1000)')
+    parser.add_argument('--threads', type=int, default=16,
+                        help='threads for the upsert_user concurrency check (default: 16)')
+    parser.add_argument('--upserts', type=int, default=200,
+                        help='upsert_user calls per thread (default: 200, 0 to skip)')
+    parser.add_argument('--csv-rows', type=int, default=0,
+                        help='compare CSV loads of this many contacts (default: 0, skip)')
+    parser.add_argument('--csv-workers', type=int, default=4,
+                        help='connections for the parallel CSV load (default: 4)')
+    parser.add_argument('--partitions', type=int, default=0,
+                        help='hash-partition the bench table into N partitions (default: 0, none)')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the bench schema after the run')
+    parser.add_argument('--compare', metavar='REPORT',
+                        help='print p50 changes against an earlier JSON report')
+    args = parser.parse_args()
+
+    report = {'benchmark': 'phone_book',
+              'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+              'repeat': args.repeat, 'bulk_size': args.bulk_size,
+              'partitions': args.partitions, 'runs': []}
+    with connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SHOW server_version")
+                report['server_version'] = cur.fetchone()[0]
+            prepare_schema(conn, args.partitions)
+            for rows in args.rows:
+                seed_seconds = seed(conn, rows)
+                print(f"[INFO] Seeded {rows} rows in {seed_seconds:.1f}s.")
+                run = {'rows': rows, 'seed_seconds': round(seed_seconds, 2)}
+                run['search'] = bench_search(conn, args.repeat)
+                run['ranked_name_indexes'] = ranked_name_indexes(conn)
+                if 'phone_book_user_name_trgm_gist_idx' not in run['ranked_name_indexes']:
+                    print(f"[WARN] Ranked name search does not use the GiST trigram index: "
+                          f"{run['ranked_name_indexes']}")
+                run['paginate'] = bench_paginate(conn, rows, args.repeat)
+                run['prepared'] = bench_prepared(conn, args.repeat)
+                run['static_sql'] = bench_static_sql(conn, args.repeat)
+                run['writes'] = bench_writes(conn, rows, args.repeat, args.bulk_size)
+                if args.partitions:
+                    run['partitions_scanned'] = {
+                        lookup: scanned
+                        for lookup, (scanned, _) in partition_pruning(conn, *seeded_contact(1)).items()
+                    }
+                report['runs'].append(run)
+                print(f"[OK] {rows} rows: search, paginate, prepared, static sql and write "
+                      f"benchmarks done.")
+            if args.upserts:
+                result = bench_upsert_concurrency(args.threads, args.upserts)
+                report['upsert_concurrency'] = result
+                if result['duplicate_names'] or result['errors']:
+                    print(f"[ERROR] upsert_user concurrency check failed: "
+                          f"{result['duplicate_names']} duplicated name(s), "
+                          f"{len(result['errors'])} failed thread(s).")
+                else:
+                    print(f"[OK] {result['calls']} concurrent upserts, no duplicate names "
+                          f"({result['throughput_per_s']} calls/s).")
+
+                result = bench_group_commit(args.threads, args.upserts)
+                report['group_commit'] = result
+                print(f"[OK] Upserts with a commit each: "
+                      f"{result['commit_per_call']['throughput_per_s']} calls/s; "
+                      f"with group commit: {result['group_commit']['throughput_per_s']} calls/s "
+                      f"(synchronous_commit={result['synchronous_commit']}, fsync={result['fsync']}).")
+            if args.csv_rows:
+                result = bench_csv_load(args.csv_rows, args.csv_workers)
+                report['csv_load'] = result
+                print(f"[OK] CSV load of {args.csv_rows} rows: single COPY "
+                      f"{result['copy']['rows_per_s']} rows/s, validated import "
+                      f"{result['import']['rows_per_s']} rows/s, {args.csv_workers} connections "
+                      f"{result['parallel']['rows_per_s']} rows/s.")
+        finally:
+            if not args.keep:
+                with conn.cursor() as cur:
+                    cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+
+    if args.compare:
+        compare(report, args.compare)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"[OK] Report written to {args.output}.")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""In-process read-through cache for phone book lookups.
+
+Results of searches and pages are kept in an LRU with a time-to-live and
+dropped as a whole whenever the phone book changes. Writes made through
+contacts.py invalidate it once they commit; writes from other processes are seen
+through the `phone_book_changed` notification (see sql_functions.sql)
+once start_listener() is running.
+"""
+import select
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+from config import host, user, password, db_name
+
+NOTIFY_CHANNEL = 'phone_book_changed'
+
+
+def _sizeof(value):
+    """Rough memory footprint of a cached result (rows of plain values)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            size += _sizeof(item)
+    return size
+
+
+class QueryCache:
+    """A thread-safe LRU cache whose entries expire after `ttl` seconds.
+
+    `generation` is bumped on every invalidation; a result read before an
+    invalidation is not stored afterwards (see put()), so a slow query
+    cannot put stale rows back into a freshly cleared cache.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = OrderedDict()   # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def get(self, key):
+        """Return the cached value for `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value, size = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation=None):
+        """Store `value` unless the cache was invalidated since `generation`."""
+        size = _sizeof(value)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (time.monotonic() + self.ttl, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self):
+        """Drop every entry."""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'approx_bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+
+
+def _listen(cache, stop, poll_interval):
+    conn = None
+    while not stop.is_set():
+        try:
+            if conn is None:
+                conn = psycopg2.connect(host=host, user=user, password=password, database=db_name)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Changes made while we were not listening are unknown
+                cache.invalidate()
+            if select.select([conn], [], [], poll_interval)[0]:
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    cache.invalidate()
+        except psycopg2.Error as e:
+            print(f"[WARN] Cache listener lost its connection: {e}".rstrip())
+            if conn is not None:
+                conn.close()
+                conn = None
+            stop.wait(poll_interval)
+    if conn is not None:
+        conn.close()
+
+
+def start_listener(cache, poll_interval=1.0):
+    """Invalidate `cache` whenever another process changes the phone book.
+
+    Runs in a daemon thread with its own connection; returns an Event
+    that stops the thread when set.
+    """
+    stop = threading.Event()
+    thread = threading.Thread(target=_listen, args=(cache, stop, poll_interval),
+                              name='phone-book-cache-listener', daemon=True)
+    thread.start()
+    return stop
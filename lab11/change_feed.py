@@ -0,0 +1,226 @@
+"""Change-data feed of the phone_book table.
+
+Statement triggers (sql_functions.sql, section 8) log every inserted,
+updated and deleted contact in phone_book_changes and send a NOTIFY on
+`phone_book_feed` when the statement commits. This consumer waits for
+those notifications, reads the new rows from the log and writes them as
+NDJSON lines, so downstream jobs get the changes as they happen instead
+of diffing the whole table:
+
+    python change_feed.py                 # continue from the saved position
+    python change_feed.py --from-now      # skip what was logged before
+    python change_feed.py | ./load_into_warehouse
+
+The position is saved to `feed_position_file`, so after a restart or a
+lost connection the consumer catches up from the log before it waits
+again. Only positions whose lines were flushed to stdout are saved, so a
+consumer that goes away (a broken pipe) gets the changes it missed on
+the next start. Changes are delivered at least once: a crash between
+printing a change and saving the position repeats it, so consumers
+should be idempotent (every change carries its change_id).
+"""
+import argparse
+import json
+import os
+import select
+import sys
+import time
+
+import psycopg2
+
+from config import (host, user, password, db_name, connect_backoff,
+                    feed_poll_interval, feed_batch_size, feed_position_file)
+
+CHANNEL = 'phone_book_feed'
+START = ('0', 0)            # (xid, change_id) before the first logged change
+
+# Only transactions older than the snapshot's xmin are known to be finished;
+# newer rows wait for the next read, so none is skipped when transactions
+# commit out of order
+READ_CHANGES = """
+    SELECT xid::TEXT, change_id, op, user_id, user_name, phone_num, changed_at
+    FROM phone_book_changes
+    WHERE (xid, change_id) > (%s::XID8, %s)
+      AND xid < pg_snapshot_xmin(pg_current_snapshot())
+    ORDER BY xid, change_id
+    LIMIT %s
+"""
+
+LAST_POSITION = """
+    SELECT xid::TEXT, change_id
+    FROM phone_book_changes
+    WHERE xid < pg_snapshot_xmin(pg_current_snapshot())
+    ORDER BY xid DESC, change_id DESC
+    LIMIT 1
+"""
+
+
+def read_changes(conn, position, limit=feed_batch_size):
+    """Return up to `limit` committed changes after `position`, oldest first.
+
+    Each change is (position, dict); pass the last position back in to
+    continue.
+    """
+    with conn.cursor() as cur:
+        cur.execute(READ_CHANGES, (position[0], position[1], limit))
+        return [((xid, change_id), {
+                    'change_id': change_id, 'op': op, 'user_id': user_id,
+                    'user_name': user_name, 'phone_num': phone_num,
+                    'changed_at': changed_at.isoformat()
+                })
+                for xid, change_id, op, user_id, user_name, phone_num, changed_at
+                in cur.fetchall()]
+
+
+def current_position(conn):
+    """Position of the newest finished change, to start a feed from now."""
+    with conn.cursor() as cur:
+        cur.execute(LAST_POSITION)
+        row = cur.fetchone()
+    return (row[0], row[1]) if row else START
+
+
+def load_position(path=feed_position_file):
+    try:
+        with open(path) as f:
+            xid, change_id = f.read().split()
+        return xid, int(change_id)
+    except FileNotFoundError:
+        return None
+
+
+def save_position(position, path=feed_position_file):
+    # Renamed into place, so a crash never leaves half a position behind
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(f"{position[0]} {position[1]}\n")
+    os.replace(tmp_path, path)
+
+
+def _connect():
+    conn = psycopg2.connect(host=host, user=user, password=password, database=db_name)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {CHANNEL}")
+    return conn
+
+
+def follow(position, poll_interval=feed_poll_interval, batch_size=feed_batch_size,
+           on_idle=None):
+    """Yield (position, change) for every change after `position`, forever.
+
+    Reads the log until it is drained, then waits for a NOTIFY (or
+    `poll_interval` seconds, for changes that were held back) and reads
+    again. on_idle(position) is called whenever the feed has caught up.
+    A lost connection is reopened with backoff and the feed continues
+    from the last position it yielded.
+    """
+    conn = None
+    delay = connect_backoff
+    while True:
+        try:
+            if conn is None:
+                conn = _connect()
+                delay = connect_backoff
+            while True:
+                changes = read_changes(conn, position, batch_size)
+                for position, change in changes:
+                    yield position, change
+                if len(changes) < batch_size:
+                    break
+            if on_idle:
+                on_idle(position)
+            if select.select([conn], [], [], poll_interval)[0]:
+                conn.poll()
+                # The payload only says that something changed; the log has the rows
+                conn.notifies.clear()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            print(f"[WARN] Change feed lost its connection: {e}".rstrip(), file=sys.stderr)
+            if conn is not None:
+                conn.close()
+                conn = None
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+
+class Delivery:
+    """Writes changes as NDJSON lines and saves the position of those delivered.
+
+    A line only counts as delivered once `out` was flushed after it;
+    until then the saved position stays at the last flushed change. Once
+    a write or flush fails with BrokenPipeError the buffer is gone, so a
+    later flush proves nothing and the position is not moved again.
+    """
+
+    def __init__(self, out, position, path=feed_position_file):
+        self.out = out
+        self.path = path
+        self.written = self.delivered = position
+        self.broken = False
+
+    def write(self, position, change):
+        try:
+            print(json.dumps(change, ensure_ascii=False), file=self.out)
+        except BrokenPipeError:
+            self.broken = True
+            raise
+        self.written = position
+
+    def flush(self):
+        """Flush `out` and save what it held; raises BrokenPipeError like flush()."""
+        try:
+            self.out.flush()
+        except BrokenPipeError:
+            self.broken = True
+            raise
+        self.delivered = self.written
+        save_position(self.delivered, self.path)
+
+    def close(self):
+        """Save the final position: everything written, unless `out` is gone."""
+        if not self.broken:
+            try:
+                self.flush()
+                return
+            except BrokenPipeError:
+                pass
+        save_position(self.delivered, self.path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream phone_book changes as NDJSON.")
+    parser.add_argument('--from-now', action='store_true',
+                        help='ignore the saved position and skip changes logged so far')
+    parser.add_argument('--position-file', default=feed_position_file)
+    parser.add_argument('--poll-interval', type=float, default=feed_poll_interval)
+    args = parser.parse_args()
+
+    position = None if args.from_now else load_position(args.position_file)
+    if position is None:
+        if args.from_now:
+            conn = _connect()
+            position = current_position(conn)
+            conn.close()
+        else:
+            position = START
+    print(f"[INFO] Following phone_book changes after change {position[1]}.", file=sys.stderr)
+
+    delivery = Delivery(sys.stdout, position, args.position_file)
+    try:
+        for position, change in follow(position, args.poll_interval,
+                                       on_idle=lambda _: delivery.flush()):
+            delivery.write(position, change)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    finally:
+        delivery.close()
+    if delivery.broken:
+        # Nobody reads stdout any more; keep the interpreter from flushing it at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        print(f"[WARN] Output closed; resuming after change {delivery.delivered[1]} next time.",
+              file=sys.stderr)
+    print("[INFO] Change feed stopped.", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""Non-interactive command line interface for the phone book.
+
+Runs the same operations as the interactive menu, but takes its input
+from arguments, files or stdin and keeps one database connection for the
+whole run, so many changes can be applied by a single process:
+
+    python cli.py search John 555-12
+    python cli.py search --ranked --limit 5 "Jhon Smtih"
+    python cli.py upsert "John Smith" +1-555-123-4567
+    python cli.py upsert --file contacts.csv
+    python cli.py bulk-insert contacts.csv --batch-size 5000
+    python cli.py import big_feed.csv --workers 4
+    python cli.py delete --by phone --file opted_out.txt   # prints per-value counts
+    python cli.py export dump.ndjson.gz --format ndjson --pattern Smith
+    python cli.py paginate --page-size 50 --sort-by user_name --pages 3
+    cat names.txt | python cli.py search --file -
+
+Result rows go to stdout as tab-separated values; status lines go to
+stderr. The exit code is 1 if any operation failed or was rejected.
+--stats prints statement latencies per operation at the end; slow
+statements are logged as configured in config.py (see metrics.py).
+"""
+import argparse
+import contextlib
+import csv
+import shlex
+import sys
+
+import contacts
+import metrics
+from config import insert_batch_size, phone_book_partitions, import_workers
+from db import get_pool, close_pool, transaction
+
+
+def info(message):
+    print(message, file=sys.stderr)
+
+
+def open_input(path):
+    """Open `path` for reading; '-' means stdin, which is left open afterwards."""
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin)
+    return open(path, 'r', newline='')
+
+
+def read_values(args):
+    """Positional values followed by one value per line of --file."""
+    values = list(args.values)
+    if args.file:
+        with open_input(args.file) as f:
+            values.extend(line.rstrip('\r\n') for line in f if line.strip())
+    return values
+
+
+def read_contacts(path, has_header):
+    """Yield (name, phone) pairs from a two-column CSV file or stdin."""
+    with open_input(path) as f:
+        reader = csv.reader(f)
+        if has_header:
+            next(reader, None)
+        for row in reader:
+            if row:
+                # Rows with the wrong column count get no phone and are rejected
+                yield (row[0], row[1]) if len(row) == 2 else (row[0], None)
+
+
+def print_rows(rows):
+    count = 0
+    for row in rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+        count += 1
+    return count
+
+
+# --- COMMANDS ---
+
+def cmd_setup(conn, args):
+    for version in contacts.install_schema(conn):
+        info(f"[OK] Applied migration {version}.")
+    if args.partitions and contacts.partition_table(conn, args.partitions):
+        info(f"[OK] phone_book now has {args.partitions} hash partitions on user_name.")
+    info("[OK] Schema, functions and procedures are up to date.")
+    if args.partitions:
+        for lookup, (scanned, total) in contacts.partition_pruning(conn).items():
+            info(f"[INFO] Exact lookup by {lookup}: {scanned} of {total} partition(s) scanned.")
+    return 0
+
+
+def cmd_search(conn, args):
+    patterns = read_values(args)
+    if not patterns:
+        info("[ERROR] Give at least one pattern or --file.")
+        return 1
+    for pattern in patterns:
+        if args.ranked:
+            rows = contacts.search_ranked(conn, pattern, args.limit)
+        else:
+            rows = contacts.find_contacts(conn, pattern)
+        count = print_rows(rows)
+        info(f"[OK] {count} record(s) found for {pattern!r}.")
+    if args.cache_stats:
+        info(f"[INFO] Cache: {contacts.query_cache.stats()}")
+    return 0
+
+
+def cmd_bulk_insert(conn, args):
+    """Send contacts to bulk_insert_users in batches of --batch-size."""
+    def report(entry, name, phone, reason):
+        info(f"[WARN] Entry {entry}: {reason} (name: {name!r}, phone: {phone!r})")
+
+    accepted, rejected = contacts.bulk_upsert_batched(
+        conn, read_contacts(args.path, not args.no_header), args.batch_size, report
+    )
+    info(f"[OK] Bulk insert completed: {accepted} accepted, {rejected} rejected.")
+    return 1 if rejected else 0
+
+
+def cmd_upsert(conn, args):
+    if args.file:
+        args.path = args.file
+        return cmd_bulk_insert(conn, args)
+    if len(args.values) != 2:
+        info("[ERROR] upsert takes NAME PHONE, or --file.")
+        return 1
+    name, phone = args.values
+    contacts.upsert_contact(conn, name, phone)
+    info(f"[OK] User {name} processed successfully.")
+    return 0
+
+
+def cmd_import(conn, args):
+    result = contacts.import_contacts(conn, args.path, workers=args.workers,
+                                      chunk_rows=args.chunk_rows, has_header=not args.no_header)
+    rate = result['rows'] / result['seconds'] if result['seconds'] else 0
+    info(f"[OK] Imported {args.path}: {result['rows']} rows read, {result['merged']} merged, "
+         f"{result['rejected']} rejected in {result['seconds']:.1f}s ({rate:,.0f} rows/s).")
+    if result['rejected']:
+        info(f"[INFO] Rejected rows were written to {result['reject_path']}.")
+        return 1
+    return 0
+
+
+def cmd_delete(conn, args):
+    if not args.values and not args.file:
+        info("[ERROR] Give at least one value or --file.")
+        return 1
+    # One join per call instead of one CALL per value; a --file is
+    # streamed to the server with COPY rather than read into memory
+    with transaction(conn):
+        counts = contacts.delete_contacts(conn, args.values, args.by) if args.values else []
+        if args.file:
+            with open_input(args.file) as f:
+                lines = (line.rstrip('\r\n') for line in f if line.strip())
+                counts += contacts.delete_contacts_copy(conn, lines, args.by)
+    print_rows(counts)
+    total = sum(deleted for _, deleted in counts)
+    missing = sum(1 for _, deleted in counts if not deleted)
+    info(f"[OK] Deleted {total} record(s) for {len(counts)} {args.by}(s); {missing} matched nothing.")
+    return 0
+
+
+def cmd_export(conn, args):
+    rows, seconds = contacts.export_contacts(conn, args.path, args.format, args.pattern)
+    info(f"[OK] Exported {rows} record(s) to {args.path} in {seconds:.1f}s.")
+    return 0
+
+
+def cmd_paginate(conn, args):
+    after_value, after_id = args.after_value, args.after_id
+    for page_num in range(1, args.pages + 1):
+        rows = contacts.get_page(conn, args.page_size, args.sort_by, args.order,
+                                 after_value, after_id)
+        print_rows((row['user_id'], row['user_name'], row['phone_num']) for row in rows)
+        if len(rows) < args.page_size:
+            info(f"[INFO] End of records after page {page_num}.")
+            return 0
+        after_value, after_id = contacts.page_key(rows[-1], args.sort_by)
+    # Lets a script continue where this run stopped; user_id pages need no after-value
+    value = '' if after_value is None else f"--after-value {shlex.quote(str(after_value))} "
+    info(f"[INFO] Next page: {value}--after-id {after_id}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Phone book batch operations.")
+    parser.add_argument('--stats', action='store_true',
+                        help='print statement latencies per operation when done')
+    parser.add_argument('--explain-slow', action='store_true',
+                        help='log EXPLAIN (ANALYZE, BUFFERS) for slow statements')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('setup', help='apply pending schema migrations')
+    p.add_argument('--partitions', type=int, default=phone_book_partitions,
+                   help='hash-partition phone_book into N partitions (default from config.py)')
+    p.set_defaults(func=cmd_setup)
+
+    p = commands.add_parser('search', help='search by part of a name or phone')
+    p.add_argument('values', nargs='*', metavar='PATTERN')
+    p.add_argument('--file', help="read one pattern per line ('-' for stdin)")
+    p.add_argument('--ranked', action='store_true',
+                   help='fuzzy search: best matches first, with a score column')
+    p.add_argument('--limit', type=int, default=10, help='results per --ranked search (default: 10)')
+    p.add_argument('--cache-stats', action='store_true',
+                   help='report cache hits/misses for repeated patterns')
+    p.set_defaults(func=cmd_search)
+
+    p = commands.add_parser('upsert', help='insert or update one contact, or a CSV of them')
+    p.add_argument('values', nargs='*', metavar='NAME PHONE')
+    p.add_argument('--file', help="CSV file with user_name,phone_num ('-' for stdin)")
+    p.add_argument('--no-header', action='store_true', help='the CSV has no header line')
+    p.add_argument('--batch-size', type=int, default=insert_batch_size)
+    p.set_defaults(func=cmd_upsert)
+
+    p = commands.add_parser('bulk-insert', help='validated batch upsert from a CSV file')
+    p.add_argument('path', help="CSV file with user_name,phone_num ('-' for stdin)")
+    p.add_argument('--no-header', action='store_true', help='the CSV has no header line')
+    p.add_argument('--batch-size', type=int, default=insert_batch_size,
+                   help=f'contacts per bulk_insert_users call (default: {insert_batch_size})')
+    p.set_defaults(func=cmd_bulk_insert)
+
+    p = commands.add_parser('import', help='streaming import of a large CSV file')
+    p.add_argument('path')
+    p.add_argument('--no-header', action='store_true', help='the CSV has no header line')
+    p.add_argument('--chunk-rows', type=int, default=50000)
+    p.add_argument('--workers', type=int, default=import_workers,
+                   help=f'connections staging the file at once (default: {import_workers})')
+    p.set_defaults(func=cmd_import)
+
+    p = commands.add_parser('delete', help='delete contacts by exact name or phone')
+    p.add_argument('values', nargs='*', metavar='VALUE')
+    p.add_argument('--by', choices=('name', 'phone'), default='name')
+    p.add_argument('--file', help="read one value per line ('-' for stdin)")
+    p.set_defaults(func=cmd_delete)
+
+    p = commands.add_parser('export', help='stream contacts to a CSV/NDJSON file')
+    p.add_argument('path', help='output file, gzipped if it ends in .gz')
+    p.add_argument('--format', choices=('csv', 'ndjson'), default='csv')
+    p.add_argument('--pattern', help='only export contacts matching this pattern')
+    p.set_defaults(func=cmd_export)
+
+    p = commands.add_parser('paginate', help='print pages of contacts in sort order')
+    p.add_argument('--page-size', type=int, default=50)
+    p.add_argument('--pages', type=int, default=1)
+    p.add_argument('--sort-by', choices=contacts.SORT_COLUMNS, default='user_id')
+    p.add_argument('--order', choices=('ASC', 'DESC'), default='ASC')
+    p.add_argument('--after-value', help='sort value of the last row already seen')
+    p.add_argument('--after-id', type=int, help='user_id of the last row already seen')
+    p.set_defaults(func=cmd_paginate)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    metrics.explain_slow = metrics.explain_slow or args.explain_slow
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        return args.func(conn, args)
+    except (OSError, ValueError) as e:
+        info(f"[ERROR] {e}")
+        return 1
+    except Exception as e:
+        info(f"[ERROR] {args.command} failed: {e}")
+        return 1
+    finally:
+        pool.putconn(conn)
+        close_pool()
+        if args.stats:
+            info(metrics.format_summary())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,3 +2,65 @@ host = "localhost"
 user = "komronsodiqov"
 password = ""          
 db_name = "my_db"    
+
+# connection pool
+pool_min_size = 1
+pool_max_size = 10
+pool_timeout = 5.0                  # seconds to wait for a free connection
+pool_health_check_interval = 30.0   # probe connections idle longer than this
+connect_retries = 5
+connect_backoff = 0.2               # first retry delay, doubled each attempt
+
+# rows fetched per round trip when streaming large result sets
+fetch_itersize = 2000
+
+# read replicas (db.py); each entry overrides the settings above, e.g.
+# [{'host': 'replica1.local'}, {'host': 'localhost', 'port': 5433}].
+# Empty: every query goes to the primary. To try it locally, start a
+# streaming replica with `pg_basebackup -h localhost -D /tmp/replica -R`
+# and `pg_ctl -D /tmp/replica -o "-p 5433" start`, then list {'port': 5433}.
+read_replicas = []
+replica_sticky_seconds = 2.0        # reads stay on the primary this long after a write
+replica_retry_after = 30.0          # skip a replica this long after it failed
+
+# HTTP service (service.py)
+service_host = "127.0.0.1"
+service_port = 8080
+service_pool_min_size = 2
+service_pool_max_size = 20
+
+# read-through cache for searches and pages (cache.py)
+cache_max_entries = 1024
+cache_ttl = 30.0                    # seconds before a cached result is re-read
+cache_max_rows = 1000               # larger results are streamed, not cached
+
+# change feed consumer (change_feed.py)
+feed_poll_interval = 5.0            # re-check for changes this often without a NOTIFY
+feed_batch_size = 1000              # changes read per query while catching up
+feed_position_file = "phone_book_feed.pos"
+
+# group commit (db.GroupCommitter) for single upserts outside a transaction:
+# upserts from concurrent threads share one commit and WAL flush, each call
+# still returning only once its upsert is committed. Off: one commit per upsert.
+group_commit = False
+group_commit_max_batch = 100
+group_commit_max_delay = 0.002      # seconds a batch waits for more upserts
+group_commit_workers = 2            # connections committing batches in parallel
+
+# contacts per bulk_insert_users call when adding many contacts at once
+insert_batch_size = 1000
+
+# connections that stage a large CSV import at once (csv_import.py), on top
+# of the caller's own, which runs the merge; 1 keeps the single-connection
+# import. Capped at pool_max_size - 1.
+import_workers = 4
+
+# hash partitions of phone_book created by setup (partition_phone_book in
+# sql_functions.sql); 0 keeps a single table. Worth it at ~100M+ contacts.
+phone_book_partitions = 0
+
+# statement metrics and slow-query log (metrics.py)
+slow_query_ms = 200                 # statements at least this slow are logged
+slow_query_log = "slow_queries.log"
+explain_slow_queries = False        # also log EXPLAIN (ANALYZE, BUFFERS); re-runs the statement
+metrics_file = "phone_book_metrics.prom"
@@ -0,0 +1,338 @@
+"""Phone book operations without any console interaction.
+
+Thin wrappers around the functions and procedures in sql_functions.sql,
+shared by the interactive menu (phone_book_v2.0.1.py) and the batch CLI
+(cli.py). Errors are raised, not printed.
+
+Searches and pages are served from an in-process cache (cache.py) that
+is cleared by every write made here. Reads that miss the cache run on a
+read replica when config.py lists any (db.read_connection); writes
+use the connection passed in, which should be the primary's, except
+single upserts under group_commit (db.GroupCommitter).
+"""
+import csv
+import io
+
+from cache import QueryCache
+from config import cache_max_entries, cache_ttl, cache_max_rows, insert_batch_size
+from csv_import import import_csv, import_csv_parallel
+from db import (get_pool, get_group_committer, iter_query, transaction, read_connection,
+                mark_write, on_commit, execute_prepared)
+from export import export_query
+from metrics import InstrumentedDictCursor
+from migrate import migrate
+
+SORT_COLUMNS = ('user_id', 'user_name', 'phone_num')
+
+query_cache = QueryCache(cache_max_entries, cache_ttl)
+
+
+def install_schema(conn):
+    """Apply pending migrations (table, indexes, functions/procedures).
+
+    Returns the migrations that were applied; nothing runs when the
+    schema is already current.
+    """
+    applied = migrate(conn, repeatable=['sql_functions.sql'])
+    if applied:
+        after_write(conn)
+    return applied
+
+
+def partition_table(conn, partitions):
+    """Move phone_book into `partitions` hash partitions (no-op if done already).
+
+    Returns True if the table was converted by this call.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'phone_book'::regclass")
+        if cur.fetchone() is not None:
+            return False
+        cur.execute("CALL partition_phone_book(%s)", (partitions,))
+    after_write(conn)
+    return True
+
+
+def _scanned_relations(plan):
+    names = {plan['Relation Name']} if 'Relation Name' in plan else set()
+    for child in plan.get('Plans', ()):
+        names |= _scanned_relations(child)
+    return names
+
+
+def partition_pruning(conn, name='pruning check', phone='+1-555-000-0000'):
+    """Partitions read by exact lookups, as {lookup: (scanned, total)}.
+
+    Name lookups should read a single partition, both with the value in
+    the query and as a generic prepared plan, which is how the stored
+    procedures run them. Phone lookups are not on the partition key and
+    read every partition (through its phone_digits index).
+    """
+    checks = {
+        'name, literal': ("EXPLAIN (FORMAT JSON) SELECT * FROM phone_book WHERE user_name = %s",
+                          (name,)),
+        'name, generic plan': ("EXPLAIN (FORMAT JSON) EXECUTE pruning_check_by_name(%s)", (name,)),
+        'phone, literal': ("EXPLAIN (FORMAT JSON) SELECT * FROM phone_book "
+                           "WHERE phone_digits = normalize_phone(%s)", (phone,)),
+    }
+    result = {}
+    with transaction(conn), conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM pg_partition_tree('phone_book') WHERE isleaf")
+        total = cur.fetchone()[0] or 1
+        cur.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+        cur.execute("PREPARE pruning_check_by_name(TEXT) AS "
+                    "SELECT * FROM phone_book WHERE user_name = $1")
+        try:
+            for label, (query, params) in checks.items():
+                cur.execute(query, params)
+                result[label] = (len(_scanned_relations(cur.fetchone()[0][0]['Plan'])), total)
+        finally:
+            cur.execute("DEALLOCATE pruning_check_by_name")
+    return result
+
+
+def after_write(conn=None):
+    """Called after every write: drop cached reads, keep reads on the primary for a while.
+
+    Given the connection that wrote, this waits until its transaction
+    commits: cleared earlier, the cache could be refilled with rows that
+    are about to change.
+    """
+    if conn is not None:
+        on_commit(conn, after_write)
+        return
+    query_cache.invalidate()
+    mark_write()
+
+
+def find_contacts(conn, pattern):
+    """Yield (user_id, user_name, phone_num) rows matching `pattern`."""
+    # The search is ILIKE, so case does not change the result
+    key = ('search', pattern.lower())
+    rows = query_cache.get(key)
+    if rows is not None:
+        return iter(rows)
+    return _read_through(key, _stream(conn, "SELECT * FROM find_contacts_by_pattern(%s)",
+                                      (pattern,)))
+
+
+def search_ranked(conn, query, limit=10):
+    """Return the `limit` best fuzzy matches as (user_id, user_name, phone_num, score).
+
+    Names are matched by trigram similarity, so typos still match, and
+    phone numbers by digit prefix; ranking and the limit are applied in
+    the database.
+    """
+    key = ('ranked', query.lower(), limit)
+    rows = query_cache.get(key)
+    if rows is not None:
+        return list(rows)
+    generation = query_cache.generation
+    with read_connection(conn) as reader, reader.cursor() as cur:
+        execute_prepared(cur, "SELECT * FROM search_contacts_ranked(%s, %s)", (query, limit))
+        rows = cur.fetchall()
+    query_cache.put(key, tuple(rows), generation)
+    return rows
+
+
+def _stream(conn, query, params):
+    """iter_query on a replica connection, held until the rows are read."""
+    with read_connection(conn) as reader:
+        yield from iter_query(reader, query, params)
+
+
+def _read_through(key, rows):
+    """Yield `rows` and cache them once fully read, unless there are too many."""
+    generation = query_cache.generation
+    seen = []
+    for row in rows:
+        if seen is not None:
+            seen.append(row)
+            if len(seen) > cache_max_rows:
+                seen = None
+        yield row
+    if seen is not None:
+        query_cache.put(key, tuple(seen), generation)
+
+
+def upsert_contact(conn, name, phone):
+    """Insert a contact or update the phone of an existing name.
+
+    With group_commit on, a call outside a transaction is committed by
+    the process-wide GroupCommitter, together with other threads' upserts.
+    """
+    if not name or not phone:
+        raise ValueError("Name and phone cannot be empty.")
+    committer = get_group_committer()
+    if committer is not None and conn.autocommit:
+        committer.execute("CALL upsert_user(%s, %s)", (name, phone))
+        after_write()
+        return
+    with conn.cursor() as cur:
+        cur.execute("CALL upsert_user(%s, %s)", (name, phone))
+    after_write(conn)
+
+
+def bulk_upsert(conn, names, phones):
+    """Upsert many contacts at once; returns the rejected entries.
+
+    Each rejected entry is (entry_index, user_name, phone_num, reason),
+    with entry_index counting from 1 within this batch.
+    """
+    with conn.cursor() as cur:
+        execute_prepared(cur, "SELECT * FROM bulk_insert_users(%s, %s)", (names, phones))
+        rejected = cur.fetchall()
+    after_write(conn)
+    return rejected
+
+
+def bulk_upsert_batched(conn, entries, batch_size=insert_batch_size, on_reject=None):
+    """Upsert (name, phone) pairs from any iterable in one transaction.
+
+    The pairs are sent to bulk_insert_users `batch_size` at a time, so
+    the input is never held in memory as a whole. Rejected entries are
+    numbered from 1 across the whole input and passed to `on_reject` as
+    they come back. Returns (accepted, rejected) counts.
+    """
+    accepted = rejected = offset = 0
+    names, phones = [], []
+
+    def flush():
+        nonlocal accepted, rejected, offset
+        failed = bulk_upsert(conn, names, phones)
+        for entry, name, phone, reason in failed:
+            if on_reject:
+                on_reject(offset + entry, name, phone, reason)
+        accepted += len(names) - len(failed)
+        rejected += len(failed)
+        offset += len(names)
+        names.clear()
+        phones.clear()
+
+    with transaction(conn):
+        for name, phone in entries:
+            names.append(name)
+            phones.append(phone)
+            if len(names) == batch_size:
+                flush()
+        if names:
+            flush()
+    return accepted, rejected
+
+
+def get_page(conn, page_size, sort_by='user_id', sort_order='ASC',
+             after_value=None, after_id=None):
+    """Return one keyset page as a list of dict-like rows.
+
+    Pass the key of the last row of the previous page (see page_key) to
+    get the next one; leave both at None for the first page.
+    """
+    key = ('page', page_size, sort_by, sort_order.upper(), after_value, after_id)
+    rows = query_cache.get(key)
+    if rows is not None:
+        return list(rows)
+    generation = query_cache.generation
+    with read_connection(conn) as reader, reader.cursor(cursor_factory=InstrumentedDictCursor) as cur:
+        execute_prepared(
+            cur, "SELECT * FROM get_contacts_keyset(%s, %s, %s, %s, %s)",
+            (page_size, sort_by, sort_order, after_value, after_id)
+        )
+        rows = cur.fetchall()
+    if len(rows) <= cache_max_rows:
+        query_cache.put(key, tuple(rows), generation)
+    return rows
+
+
+def page_key(row, sort_by):
+    """The (after_value, after_id) pair that continues after `row`."""
+    return (None if sort_by == 'user_id' else row[sort_by]), row['user_id']
+
+
+def delete_contact(conn, value, delete_type='name'):
+    """Delete contacts by exact name or phone; returns the number deleted."""
+    if delete_type not in ('name', 'phone'):
+        raise ValueError("Delete type must be 'name' or 'phone'.")
+    with conn.cursor() as cur:
+        cur.execute("CALL delete_contact(%s, NULL, %s)", (value, delete_type))
+        deleted = cur.fetchone()[0]
+    after_write(conn)
+    return deleted
+
+
+def delete_contacts(conn, values, delete_type='name'):
+    """Delete every exact name or phone in `values` with one statement.
+
+    Returns [(value, rows_deleted)], one entry per distinct value in
+    input order; values that matched nothing have 0.
+    """
+    if delete_type not in ('name', 'phone'):
+        raise ValueError("Delete type must be 'name' or 'phone'.")
+    with conn.cursor() as cur:
+        execute_prepared(cur, "SELECT * FROM delete_contacts(%s, %s)", (list(values), delete_type))
+        rows = cur.fetchall()
+    after_write(conn)
+    return rows
+
+
+def delete_contacts_copy(conn, values, delete_type='name', chunk_rows=50000):
+    """Like delete_contacts, but streams `values` (any iterable) with COPY.
+
+    The values go into a temporary table in chunks and never have to be
+    held by the client as a whole, which suits long lists read from a file.
+    """
+    if delete_type not in ('name', 'phone'):
+        raise ValueError("Delete type must be 'name' or 'phone'.")
+    with transaction(conn), conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE delete_keys (ord BIGSERIAL, value TEXT)")
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        pending = 0
+        for value in values:
+            writer.writerow((value,))
+            pending += 1
+            if pending == chunk_rows:
+                _copy_keys(cur, buf)
+                pending = 0
+        if pending:
+            _copy_keys(cur, buf)
+        cur.execute("SELECT * FROM delete_contacts(ARRAY(SELECT value FROM delete_keys ORDER BY ord), %s)",
+                    (delete_type,))
+        rows = cur.fetchall()
+        cur.execute("DROP TABLE delete_keys")
+    after_write(conn)
+    return rows
+
+
+def _copy_keys(cur, buf):
+    buf.seek(0)
+    cur.copy_expert("COPY delete_keys (value) FROM STDIN WITH CSV", buf)
+    buf.seek(0)
+    buf.truncate()
+
+
+def import_contacts(conn, path, workers=1, **options):
+    """Streaming, validated CSV import (see csv_import.import_csv).
+
+    With workers > 1 the file is staged over that many more pooled
+    connections at once (csv_import.import_csv_parallel); `conn` runs
+    the merge.
+    """
+    try:
+        if workers > 1:
+            return import_csv_parallel(conn, get_pool(), path, workers, **options)
+        return import_csv(conn, path, **options)
+    finally:
+        after_write(conn)
+
+
+def export_contacts(conn, path, fmt='csv', pattern=None):
+    """Stream contacts, optionally filtered by `pattern`, to `path`.
+
+    Returns (rows, seconds).
+    """
+    if pattern:
+        query, params = "SELECT * FROM find_contacts_by_pattern(%s)", (pattern,)
+    else:
+        query, params = "SELECT user_id, user_name, phone_num FROM phone_book ORDER BY user_id", None
+    with read_connection(conn) as reader:
+        return export_query(reader, query, params, path, fmt)
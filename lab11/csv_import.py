@@ -0,0 +1,294 @@
+"""Streaming, validated CSV import into the phone_book table.
+
+The file is parsed on the client and sent in chunks with COPY into an
+unlogged staging table, so memory use does not depend on the file size.
+Rows with a bad name or phone number are removed from staging in SQL and
+written to a side file together with lines that could not be parsed at
+all. What is left is merged into phone_book with a single statement.
+
+import_csv_parallel splits the file into byte ranges on line boundaries
+and stages them concurrently over several pooled connections before the
+same single merge.
+"""
+import csv
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2 import sql
+
+from db import transaction
+
+# Same rule as bulk_insert_users in sql_functions.sql
+PHONE_PATTERN = r'^\+?[0-9]{1,3}[-\s]?[0-9]{3,}[-\s0-9]*$'
+CHUNK_ROWS = 50000
+
+# Merge strategies for the validated staging rows
+#   MERGE_UPSERT     - needs the unique index on user_name (lab11 schema);
+#                      the last line of the file wins for a repeated name
+#   MERGE_APPEND_NEW - plain table: add (name, phone) pairs not present yet,
+#                      comparing phones by their digits (phone_digits column)
+MERGE_UPSERT = """
+    INSERT INTO phone_book(user_name, phone_num)
+    SELECT DISTINCT ON (s.user_name) s.user_name, s.phone_num
+    FROM {staging} s
+    ORDER BY s.user_name, s.line_no DESC
+    ON CONFLICT (user_name) DO UPDATE SET phone_num = EXCLUDED.phone_num
+"""
+MERGE_APPEND_NEW = """
+    INSERT INTO phone_book(user_name, phone_num)
+    SELECT DISTINCT ON (s.user_name, d.digits) s.user_name, s.phone_num
+    FROM {staging} s
+    CROSS JOIN LATERAL (SELECT regexp_replace(s.phone_num, '[^0-9]', '', 'g') AS digits) d
+    WHERE NOT EXISTS (
+        SELECT 1 FROM phone_book pb
+        WHERE pb.user_name = s.user_name AND pb.phone_digits = d.digits
+    )
+    ORDER BY s.user_name, d.digits, s.line_no
+"""
+
+REJECT_REASON = """
+    CASE
+        WHEN user_name IS NULL OR length(trim(user_name)) = 0 THEN 'Empty name'
+        WHEN length(user_name) > 150 THEN 'Name longer than 150 characters'
+        WHEN phone_num IS NULL OR NOT phone_num ~ {pattern} THEN 'Invalid phone format'
+        WHEN length(phone_num) > 15 THEN 'Phone longer than 15 characters'
+    END
+"""
+
+
+def _copy_chunk(cur, staging, buf):
+    """Send one buffered chunk of staging rows with COPY."""
+    buf.seek(0)
+    cur.copy_expert(
+        sql.SQL("COPY {} (line_no, user_name, phone_num) FROM STDIN WITH CSV")
+        .format(staging).as_string(cur),
+        buf
+    )
+
+
+def stage_csv(cur, path, staging, reject_writer, chunk_rows=CHUNK_ROWS, has_header=True):
+    """Stream `path` into the staging table; returns (staged, rejected) counts.
+
+    Lines that do not have exactly two columns are written to
+    `reject_writer` straight away and never reach the server.
+    """
+    staged = rejected = 0
+    started = time.perf_counter()
+
+    with open(path, 'r', newline='') as src:
+        reader = csv.reader(src)
+        if has_header:
+            next(reader, None)
+
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        pending = 0
+        for row in reader:
+            if len(row) != 2:
+                reject_writer.writerow([reader.line_num, ','.join(row), '',
+                                        f'Expected 2 columns, got {len(row)}'])
+                rejected += 1
+                continue
+
+            writer.writerow([reader.line_num, row[0], row[1]])
+            pending += 1
+            if pending == chunk_rows:
+                _copy_chunk(cur, staging, buf)
+                staged += pending
+                rate = staged / (time.perf_counter() - started)
+                print(f"[INFO] {staged} rows staged ({rate:,.0f} rows/s).")
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                pending = 0
+
+        if pending:
+            _copy_chunk(cur, staging, buf)
+            staged += pending
+
+    return staged, rejected
+
+
+def reject_invalid(cur, staging, rejects_file):
+    """Move rows that fail validation from staging into the rejects file."""
+    reason = sql.SQL(REJECT_REASON).format(pattern=sql.Literal(PHONE_PATTERN))
+    cur.copy_expert(
+        sql.SQL("COPY (DELETE FROM {staging} WHERE {reason} IS NOT NULL "
+                "RETURNING line_no, user_name, phone_num, {reason}) TO STDOUT WITH CSV")
+        .format(staging=staging, reason=reason).as_string(cur),
+        rejects_file
+    )
+    return cur.rowcount
+
+
+def import_csv(conn, path, merge_sql=MERGE_UPSERT, reject_path=None,
+               chunk_rows=CHUNK_ROWS, has_header=True):
+    """Validate and merge a contacts CSV (user_name,phone_num) into phone_book.
+
+    Returns a dict with the number of data rows read, rejected and merged,
+    the elapsed time and the path of the rejects file.
+    """
+    if reject_path is None:
+        reject_path = os.path.splitext(path)[0] + '.rejected.csv'
+    staging = sql.Identifier(f"phone_book_staging_{os.getpid()}_{time.time_ns()}")
+    started = time.perf_counter()
+
+    # One transaction from staging to merge: a failed import leaves neither
+    # a half-merged phone_book nor a staging table behind, and every COPY
+    # chunk is not a commit of its own
+    with transaction(conn), conn.cursor() as cur:
+        cur.execute(sql.SQL(
+            "CREATE UNLOGGED TABLE {} (line_no BIGINT, user_name TEXT, phone_num TEXT)"
+        ).format(staging))
+        with open(reject_path, 'w', newline='') as rejects:
+            reject_writer = csv.writer(rejects)
+            reject_writer.writerow(['line_no', 'user_name', 'phone_num', 'reason'])
+            staged, unparsed = stage_csv(cur, path, staging, reject_writer,
+                                         chunk_rows, has_header)
+            rejects.flush()
+            rejected = unparsed + reject_invalid(cur, staging, rejects)
+
+        cur.execute(sql.SQL(merge_sql).format(staging=staging))
+        merged = cur.rowcount
+        cur.execute(sql.SQL("DROP TABLE {}").format(staging))
+
+    elapsed = time.perf_counter() - started
+    return {
+        'rows': staged + unparsed,
+        'rejected': rejected,
+        'merged': merged,
+        'seconds': elapsed,
+        'reject_path': reject_path
+    }
+
+
+def split_file(path, parts, has_header=True):
+    """Split `path` into up to `parts` byte ranges that start at a line start."""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        first = len(f.readline()) if has_header else 0
+        bounds = [first]
+        for i in range(1, parts):
+            f.seek(max(first + (size - first) * i // parts - 1, first))
+            f.readline()            # move on to the start of the next line
+            bounds.append(max(f.tell(), bounds[-1]))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def _stage_range(pool, path, start, end, staging, chunk_rows):
+    """COPY the lines starting in [start, end) into staging over one pooled connection.
+
+    Rows are keyed by the byte offset of their line, which keeps the file
+    order across ranges. Returns (staged, unparsed) where unparsed lists
+    the reject rows for lines without exactly two columns.
+    """
+    staged = 0
+    unparsed = []
+    offset = start
+
+    def lines(src):
+        nonlocal offset
+        src.seek(start)
+        position = start
+        while position < end:
+            line = src.readline()
+            if not line:
+                break
+            offset = position
+            position += len(line)
+            yield line.decode('utf-8')
+
+    with open(path, 'rb') as src, pool.connection() as conn, \
+            transaction(conn), conn.cursor() as cur:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        pending = 0
+        for row in csv.reader(lines(src)):
+            if len(row) != 2:
+                unparsed.append([offset, ','.join(row), '', f'Expected 2 columns, got {len(row)}'])
+                continue
+            writer.writerow([offset, row[0], row[1]])
+            pending += 1
+            if pending == chunk_rows:
+                _copy_chunk(cur, staging, buf)
+                staged += pending
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                pending = 0
+        if pending:
+            _copy_chunk(cur, staging, buf)
+            staged += pending
+    return staged, unparsed
+
+
+def import_csv_parallel(conn, pool, path, workers=4, merge_sql=MERGE_UPSERT, reject_path=None,
+                        chunk_rows=CHUNK_ROWS, has_header=True):
+    """import_csv with the staging done by `workers` connections from `pool` at once.
+
+    `conn` (the caller's connection, checked out of the same pool) creates
+    the staging table and runs the merge, so the import needs `workers`
+    more connections; fewer are used when the pool cannot hold that many,
+    and a pool of one connection falls back to import_csv on `conn`.
+    The staging table is committed first so that every connection can
+    COPY into it; only the reject pass and the merge run in one
+    transaction, and the staging table is dropped however it ends.
+    Lines are split on newlines, so quoted fields must not contain line
+    breaks. The rejects file lists byte offsets instead of line numbers.
+    Returns the same dict as import_csv, plus the number of workers.
+    """
+    if pool.maxconn < 2:
+        print("[WARN] The pool has no connection to spare; importing over one connection.")
+        result = import_csv(conn, path, merge_sql, reject_path, chunk_rows, has_header)
+        result['workers'] = 0
+        return result
+    if not conn.autocommit:
+        raise ValueError("A parallel import cannot run inside a transaction: "
+                         "the other connections would not see its staging table.")
+    if reject_path is None:
+        reject_path = os.path.splitext(path)[0] + '.rejected.csv'
+    # `conn` is one of the pool's connections too
+    workers = max(1, min(workers, pool.maxconn - 1))
+    staging = sql.Identifier(f"phone_book_staging_{os.getpid()}_{time.time_ns()}")
+    ranges = split_file(path, workers, has_header)
+    started = time.perf_counter()
+
+    with transaction(conn), conn.cursor() as cur:
+        cur.execute(sql.SQL(
+            "CREATE UNLOGGED TABLE {} (line_no BIGINT, user_name TEXT, phone_num TEXT)"
+        ).format(staging))
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges) or 1) as executor:
+            results = [future.result() for future in [
+                executor.submit(_stage_range, pool, path, start, end, staging, chunk_rows)
+                for start, end in ranges
+            ]]
+        staged = sum(count for count, _ in results)
+        print(f"[INFO] {staged} rows staged by {len(ranges)} connection(s) "
+              f"({staged / (time.perf_counter() - started):,.0f} rows/s).")
+
+        with open(reject_path, 'w', newline='') as rejects:
+            reject_writer = csv.writer(rejects)
+            reject_writer.writerow(['byte_offset', 'user_name', 'phone_num', 'reason'])
+            unparsed = 0
+            for _, rows in results:
+                reject_writer.writerows(rows)
+                unparsed += len(rows)
+            rejects.flush()
+            with transaction(conn), conn.cursor() as cur:
+                rejected = unparsed + reject_invalid(cur, staging, rejects)
+                cur.execute(sql.SQL(merge_sql).format(staging=staging))
+                merged = cur.rowcount
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(staging))
+
+    return {
+        'rows': staged + unparsed,
+        'rejected': rejected,
+        'merged': merged,
+        'seconds': time.perf_counter() - started,
+        'reject_path': reject_path,
+        'workers': len(ranges)
+    }
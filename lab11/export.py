@@ -0,0 +1,46 @@
+"""Streaming export of phone book queries to CSV or NDJSON files.
+
+Rows are produced by COPY ... TO STDOUT on the server and written to the
+output file as they arrive, so memory use stays flat no matter how many
+rows are exported. Files ending in .gz (or compress=True) are gzipped.
+"""
+import gzip
+import time
+
+FORMATS = ('csv', 'ndjson')
+
+
+def _open_output(path, compress):
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def export_query(conn, query, params, path, fmt='csv', compress=None):
+    """Stream the rows of `query` into `path`; returns (rows, seconds).
+
+    csv    - header line plus one CSV line per row
+    ndjson - one JSON object per line, keyed by column name
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    if compress is None:
+        compress = path.endswith('.gz')
+
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        # COPY does not take bind parameters, so inline them safely first
+        query = cur.mogrify(query, params).decode()
+        if fmt == 'csv':
+            copy_sql = f"COPY ({query}) TO STDOUT WITH CSV HEADER"
+        else:
+            # One json column per row. CSV mode with control characters as
+            # quote and delimiter writes the JSON text through unescaped;
+            # row_to_json already escapes those characters itself.
+            copy_sql = (f"COPY (SELECT row_to_json(t) FROM ({query}) t) TO STDOUT "
+                        "WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')")
+        with _open_output(path, compress) as out:
+            cur.copy_expert(copy_sql, out)
+        rows = cur.rowcount
+
+    return rows, time.perf_counter() - started
@@ -0,0 +1,134 @@
+"""Load test for the phone book HTTP service (service.py).
+
+Opens many concurrent keep-alive clients against a running service and
+sends a mix of searches, page reads, upserts, small bulk inserts and
+deletes for a fixed duration, then prints per-endpoint p50/p99 latency
+and throughput as JSON. Upserted contacts are named "Load Test User N",
+so the test only touches its own rows.
+
+    python service.py &
+    python load_test.py --clients 200 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlencode
+
+from benchmark import summarize
+from config import service_host, service_port
+
+SEARCH_PATTERNS = ['Smith', 'ohn', 'Garcia', '555-12', '4567', 'Load Test']
+LOAD_USERS = 1000
+
+
+def _load_user():
+    return f"Load Test User {random.randrange(LOAD_USERS)}"
+
+
+def _phone():
+    return f"+1-555-{random.randrange(1000):03d}-{random.randrange(10000):04d}"
+
+
+# (weight, name, request builder) -> (method, target, body)
+MIX = [
+    (60, 'search', lambda: ('GET', '/contacts/search?' + urlencode(
+        {'pattern': random.choice(SEARCH_PATTERNS), 'limit': 50}), None)),
+    (15, 'page', lambda: ('GET', '/contacts?' + urlencode(
+        {'limit': 20, 'sort_by': random.choice(['user_id', 'user_name'])}), None)),
+    (15, 'upsert', lambda: ('PUT', '/contacts', {'name': _load_user(), 'phone': _phone()})),
+    (5, 'bulk', lambda: ('POST', '/contacts/bulk', {
+        'contacts': [{'name': _load_user(), 'phone': _phone()} for _ in range(20)]})),
+    (5, 'delete', lambda: ('DELETE', '/contacts?' + urlencode(
+        {'value': _load_user(), 'type': 'name'}), None)),
+]
+
+
+async def request(reader, writer, host, method, target, payload):
+    """Send one request on a keep-alive connection; returns the status code."""
+    body = json.dumps(payload).encode() if payload is not None else b''
+    writer.write(
+        f"{method} {target} HTTP/1.1\r\nHost: {host}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    length = 0
+    for line in lines[1:]:
+        if line.lower().startswith('content-length:'):
+            length = int(line.split(':', 1)[1])
+    await reader.readexactly(length)
+    return status
+
+
+async def client(host, port, deadline, samples, failures):
+    weights = [w for w, _, _ in MIX]
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            _, name, build = random.choices(MIX, weights)[0]
+            method, target, payload = build()
+            started = time.perf_counter()
+            status = await request(reader, writer, host, method, target, payload)
+            samples[name].append(time.perf_counter() - started)
+            if status != 200:
+                failures[name] = failures.get(name, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run(host, port, clients, duration):
+    samples = {name: [] for _, name, _ in MIX}
+    failures = {}
+    started = time.perf_counter()
+    deadline = started + duration
+    results = await asyncio.gather(
+        *(client(host, port, deadline, samples, failures) for _ in range(clients)),
+        return_exceptions=True
+    )
+    elapsed = time.perf_counter() - started
+    client_errors = [str(r) for r in results if isinstance(r, Exception)]
+
+    total = sum(len(s) for s in samples.values())
+    endpoints = {}
+    for name, latencies in samples.items():
+        if latencies:
+            endpoints[name] = summarize(latencies)
+            # Across all clients, not per connection as summarize() reports
+            endpoints[name]['throughput_per_s'] = round(len(latencies) / elapsed, 1)
+    return {
+        'clients': clients,
+        'seconds': round(elapsed, 2),
+        'requests': total,
+        'requests_per_s': round(total / elapsed, 1),
+        'non_200': failures,
+        'client_errors': client_errors[:10],
+        'endpoints': endpoints
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default=service_host)
+    parser.add_argument('--port', type=int, default=service_port)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=30, help='seconds (default: 30)')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.host, args.port, args.clients, args.duration))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"[OK] Report written to {args.output}.")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+-- Migration 001: the phone_book table and its indexes.
+-- Every statement is idempotent, so databases created before migrations were
+-- tracked (when this was schema.sql, run on every start) take it as a no-op.
+
+CREATE TABLE IF NOT EXISTS phone_book (
+    user_id SERIAL PRIMARY KEY,
+    user_name VARCHAR(150) NOT NULL,
+    phone_num VARCHAR(15) NOT NULL
+);
+
+-- Trigram indexes let find_contacts_by_pattern answer '%pattern%' searches
+-- with a bitmap index scan instead of reading the whole table
+CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA public;
+
+CREATE INDEX IF NOT EXISTS phone_book_user_name_trgm_idx
+    ON phone_book USING gin (user_name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS phone_book_phone_num_trgm_idx
+    ON phone_book USING gin (phone_num gin_trgm_ops);
+
+-- Composite indexes for keyset pagination in get_contacts_keyset: the
+-- user_id tie-breaker makes every sort key unique so pages never overlap
+CREATE INDEX IF NOT EXISTS phone_book_user_name_user_id_idx
+    ON phone_book (user_name, user_id);
+
+CREATE INDEX IF NOT EXISTS phone_book_phone_num_user_id_idx
+    ON phone_book (phone_num, user_id);
+
+-- One row per user name: upsert_user and bulk_insert_users rely on this
+-- index for INSERT ... ON CONFLICT (user_name). Older tables may already
+-- hold duplicate names, so the latest row for each name is kept before the
+-- index is built. This only runs while the index does not exist yet.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_indexes
+        WHERE schemaname = current_schema()
+          AND tablename = 'phone_book'
+          AND indexname = 'phone_book_user_name_key'
+    ) THEN
+        DELETE FROM phone_book older
+        USING phone_book newer
+        WHERE older.user_name = newer.user_name
+          AND older.user_id < newer.user_id;
+
+        CREATE UNIQUE INDEX phone_book_user_name_key ON phone_book (user_name);
+    END IF;
+END $$;
@@ -0,0 +1,13 @@
+-- Migration 002: digits-only phone column for exact phone lookups
+
+-- Canonical digits-only form of phone_num, so "+1-555-123-4567" and
+-- "15551234567" compare equal. Computed by the server on every insert and
+-- update, whichever path wrote the row (procedures, COPY, plain INSERT).
+-- Adding it to an existing table rewrites the table once.
+ALTER TABLE phone_book ADD COLUMN IF NOT EXISTS phone_digits TEXT
+    GENERATED ALWAYS AS (regexp_replace(phone_num, '[^0-9]', '', 'g')) STORED;
+
+-- Exact phone lookups (delete_contact) go through normalize_phone() and
+-- this index instead of scanning for one particular spelling
+CREATE INDEX IF NOT EXISTS phone_book_phone_digits_idx
+    ON phone_book (phone_digits);
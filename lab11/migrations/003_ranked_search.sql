@@ -0,0 +1,13 @@
+-- Migration 003: indexes for search_contacts_ranked (sql_functions.sql)
+
+-- GiST, unlike the GIN index from 001, can return rows in order of
+-- trigram distance, so "ORDER BY ... <<-> ... LIMIT k" reads only k rows
+CREATE INDEX IF NOT EXISTS phone_book_user_name_trgm_gist_idx
+    ON phone_book USING gist (user_name gist_trgm_ops);
+
+-- Digit-prefix phone search (LIKE '1555%') needs text_pattern_ops; the
+-- same index still serves the exact matches, so it replaces the one from 002
+CREATE INDEX IF NOT EXISTS phone_book_phone_digits_pattern_idx
+    ON phone_book (phone_digits text_pattern_ops);
+
+DROP INDEX IF EXISTS phone_book_phone_digits_idx;
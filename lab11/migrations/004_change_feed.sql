@@ -0,0 +1,19 @@
+-- Migration 004: change log behind the phone_book change feed (change_feed.py)
+
+-- One row per inserted, updated or deleted contact, written by the
+-- statement triggers in sql_functions.sql (section 8). Consumers read it
+-- in (xid, change_id) order: change_id alone is assigned before commit,
+-- so a smaller id can become visible after a larger one, while every
+-- transaction older than the snapshot's xmin has finished.
+CREATE TABLE IF NOT EXISTS phone_book_changes (
+    change_id  BIGSERIAL PRIMARY KEY,
+    xid        XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    op         CHAR(1) NOT NULL,            -- I(nsert), U(pdate), D(elete), T(runcate)
+    user_id    INT,
+    user_name  VARCHAR(150),
+    phone_num  VARCHAR(15),
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS phone_book_changes_xid_idx
+    ON phone_book_changes (xid, change_id);
@@ -1,47 +1,33 @@
-import psycopg2
-import psycopg2.extras
-from config import host, user, password, db_name
+import contacts
+import metrics
+from cache import start_listener
+from config import metrics_file, phone_book_partitions, import_workers
+from db import get_pool, close_pool, read_connection
 
 
 def connect_db():
-    """Establish and return a PostgreSQL connection."""
+    """Check out a PostgreSQL connection from the shared pool."""
     try:
-        conn = psycopg2.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=db_name
-        )
-        conn.autocommit = True
-        return conn
+        return get_pool().getconn()
     except Exception as e:
         print(f"[ERROR] Database connection failed: {e}")
         exit(1)
 
 
+def release_db(conn):
+    """Hand the connection back to the pool and shut the pool down."""
+    get_pool().putconn(conn)
+    close_pool()
+
+
 def setup_database(conn):
-    """Create the phone_book table and setup all functions/procedures."""
-    # First create the base table
-    table_sql = """
-        CREATE TABLE IF NOT EXISTS phone_book (
-            user_id SERIAL PRIMARY KEY,
-            user_name VARCHAR(150) NOT NULL,
-            phone_num VARCHAR(15) NOT NULL
-        )
-    """
-    
+    """Apply pending migrations: table, indexes and all functions/procedures."""
     try:
-        with conn.cursor() as cur:
-            cur.execute(table_sql)
-        print("[OK] Table `phone_book` is ready.")
-        
-        # Now load all the functions and procedures from file
-        with open('sql_functions.sql', 'r') as f:
-            sql_functions = f.read()
-            
-        with conn.cursor() as cur:
-            cur.execute(sql_functions)
-        print("[OK] All database functions and procedures are installed.")
+        for version in contacts.install_schema(conn):
+            print(f"[OK] Applied migration {version}.")
+        if phone_book_partitions and contacts.partition_table(conn, phone_book_partitions):
+            print(f"[OK] phone_book split into {phone_book_partitions} hash partitions.")
+        print("[OK] Table `phone_book` and its functions are up to date.")
         
     except Exception as e:
         print(f"[ERROR] Database setup failed: {e}")
@@ -54,18 +40,34 @@ def search_by_pattern(conn):
     """Use the database function to search by pattern in name or phone."""
     try:
         pattern = input("Enter search pattern (part of name or phone): ")
+        ranked = input("Fuzzy search, best matches first? (y/N): ").strip().lower() == 'y'
         
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM find_contacts_by_pattern(%s)", (pattern,))
-            rows = cur.fetchall()
-            
-        if rows:
-            print("\nSearch Results:")
-            print("ID\tName\t\tPhone")
-            print("-" * 40)
-            for uid, name, phone in rows:
-                print(f"{uid}\t{name}\t\t{phone}")
+        if ranked:
+            limit = int(input("How many results (default: 10)? ") or 10)
+            rows = contacts.search_ranked(conn, pattern, limit)
+            if not rows:
+                print("[INFO] No matching records found.")
+                return
+            print("\nBest Matches:")
+            print("ID\tName\t\tPhone\t\tScore")
+            print("-" * 50)
+            for uid, name, phone, score in rows:
+                print(f"{uid}\t{name}\t\t{phone}\t{score:.2f}")
             print(f"\n[OK] {len(rows)} record(s) found.")
+            return
+        
+        # Rows are streamed from a server-side cursor and printed as they arrive
+        count = 0
+        for uid, name, phone in contacts.find_contacts(conn, pattern):
+            if count == 0:
+                print("\nSearch Results:")
+                print("ID\tName\t\tPhone")
+                print("-" * 40)
+            print(f"{uid}\t{name}\t\t{phone}")
+            count += 1
+            
+        if count:
+            print(f"\n[OK] {count} record(s) found.")
         else:
             print("[INFO] No matching records found.")
     except Exception as e:
@@ -80,54 +82,42 @@ def upsert_user(conn):
         name = input("Enter user name: ")
         phone = input("Enter phone number: ")
         
-        # Basic validation
-        if not name or not phone:
-            print("[ERROR] Name and phone cannot be empty.")
-            return
-            
-        with conn.cursor() as cur:
-            cur.execute("CALL upsert_user(%s, %s)", (name, phone))
-            
+        contacts.upsert_contact(conn, name, phone)
         print(f"[OK] User {name} processed successfully.")
+    except ValueError as e:
+        print(f"[ERROR] {e}")
     except Exception as e:
         print(f"[ERROR] Upsert operation failed: {e}")
 
 
-# --- PROCEDURE 3: BULK INSERT WITH VALIDATION ---
+# --- FUNCTION 3: BULK INSERT WITH VALIDATION ---
 
 def bulk_insert_users(conn):
-    """Bulk insert users with validation in the database procedure."""
+    """Bulk insert users with validation in the database function."""
     try:
         num_users = int(input("How many users do you want to insert? "))
         if num_users <= 0:
             print("[ERROR] Number must be positive.")
             return
             
-        names = []
-        phones = []
+        entries = []
         
         print("\nEnter user details (name and phone on separate lines):")
         for i in range(num_users):
             print(f"\nUser {i+1}:")
             name = input("Name: ")
             phone = input("Phone: ")
-            names.append(name)
-            phones.append(phone)
-        
-        # Call the stored procedure with arrays
-        with conn.cursor() as cur:
-            cur.execute(
-                "CALL bulk_insert_users(%s, %s, NULL)", 
-                (names, phones)
-            )
-            
-            # Fetch notices that contain validation errors
-            notices = conn.notices
-            if notices:
-                for notice in notices:
-                    print(notice)
-        
-        print(f"[OK] Bulk insert of {num_users} users completed.")
+            entries.append((name, phone))
+
+        def report(entry, name, phone, reason):
+            print(f"[WARN] Entry {entry}: {reason} (name: {name!r}, phone: {phone!r})")
+
+        # Everything is typed in before the transaction starts; the entries
+        # then go to the database function in batches and it returns the
+        # rejected rows
+        accepted, rejected = contacts.bulk_upsert_batched(conn, entries, on_reject=report)
+
+        print(f"[OK] Bulk insert completed: {accepted} accepted, {rejected} rejected.")
         
     except ValueError:
         print("[ERROR] Please enter a valid number.")
@@ -147,7 +137,6 @@ def paginated_query(conn):
             return
             
         page_num = 1
-        offset = 0
         sort_options = {
             '1': 'user_id',
             '2': 'user_name', 
@@ -164,31 +153,34 @@ def paginated_query(conn):
         if sort_order not in ('ASC', 'DESC'):
             sort_order = 'ASC'
         
+        # Keyset pagination: remember the sort key each page starts after, so
+        # going back is a lookup and going forward seeks past the last row
+        # shown instead of skipping over `offset` rows
+        page_starts = [(None, None)]
+        
         while True:
-            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-                cur.execute(
-                    "SELECT * FROM get_contacts_paginated(%s, %s, %s, %s)",
-                    (page_size, offset, sort_by, sort_order)
-                )
-                rows = cur.fetchall()
+            after_value, after_id = page_starts[page_num - 1]
+            rows = contacts.get_page(conn, page_size, sort_by, sort_order, after_value, after_id)
             
             if not rows:
                 print("[INFO] No more records found.")
                 break
                 
-            total_count = rows[0]['total_count'] if rows else 0
+            # total_count is a planner estimate, not an exact COUNT(*)
+            offset = (page_num - 1) * page_size
+            total_count = max(rows[0]['total_count'], offset + len(rows))
             total_pages = (total_count + page_size - 1) // page_size
             
-            print(f"\n--- Page {page_num} of {total_pages} ---")
+            print(f"\n--- Page {page_num} of ~{total_pages} ---")
             print("ID\tName\t\tPhone")
             print("-" * 40)
             
             for row in rows:
                 print(f"{row['user_id']}\t{row['user_name']}\t\t{row['phone_num']}")
                 
-            print(f"\nShowing records {offset+1}-{min(offset+page_size, total_count)} of {total_count}")
+            print(f"\nShowing records {offset+1}-{offset+len(rows)} of ~{total_count}")
             
-            if page_num >= total_pages:
+            if len(rows) < page_size:
                 print("[INFO] End of records.")
                 break
                 
@@ -197,10 +189,10 @@ def paginated_query(conn):
                 break
             elif choice == 'P' and page_num > 1:
                 page_num -= 1
-                offset = (page_num - 1) * page_size
             else:  # Default to next page
+                if len(page_starts) == page_num:
+                    page_starts.append(contacts.page_key(rows[-1], sort_by))
                 page_num += 1
-                offset = (page_num - 1) * page_size
                 
     except ValueError:
         print("[ERROR] Please enter a valid number.")
@@ -216,9 +208,13 @@ def delete_contact(conn):
         print("\nDelete Contact")
         print("1. Delete by name")
         print("2. Delete by phone number")
+        print("3. Delete many names or phone numbers listed in a file")
         
         option = input("Select option: ")
         
+        if option == '3':
+            delete_many(conn)
+            return
         if option == '1':
             value = input("Enter name to delete: ")
             delete_type = 'name'
@@ -229,20 +225,28 @@ def delete_contact(conn):
             print("[ERROR] Invalid option.")
             return
             
-        with conn.cursor() as cur:
-            # Change this line to match the parameter order in the procedure definition
-            cur.execute("CALL delete_contact(%s, NULL, %s)", (value, delete_type))
-            
-            # Get the notices with results
-            notices = conn.notices
-            if notices:
-                for notice in notices:
-                    print(notice)
+        rows_deleted = contacts.delete_contact(conn, value, delete_type)
+        print(f"[OK] Deleted {rows_deleted} record(s) with {delete_type}: {value}")
                 
     except Exception as e:
         print(f"[ERROR] Delete operation failed: {e}")
 
 
+def delete_many(conn):
+    """Delete every name or phone listed in a file, one per line, in one statement."""
+    path = input("Enter file path (one value per line): ")
+    delete_type = 'phone' if input("Values are (1) names or (2) phone numbers? ") == '2' else 'name'
+    with open(path, 'r') as f:
+        lines = (line.rstrip('\r\n') for line in f if line.strip())
+        counts = contacts.delete_contacts_copy(conn, lines, delete_type)
+    
+    missing = [value for value, deleted in counts if not deleted]
+    total = sum(deleted for _, deleted in counts)
+    print(f"[OK] Deleted {total} record(s) for {len(counts)} {delete_type}(s).")
+    if missing:
+        print(f"[INFO] {len(missing)} value(s) matched nothing, e.g. {', '.join(missing[:5])}")
+
+
 # --- INSERT OPERATIONS ---
 
 def insert_from_csv(conn):
@@ -258,6 +262,7 @@ def insert_from_csv(conn):
                     "COPY phone_book(user_name, phone_num) FROM STDIN WITH CSV",
                     f
                 )
+        contacts.after_write(conn)
         print(f"[OK] Imported data from {path}.")
     except FileNotFoundError:
         print(f"[ERROR] File {path} not found. Please check the file path.")
@@ -265,12 +270,46 @@ def insert_from_csv(conn):
         print(f"[ERROR] CSV import failed: {e}")
 
 
+
+def import_csv_validated(conn):
+    """Stream a large CSV file through a staging table with validation."""
+    path = input("Enter path to CSV file: ")
+    try:
+        result = contacts.import_contacts(conn, path, workers=import_workers)
+        rate = result['rows'] / result['seconds'] if result['seconds'] else 0
+        print(f"[OK] Imported {path}: {result['rows']} rows read, {result['merged']} merged, "
+              f"{result['rejected']} rejected in {result['seconds']:.1f}s ({rate:,.0f} rows/s).")
+        if result['rejected']:
+            print(f"[INFO] Rejected rows were written to {result['reject_path']}.")
+    except FileNotFoundError:
+        print(f"[ERROR] File {path} not found. Please check the file path.")
+    except Exception as e:
+        print(f"[ERROR] CSV import failed: {e}")
+
+# --- EXPORT OPERATIONS ---
+
+def export_contacts(conn):
+    """Stream contacts, optionally filtered by a pattern, to a CSV or NDJSON file."""
+    try:
+        path = input("Enter output file path (end with .gz to compress): ")
+        fmt = input("Format (csv/ndjson, default: csv): ").lower() or 'csv'
+        pattern = input("Filter pattern (leave empty to export everything): ")
+        
+        rows, seconds = contacts.export_contacts(conn, path, fmt, pattern)
+        print(f"[OK] Exported {rows} record(s) to {path} in {seconds:.1f}s.")
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+    except Exception as e:
+        print(f"[ERROR] Export failed: {e}")
+
+
 # --- UTILITY FUNCTIONS ---
 
 def view_table_structure(conn):
     """View the structure of the phone_book table."""
     try:
-        with conn.cursor() as cur:
+        # Read-only, so a replica can answer it
+        with read_connection(conn) as reader, reader.cursor() as cur:
             # Get table structure
             cur.execute("""
                 SELECT column_name, data_type, character_maximum_length
@@ -306,12 +345,25 @@ def view_table_structure(conn):
         print(f"[ERROR] Failed to retrieve schema: {e}")
 
 
+def show_query_stats(conn):
+    """Show statement latencies of this session and write the metrics file."""
+    try:
+        print("\nQuery statistics (this session):")
+        print(metrics.format_summary())
+        metrics.write_prometheus()
+        print(f"\n[OK] Metrics written to {metrics_file}.")
+    except Exception as e:
+        print(f"[ERROR] Failed to write metrics: {e}")
+
+
 def main():
     conn = None
     try:
         # Connect to database and setup
         conn = connect_db()
         setup_database(conn)
+        # Drop cached searches when another process edits the phone book
+        stop_listener = start_listener(contacts.query_cache)
         
         menu = {
             # Function 1: Search by pattern
@@ -320,7 +372,7 @@ def main():
             # Procedure 2: Insert or update user
             '2': (upsert_user, 'Insert new user or update existing'),
             
-            # Procedure 3: Bulk insert with validation
+            # Function 3: Bulk insert with validation
             '3': (bulk_insert_users, 'Bulk insert users with validation'),
             
             # Function 4: Paginated query
@@ -332,8 +384,15 @@ def main():
             # Legacy operations
             '6': (insert_from_csv, 'Import from CSV file'),
             
+            # Streaming import with validation
+            '7': (import_csv_validated, 'Import large CSV file with validation'),
+            
+            # Streaming export
+            '8': (export_contacts, 'Export contacts to CSV/NDJSON file'),
+            
             # Utility
-            '7': (view_table_structure, 'View database structure'),
+            '9': (view_table_structure, 'View database structure'),
+            '10': (show_query_stats, 'Show query statistics'),
             
             '0': (None, 'Exit')
         }
@@ -351,6 +410,11 @@ def main():
             choice = input("\nSelect an option: ")
             
             if choice == '0':
+                stop_listener.set()
+                stats = contacts.query_cache.stats()
+                print(f"[INFO] Search cache: {stats['hits']} hit(s), {stats['misses']} miss(es), "
+                      f"hit rate {stats['hit_rate']:.0%}, {stats['evictions']} eviction(s), "
+                      f"{stats['entries']} entries (~{stats['approx_bytes'] / 1024:.0f} KiB).")
                 print("[INFO] Exiting program.")
                 break
                 
@@ -364,7 +428,7 @@ def main():
         print(f"[ERROR] {e}")
     finally:
         if conn:
-            conn.close()
+            release_db(conn)
             print("[INFO] Database connection closed.")
 
 
@@ -0,0 +1,342 @@
+"""Asyncio HTTP/JSON service for the phone book.
+
+One process serves many concurrent clients over a shared asyncpg pool and
+calls the same functions and procedures as the terminal menu
+(the schema must be migrated first, e.g. with `python cli.py setup`).
+
+    python service.py --port 8080
+
+Endpoints (request and response bodies are JSON):
+
+    GET    /contacts/search?pattern=Jo[&limit=100]      find_contacts_by_pattern
+    GET    /contacts/search?pattern=Jhon&ranked=1[&limit=10]
+                                                        search_contacts_ranked
+    GET    /contacts?limit=20&offset=40&sort_by=user_name&order=ASC
+                                                        get_contacts_paginated
+    GET    /contacts?limit=20&sort_by=user_name&after_value=..&after_id=..
+                                                        get_contacts_keyset
+    PUT    /contacts         {"name": "..", "phone": ".."}          upsert_user
+    POST   /contacts/bulk    {"contacts": [{"name": "..", "phone": ".."}]}
+                                                        bulk_insert_users
+    DELETE /contacts?value=..&type=name|phone           delete_contact
+    POST   /contacts/delete  {"values": ["..", ".."], "type": "name"|"phone"}
+                                                        delete_contacts
+
+Searches and listings are spread over the read replicas in config.py,
+if any, except for `replica_sticky_seconds` after a write, when they go
+to the primary like all writes do. Their results are kept in the same
+read-through cache as the menu's (cache.py), which is cleared by every
+write made here and, through the `phone_book_changed` notification, by
+writes from other processes.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import asyncpg
+
+from cache import QueryCache, start_listener
+from config import (host, user, password, db_name,
+                    service_host, service_port, service_pool_min_size, service_pool_max_size,
+                    read_replicas, replica_sticky_seconds, replica_retry_after,
+                    cache_max_entries, cache_ttl, cache_max_rows)
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    413: 'Payload Too Large', 500: 'Internal Server Error'
+}
+
+
+class HTTPError(Exception):
+    """An error that is reported to the client with the given status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _param(query, name, default=None, required=False, cast=str):
+    values = query.get(name)
+    if not values:
+        if required:
+            raise HTTPError(400, f"Missing query parameter '{name}'")
+        return default
+    try:
+        return cast(values[0])
+    except ValueError:
+        raise HTTPError(400, f"Invalid value for '{name}': {values[0]!r}")
+
+
+def _json_body(body):
+    try:
+        return json.loads(body or b'{}')
+    except ValueError:
+        raise HTTPError(400, "Request body is not valid JSON")
+
+
+class PhoneBookService:
+    """Maps HTTP routes onto the phone book database functions."""
+
+    def __init__(self, pool, replica_pools=(), cache=None):
+        self.pool = pool
+        self.cache = cache or QueryCache(cache_max_entries, cache_ttl)
+        self.replica_pools = list(replica_pools)
+        self._next_replica = itertools.count()
+        self._replica_down_until = [0.0] * len(self.replica_pools)
+        self._last_write = None
+        self.routes = {
+            ('GET', '/contacts/search'): self.search,
+            ('GET', '/contacts'): self.list_contacts,
+            ('PUT', '/contacts'): self.upsert,
+            ('POST', '/contacts/bulk'): self.bulk_insert,
+            ('DELETE', '/contacts'): self.delete,
+            ('POST', '/contacts/delete'): self.bulk_delete,
+        }
+
+    async def fetch_read(self, query, *args):
+        """Run a read-only query on the next replica, or on the primary.
+
+        The primary answers while no replica is configured, for a short
+        while after a write (so clients read their own writes) and when
+        the chosen replica cannot be reached; a failed replica is skipped
+        for `replica_retry_after` seconds.
+        """
+        now = time.monotonic()
+        recent_write = self._last_write is not None and now - self._last_write < replica_sticky_seconds
+        if self.replica_pools and not recent_write:
+            index = next(self._next_replica) % len(self.replica_pools)
+            if self._replica_down_until[index] <= now:
+                try:
+                    async with self.replica_pools[index].acquire() as conn:
+                        return await conn.fetch(query, *args)
+                except (OSError, asyncpg.PostgresConnectionError) as e:
+                    print(f"[WARN] Read replica {index + 1} failed, using the primary: {e}")
+                    self._replica_down_until[index] = now + replica_retry_after
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(query, *args)
+
+    async def cached_read(self, key, query, *args):
+        """fetch_read through the cache; results over `cache_max_rows` are not kept."""
+        rows = self.cache.get(key)
+        if rows is not None:
+            return rows
+        generation = self.cache.generation
+        rows = await self.fetch_read(query, *args)
+        if len(rows) <= cache_max_rows:
+            self.cache.put(key, tuple(rows), generation)
+        return rows
+
+    def wrote(self):
+        """Called after every (committed) write."""
+        self._last_write = time.monotonic()
+        self.cache.invalidate()
+
+    async def search(self, query, body):
+        pattern = _param(query, 'pattern', required=True)
+        ranked = _param(query, 'ranked', '0') not in ('0', 'false', '')
+        limit = _param(query, 'limit', 10 if ranked else None, cast=int)
+        # Both searches ignore case, so the key does too
+        if ranked:
+            rows = await self.cached_read(
+                ('ranked', pattern.lower(), limit),
+                "SELECT * FROM search_contacts_ranked($1, $2)", pattern, limit
+            )
+        else:
+            rows = await self.cached_read(
+                ('search', pattern.lower(), limit),
+                "SELECT * FROM find_contacts_by_pattern($1) LIMIT $2", pattern, limit
+            )
+        return {'contacts': [dict(row) for row in rows]}
+
+    async def list_contacts(self, query, body):
+        limit = _param(query, 'limit', 20, cast=int)
+        sort_by = _param(query, 'sort_by', 'user_id')
+        order = _param(query, 'order', 'ASC').upper()
+        after_id = _param(query, 'after_id', cast=int)
+        if after_id is not None or 'offset' not in query:
+            after_value = _param(query, 'after_value')
+            rows = await self.cached_read(
+                ('page', limit, sort_by, order, after_value, after_id),
+                "SELECT * FROM get_contacts_keyset($1, $2, $3, $4, $5)",
+                limit, sort_by, order, after_value, after_id
+            )
+        else:
+            offset = _param(query, 'offset', 0, cast=int)
+            rows = await self.cached_read(
+                ('offset_page', limit, offset, sort_by, order),
+                "SELECT * FROM get_contacts_paginated($1, $2, $3, $4)",
+                limit, offset, sort_by, order
+            )
+        total = rows[0]['total_count'] if rows else 0
+        contacts = [{k: row[k] for k in ('user_id', 'user_name', 'phone_num')} for row in rows]
+        return {'contacts': contacts, 'total_count': total}
+
+    async def upsert(self, query, body):
+        data = _json_body(body)
+        name, phone = data.get('name'), data.get('phone')
+        if not name or not phone:
+            raise HTTPError(400, "Both 'name' and 'phone' are required")
+        async with self.pool.acquire() as conn:
+            await conn.execute("CALL upsert_user($1, $2)", name, phone)
+        self.wrote()
+        return {'status': 'ok'}
+
+    async def bulk_insert(self, query, body):
+        entries = _json_body(body).get('contacts')
+        if not isinstance(entries, list):
+            raise HTTPError(400, "'contacts' must be a list of {name, phone} objects")
+        names = [e.get('name') if isinstance(e, dict) else None for e in entries]
+        phones = [e.get('phone') if isinstance(e, dict) else None for e in entries]
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("SELECT * FROM bulk_insert_users($1, $2)", names, phones)
+        self.wrote()
+        return {'accepted': len(entries) - len(rows), 'rejected': [dict(row) for row in rows]}
+
+    async def delete(self, query, body):
+        value = _param(query, 'value', required=True)
+        delete_type = _param(query, 'type', 'name')
+        if delete_type not in ('name', 'phone'):
+            raise HTTPError(400, "'type' must be 'name' or 'phone'")
+        async with self.pool.acquire() as conn:
+            deleted = await conn.fetchval("CALL delete_contact($1, NULL, $2)", value, delete_type)
+        self.wrote()
+        return {'deleted': deleted}
+
+    async def bulk_delete(self, query, body):
+        data = _json_body(body)
+        values, delete_type = data.get('values'), data.get('type', 'name')
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise HTTPError(400, "'values' must be a list of strings")
+        if delete_type not in ('name', 'phone'):
+            raise HTTPError(400, "'type' must be 'name' or 'phone'")
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("SELECT * FROM delete_contacts($1, $2)", values, delete_type)
+        self.wrote()
+        return {'deleted': sum(row['rows_deleted'] for row in rows),
+                'counts': {row['value']: row['rows_deleted'] for row in rows}}
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            if any(path == url.path for _, path in self.routes):
+                raise HTTPError(405, f"{method} is not allowed on {url.path}")
+            raise HTTPError(404, f"No route for {url.path}")
+        return await handler(parse_qs(url.query), body)
+
+    async def handle_client(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until it closes."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.respond(writer, 413, {'error': 'Headers too large'}, False)
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    await self.respond(writer, 400, {'error': 'Malformed request line'}, False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        key, value = line.split(':', 1)
+                        headers[key.strip().lower()] = value.strip()
+
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version == 'HTTP/1.1')
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    await self.respond(writer, 400, {'error': 'Invalid Content-Length'}, False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {'error': 'Body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                try:
+                    status, payload = 200, await self.dispatch(method, target, body)
+                except HTTPError as e:
+                    status, payload = e.status, {'error': e.message}
+                except (asyncpg.DataError, asyncpg.RaiseError) as e:
+                    status, payload = 400, {'error': str(e)}
+                except Exception as e:
+                    status, payload = 500, {'error': str(e)}
+                    print(f"[ERROR] {method} {target} failed: {e}")
+
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, default=str).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+
+
+async def serve(bind_host, bind_port):
+    pool = await asyncpg.create_pool(
+        host=host, user=user, password=password, database=db_name,
+        min_size=service_pool_min_size, max_size=service_pool_max_size
+    )
+    # Replica pools open their connections on first use, so a replica
+    # that is down does not keep the service from starting
+    replica_pools = [
+        await asyncpg.create_pool(
+            **{'host': host, 'user': user, 'password': password, 'database': db_name, **replica},
+            min_size=0, max_size=service_pool_max_size
+        )
+        for replica in read_replicas
+    ]
+    service = PhoneBookService(pool, replica_pools)
+    stop_listener = start_listener(service.cache)
+    server = await asyncio.start_server(service.handle_client, bind_host, bind_port,
+                                        limit=MAX_HEADER_BYTES)
+    print(f"[OK] Phone book service listening on http://{bind_host}:{bind_port}"
+          f" ({len(replica_pools)} read replica(s))")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        stop_listener.set()
+        for replica_pool in replica_pools:
+            await replica_pool.close()
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phone book HTTP/JSON service.")
+    parser.add_argument('--host', default=service_host)
+    parser.add_argument('--port', type=int, default=service_port)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("[INFO] Service stopped.")
+
+
+if __name__ == '__main__':
+    main()
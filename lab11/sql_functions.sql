@@ -1,119 +1,186 @@
 -- This file contains all the SQL functions and procedures for the PhoneBook application
 -- Save this as sql_functions.sql in the same directory as your Python script
 
+-- 0. Canonical form of a phone number: its digits only, the same rule as the
+-- phone_digits column from migrations/002_phone_digits.sql. NULL when there
+-- are no digits at all, so an empty lookup never matches anything.
+CREATE OR REPLACE FUNCTION normalize_phone(p_phone TEXT)
+RETURNS TEXT AS $$
+    SELECT NULLIF(regexp_replace(p_phone, '[^0-9]', '', 'g'), '');
+$$ LANGUAGE sql IMMUTABLE;
+
 -- 1. Function that returns all records based on a pattern
+-- Written in plain SQL so the planner can inline it: the pattern then becomes
+-- a constant and the trigram indexes from migrations/001_phone_book.sql (and
+-- the GiST one on user_name from 003_ranked_search.sql) can serve the ILIKE
 CREATE OR REPLACE FUNCTION find_contacts_by_pattern(search_pattern TEXT)
 RETURNS TABLE (
     user_id INT,
     user_name VARCHAR(150),
     phone_num VARCHAR(15)
 ) AS $$
-BEGIN
-    RETURN QUERY
     SELECT pb.user_id, pb.user_name, pb.phone_num
     FROM phone_book pb
     WHERE 
         pb.user_name ILIKE '%' || search_pattern || '%' OR
         pb.phone_num ILIKE '%' || search_pattern || '%'
     ORDER BY pb.user_id;
+$$ LANGUAGE sql STABLE;
+
+-- 1a. Ranked fuzzy search: the best `p_limit` matches with a score.
+-- A query of digits and phone punctuation matches phones by digit prefix,
+-- in number order, scored by the share of the number that was typed.
+-- Anything else matches names by trigram word similarity, so typos
+-- ("Jon Smith", "Garcai") still find "John Smith" and "Garcia". The
+-- threshold is lowered from pg_trgm's 0.6, at which a single typo in a
+-- short name already misses; two typos in one word ("Jhon Smtih") still
+-- score below 0.3.
+-- Both branches are index scans that stop after p_limit rows (see
+-- migrations/003_ranked_search.sql): `p_query <% user_name` and
+-- `p_query <<-> user_name` are commuted by the planner to the %> and <->>
+-- operators of gist_trgm_ops.
+CREATE OR REPLACE FUNCTION search_contacts_ranked(
+    p_query TEXT,
+    p_limit INT DEFAULT 10
+)
+RETURNS TABLE (
+    user_id INT,
+    user_name VARCHAR(150),
+    phone_num VARCHAR(15),
+    score REAL
+) AS $$
+DECLARE
+    v_digits TEXT := normalize_phone(p_query);
+BEGIN
+    IF v_digits IS NOT NULL AND p_query ~ '^[\s0-9()+.-]+$' THEN
+        RETURN QUERY
+        SELECT pb.user_id, pb.user_name, pb.phone_num,
+               (length(v_digits)::REAL / length(pb.phone_digits))::REAL
+        FROM phone_book pb
+        -- The text_pattern_ops operators behind LIKE 'prefix%', spelled out
+        -- so the index is used even when the plan is cached as generic
+        WHERE pb.phone_digits ~>=~ v_digits
+          AND pb.phone_digits ~<~ (v_digits || ':')   -- ':' sorts right after '9'
+        ORDER BY pb.phone_digits USING ~<~, pb.user_id
+        LIMIT p_limit;
+    ELSE
+        RETURN QUERY
+        SELECT pb.user_id, pb.user_name, pb.phone_num,
+               word_similarity(p_query, pb.user_name)
+        FROM phone_book pb
+        WHERE p_query <% pb.user_name
+        ORDER BY p_query <<-> pb.user_name, pb.user_id
+        LIMIT p_limit;
+    END IF;
 END;
-$$ LANGUAGE plpgsql;
+$$ LANGUAGE plpgsql STABLE
+SET pg_trgm.word_similarity_threshold = 0.3;
 
 -- 2. Procedure to insert new user or update phone if user exists
+-- A single INSERT ... ON CONFLICT against the unique index on user_name:
+-- one statement instead of check-then-write, and concurrent callers can
+-- no longer both insert the same name
 CREATE OR REPLACE PROCEDURE upsert_user(
     p_user_name VARCHAR(150),
     p_phone_num VARCHAR(15)
 )
 AS $$
 DECLARE
-    v_exists BOOLEAN;
+    v_inserted BOOLEAN;
 BEGIN
-    -- Check if user exists
-    SELECT EXISTS (
-        SELECT 1 FROM phone_book WHERE user_name = p_user_name
-    ) INTO v_exists;
+    INSERT INTO phone_book AS pb (user_name, phone_num)
+    VALUES (p_user_name, p_phone_num)
+    ON CONFLICT (user_name) DO UPDATE SET phone_num = EXCLUDED.phone_num
+    -- Both paths draw a user_id from the sequence, but only a fresh row
+    -- keeps it. (xmax = 0 would tell the same, but partitioned tables do
+    -- not expose system columns here.)
+    RETURNING pb.user_id = currval(pg_get_serial_sequence('phone_book', 'user_id'))
+    INTO v_inserted;
     
-    IF v_exists THEN
-        -- User exists, update phone
-        UPDATE phone_book
-        SET phone_num = p_phone_num
-        WHERE user_name = p_user_name;
-        
-        RAISE NOTICE 'User % already exists. Phone updated to %.', p_user_name, p_phone_num;
-    ELSE
-        -- User doesn't exist, insert new record
-        INSERT INTO phone_book(user_name, phone_num)
-        VALUES (p_user_name, p_phone_num);
-        
+    IF v_inserted THEN
         RAISE NOTICE 'New user % with phone % inserted.', p_user_name, p_phone_num;
+    ELSE
+        RAISE NOTICE 'User % already exists. Phone updated to %.', p_user_name, p_phone_num;
     END IF;
 END;
 $$ LANGUAGE plpgsql;
 
--- 3. Procedure to insert many users with phone validation
-CREATE OR REPLACE PROCEDURE bulk_insert_users(
+-- 3. Function to insert many users with phone validation
+-- Set-based: one regex pass over the input arrays and a single
+-- INSERT ... ON CONFLICT against the unique index on user_name.
+-- Returns the rejected entries as rows instead of raising per row.
+DO $$
+BEGIN
+    -- Older installs define bulk_insert_users as a procedure
+    IF EXISTS (
+        SELECT 1 FROM pg_proc
+        WHERE proname = 'bulk_insert_users'
+          AND pronamespace = current_schema()::regnamespace
+          AND prokind = 'p'
+    ) THEN
+        DROP PROCEDURE bulk_insert_users(TEXT[], TEXT[]);
+    END IF;
+END $$;
+
+CREATE OR REPLACE FUNCTION bulk_insert_users(
     p_names TEXT[],
-    p_phones TEXT[],
-    OUT invalid_entries TEXT[]
+    p_phones TEXT[]
 )
-AS $$
+RETURNS TABLE (
+    entry_index INT,
+    user_name TEXT,
+    phone_num TEXT,
+    reason TEXT
+) AS $$
+#variable_conflict use_column
 DECLARE
-    v_name TEXT;
-    v_phone TEXT;
-    v_count INT;
-    v_phone_pattern TEXT := '^\+?[0-9]{1,3}[-\s]?[0-9]{3,}[-\s0-9]*$'; -- Basic phone validation pattern
-    v_invalid_data TEXT;
+    v_phone_pattern CONSTANT TEXT := '^\+?[0-9]{1,3}[-\s]?[0-9]{3,}[-\s0-9]*$'; -- Basic phone validation pattern
+    v_invalid INT;
 BEGIN
-    -- Initialize output array for invalid entries
-    invalid_entries := '{}';
-    
     -- Check arrays have same length
-    IF array_length(p_names, 1) != array_length(p_phones, 1) THEN
+    IF coalesce(array_length(p_names, 1), 0) != coalesce(array_length(p_phones, 1), 0) THEN
         RAISE EXCEPTION 'Names and phones arrays must have the same length';
     END IF;
-    
-    -- Process each entry
-    v_count := array_length(p_names, 1);
-    
-    FOR i IN 1..v_count LOOP
-        v_name := p_names[i];
-        v_phone := p_phones[i];
-        
-        -- Validate inputs
-        IF v_name IS NULL OR length(trim(v_name)) = 0 THEN
-            v_invalid_data := 'Entry ' || i || ': Empty name';
-            invalid_entries := array_append(invalid_entries, v_invalid_data);
-            CONTINUE;
-        END IF;
-        
-        -- Validate phone format using regex
-        IF v_phone IS NULL OR NOT v_phone ~ v_phone_pattern THEN
-            v_invalid_data := 'Entry ' || i || ': Invalid phone format (' || coalesce(v_phone, 'NULL') || ') for user ' || v_name;
-            invalid_entries := array_append(invalid_entries, v_invalid_data);
-            CONTINUE;
-        END IF;
-        
-        -- If valid, insert the user
-        BEGIN
-            CALL upsert_user(v_name, v_phone);
-        EXCEPTION WHEN OTHERS THEN
-            v_invalid_data := 'Entry ' || i || ': Database error for ' || v_name || ' - ' || SQLERRM;
-            invalid_entries := array_append(invalid_entries, v_invalid_data);
-        END;
-    END LOOP;
-    
-    -- Report invalid entries
-    IF array_length(invalid_entries, 1) > 1 THEN
-        FOR i IN 1..array_length(invalid_entries, 1)-1 LOOP
-            RAISE NOTICE '%', invalid_entries[i];
-        END LOOP;
-    END IF;
-    
-    RAISE NOTICE 'Bulk insert completed. % invalid entries found.', array_length(invalid_entries, 1) - 1;
+
+    RETURN QUERY
+    WITH input AS (
+        SELECT i.ord::INT AS idx, i.name, i.phone,
+               CASE
+                   WHEN i.name IS NULL OR length(trim(i.name)) = 0 THEN 'Empty name'
+                   WHEN length(i.name) > 150 THEN 'Name longer than 150 characters'
+                   WHEN i.phone IS NULL OR NOT i.phone ~ v_phone_pattern THEN 'Invalid phone format'
+                   WHEN length(i.phone) > 15 THEN 'Phone longer than 15 characters'
+               END AS problem
+        FROM unnest(p_names, p_phones) WITH ORDINALITY AS i(name, phone, ord)
+    ),
+    -- A name may appear several times in one batch; like repeated
+    -- upserts, the last occurrence wins
+    latest AS (
+        SELECT DISTINCT ON (input.name) input.name, input.phone
+        FROM input
+        WHERE input.problem IS NULL
+        ORDER BY input.name, input.idx DESC
+    ),
+    upserted AS (
+        INSERT INTO phone_book(user_name, phone_num)
+        SELECT latest.name, latest.phone FROM latest
+        ON CONFLICT (user_name) DO UPDATE SET phone_num = EXCLUDED.phone_num
+    )
+    SELECT input.idx, input.name, input.phone, input.problem
+    FROM input
+    WHERE input.problem IS NOT NULL
+    ORDER BY input.idx;
+
+    GET DIAGNOSTICS v_invalid = ROW_COUNT;
+    RAISE NOTICE 'Bulk insert completed. % invalid entries found.', v_invalid;
 END;
 $$ LANGUAGE plpgsql;
 
 -- 4. Function for paginated queries
+-- One static query per sort column and direction instead of a query string
+-- built with format(): PL/pgSQL keeps the plan of each static statement for
+-- the session, while EXECUTE plans its string again on every call. user_id
+-- breaks ties, so pages are stable and the (column, user_id) indexes apply.
 CREATE OR REPLACE FUNCTION get_contacts_paginated(
     p_limit INT DEFAULT 10,
     p_offset INT DEFAULT 0,
@@ -127,12 +194,99 @@ RETURNS TABLE (
     total_count BIGINT
 ) AS $$
 DECLARE
-    v_query TEXT;
     v_count BIGINT;
+    v_desc BOOLEAN := p_sort_order = 'DESC';   -- anything else sorts ASC
 BEGIN
     -- Get total count for pagination info
     SELECT COUNT(*) INTO v_count FROM phone_book;
-    
+
+    IF p_sort_by = 'user_name' AND NOT v_desc THEN
+        RETURN QUERY
+        SELECT pb.user_id, pb.user_name, pb.phone_num, v_count
+        FROM phone_book pb
+        ORDER BY pb.user_name, pb.user_id
+        LIMIT p_limit OFFSET p_offset;
+    ELSIF p_sort_by = 'user_name' THEN
+        RETURN QUERY
+        SELECT pb.user_id, pb.user_name, pb.phone_num, v_count
+        FROM phone_book pb
+        ORDER BY pb.user_name DESC, pb.user_id DESC
+        LIMIT p_limit OFFSET p_offset;
+    ELSIF p_sort_by = 'phone_num' AND NOT v_desc THEN
+        RETURN QUERY
+        SELECT pb.user_id, pb.user_name, pb.phone_num, v_count
+        FROM phone_book pb
+        ORDER BY pb.phone_num, pb.user_id
+        LIMIT p_limit OFFSET p_offset;
+    ELSIF p_sort_by = 'phone_num' THEN
+        RETURN QUERY
+        SELECT pb.user_id, pb.user_name, pb.phone_num, v_count
+        FROM phone_book pb
+        ORDER BY pb.phone_num DESC, pb.user_id DESC
+        LIMIT p_limit OFFSET p_offset;
+    -- Any other column name sorts by user_id, as before
+    ELSIF NOT v_desc THEN
+        RETURN QUERY
+        SELECT pb.user_id, pb.user_name, pb.phone_num, v_count
+        FROM phone_book pb
+        ORDER BY pb.user_id
+        LIMIT p_limit OFFSET p_offset;
+    ELSE
+        RETURN QUERY
+        SELECT pb.user_id, pb.user_name, pb.phone_num, v_count
+        FROM phone_book pb
+        ORDER BY pb.user_id DESC
+        LIMIT p_limit OFFSET p_offset;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 4a. Cheap row count estimate taken from the planner statistics, so
+-- paging does not have to COUNT(*) the whole table for every page
+CREATE OR REPLACE FUNCTION estimate_contact_count()
+RETURNS BIGINT AS $$
+DECLARE
+    v_estimate BIGINT;
+BEGIN
+    -- A partitioned phone_book (partition_phone_book) has no rows of its
+    -- own; its estimate is the sum over the partitions
+    SELECT CASE WHEN bool_or(c.reltuples < 0) THEN NULL ELSE sum(c.reltuples)::BIGINT END
+    INTO v_estimate
+    FROM pg_class c
+    WHERE (c.oid = 'phone_book'::regclass AND c.relkind = 'r')
+       OR c.oid IN (SELECT relid FROM pg_partition_tree('phone_book') WHERE isleaf);
+
+    -- Never analyzed yet (reltuples = -1): the table is new, so count it
+    IF v_estimate IS NULL OR v_estimate < 0 THEN
+        SELECT COUNT(*) INTO v_estimate FROM phone_book;
+    END IF;
+
+    RETURN v_estimate;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- 4b. Keyset (seek) pagination: returns the page that follows the row
+-- (p_after_value, p_after_id) in the chosen sort order. Each page is an
+-- index range scan, so page 10000 costs the same as page 1.
+-- Pass NULL for p_after_id to get the first page.
+CREATE OR REPLACE FUNCTION get_contacts_keyset(
+    p_limit INT DEFAULT 10,
+    p_sort_by TEXT DEFAULT 'user_id',
+    p_sort_order TEXT DEFAULT 'ASC',
+    p_after_value TEXT DEFAULT NULL,
+    p_after_id INT DEFAULT NULL
+)
+RETURNS TABLE (
+    user_id INT,
+    user_name VARCHAR(150),
+    phone_num VARCHAR(15),
+    total_count BIGINT
+) AS $$
+DECLARE
+    v_where TEXT := '';
+    v_cmp TEXT;
+    v_count BIGINT := estimate_contact_count();
+BEGIN
     -- Validate sort parameters to prevent SQL injection
     IF p_sort_by NOT IN ('user_id', 'user_name', 'phone_num') THEN
         p_sort_by := 'user_id';
@@ -141,17 +295,41 @@ BEGIN
     IF p_sort_order NOT IN ('ASC', 'DESC') THEN
         p_sort_order := 'ASC';
     END IF;
-    
-    -- Dynamic query with validated parameters
-    v_query := format('
-        SELECT pb.user_id, pb.user_name, pb.phone_num, %L::BIGINT as total_count
+
+    -- The default order gets static statements, planned once per session
+    -- (see get_contacts_paginated); bounds past any INT mean "first page"
+    IF p_sort_by = 'user_id' AND p_sort_order = 'ASC' THEN
+        RETURN QUERY
+        SELECT pb.user_id, pb.user_name, pb.phone_num, v_count
         FROM phone_book pb
-        ORDER BY %I %s
-        LIMIT %L OFFSET %L',
-        v_count, p_sort_by, p_sort_order, p_limit, p_offset
-    );
-    
-    RETURN QUERY EXECUTE v_query;
+        WHERE pb.user_id > coalesce(p_after_id::BIGINT, -2147483649)
+        ORDER BY pb.user_id
+        LIMIT p_limit;
+        RETURN;
+    ELSIF p_sort_by = 'user_id' THEN
+        RETURN QUERY
+        SELECT pb.user_id, pb.user_name, pb.phone_num, v_count
+        FROM phone_book pb
+        WHERE pb.user_id < coalesce(p_after_id::BIGINT, 2147483648)
+        ORDER BY pb.user_id DESC
+        LIMIT p_limit;
+        RETURN;
+    END IF;
+
+    v_cmp := CASE p_sort_order WHEN 'ASC' THEN '>' ELSE '<' END;
+
+    IF p_after_id IS NOT NULL THEN
+        v_where := format('WHERE (pb.%I, pb.user_id) %s ($1, $2)', p_sort_by, v_cmp);
+    END IF;
+
+    RETURN QUERY EXECUTE format('
+        SELECT pb.user_id, pb.user_name, pb.phone_num, $4 as total_count
+        FROM phone_book pb
+        %s
+        ORDER BY pb.%I %s, pb.user_id %s
+        LIMIT $3',
+        v_where, p_sort_by, p_sort_order, p_sort_order
+    ) USING p_after_value, p_after_id, p_limit, v_count;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -171,8 +349,9 @@ BEGIN
         GET DIAGNOSTICS rows_deleted = ROW_COUNT;
         RAISE NOTICE 'Deleted % record(s) with name: %', rows_deleted, p_value;
     ELSIF p_type = 'phone' THEN
+        -- Any spelling of the number matches: "+1 555 123-4567" = "15551234567"
         DELETE FROM phone_book
-        WHERE phone_num = p_value;
+        WHERE phone_digits = normalize_phone(p_value);
         GET DIAGNOSTICS rows_deleted = ROW_COUNT;
         RAISE NOTICE 'Deleted % record(s) with phone: %', rows_deleted, p_value;
     ELSE
@@ -180,3 +359,238 @@ BEGIN
     END IF;
 END;
 $$ LANGUAGE plpgsql;
+
+-- 5a. Bulk delete: every name (or phone) in p_values is removed with one
+-- join against phone_book instead of one CALL per value. Returns one row
+-- per distinct input value, in input order, with the number of contacts
+-- it deleted (0 when nothing matched). Phone values are compared by their
+-- digits; a number given in several spellings is counted for the first.
+CREATE OR REPLACE FUNCTION delete_contacts(
+    p_values TEXT[],
+    p_type TEXT DEFAULT 'name'
+)
+RETURNS TABLE (
+    value TEXT,
+    rows_deleted INT
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_total INT;
+BEGIN
+    IF p_type = 'name' THEN
+        RETURN QUERY
+        WITH keys AS (
+            SELECT k.value, k.value AS key, min(k.ord) AS ord
+            FROM unnest(p_values) WITH ORDINALITY AS k(value, ord)
+            WHERE k.value IS NOT NULL
+            GROUP BY k.value
+        ),
+        deleted AS (
+            DELETE FROM phone_book pb
+            USING (SELECT DISTINCT keys.key FROM keys) d
+            WHERE pb.user_name = d.key
+            RETURNING d.key
+        ),
+        counts AS (
+            SELECT deleted.key, count(*)::INT AS n FROM deleted GROUP BY deleted.key
+        )
+        SELECT keys.value, coalesce(counts.n, 0)
+        FROM keys LEFT JOIN counts ON counts.key = keys.key
+        ORDER BY keys.ord;
+    ELSIF p_type = 'phone' THEN
+        RETURN QUERY
+        WITH keys AS (
+            SELECT k.value, normalize_phone(k.value) AS key, min(k.ord) AS ord
+            FROM unnest(p_values) WITH ORDINALITY AS k(value, ord)
+            WHERE k.value IS NOT NULL
+            GROUP BY k.value
+        ),
+        deleted AS (
+            DELETE FROM phone_book pb
+            USING (SELECT DISTINCT keys.key FROM keys) d
+            WHERE pb.phone_digits = d.key
+            RETURNING d.key
+        ),
+        counts AS (
+            SELECT deleted.key, count(*)::INT AS n FROM deleted GROUP BY deleted.key
+        )
+        -- Rows are counted once, for the first spelling of each number
+        SELECT keys.value,
+               CASE WHEN keys.ord = min(keys.ord) OVER (PARTITION BY keys.key)
+                    THEN coalesce(counts.n, 0) ELSE 0 END
+        FROM keys LEFT JOIN counts ON counts.key = keys.key
+        ORDER BY keys.ord;
+    ELSE
+        RAISE EXCEPTION 'Invalid delete type. Use "name" or "phone".';
+    END IF;
+
+    GET DIAGNOSTICS v_total = ROW_COUNT;
+    RAISE NOTICE 'Bulk delete checked % distinct %(s).', v_total, p_type;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 6. Change notification: one NOTIFY per statement that touches phone_book,
+-- so processes that cache lookups (cache.py) can drop stale results.
+-- Notifications are delivered on commit and duplicates within a transaction
+-- are folded into one.
+CREATE OR REPLACE FUNCTION notify_phone_book_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('phone_book_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER phone_book_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON phone_book
+FOR EACH STATEMENT EXECUTE FUNCTION notify_phone_book_changed();
+
+-- 7. Optional partitioned layout for very large phone books: moves the rows
+-- of phone_book into p_partitions hash partitions, so vacuum, index builds
+-- and bulk loads work on one partition-sized piece at a time. The partition
+-- key is user_name: the unique index behind ON CONFLICT (user_name) must
+-- contain it, and exact name lookups (upsert, delete by name) are pruned to
+-- a single partition. user_id keeps its sequence and an index but is no
+-- longer a primary key, which would have to include user_name as well.
+-- Indexes and triggers of the current table are recreated on the new one.
+-- Runs in one transaction holding an exclusive lock; a no-op once done.
+CREATE OR REPLACE PROCEDURE partition_phone_book(p_partitions INT DEFAULT 16)
+AS $$
+DECLARE
+    v_sequence TEXT := pg_get_serial_sequence('phone_book', 'user_id');
+    v_indexes TEXT[];
+    v_triggers TEXT[];
+    v_statement TEXT;
+    v_rows BIGINT;
+BEGIN
+    IF p_partitions < 2 THEN
+        RAISE EXCEPTION 'A partitioned phone_book needs at least 2 partitions';
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'phone_book'::regclass) THEN
+        RAISE NOTICE 'phone_book is already partitioned.';
+        RETURN;
+    END IF;
+
+    LOCK TABLE phone_book IN ACCESS EXCLUSIVE MODE;
+
+    SELECT array_agg(pg_get_indexdef(i.indexrelid)) INTO v_indexes
+    FROM pg_index i
+    WHERE i.indrelid = 'phone_book'::regclass AND NOT i.indisprimary;
+
+    SELECT array_agg(pg_get_triggerdef(t.oid)) INTO v_triggers
+    FROM pg_trigger t
+    WHERE t.tgrelid = 'phone_book'::regclass AND NOT t.tgisinternal;
+
+    -- Keep the user_id sequence when the old table is dropped
+    EXECUTE format('ALTER SEQUENCE %s OWNED BY NONE', v_sequence);
+    ALTER TABLE phone_book RENAME TO phone_book_unpartitioned;
+
+    CREATE TABLE phone_book (
+        LIKE phone_book_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED
+    ) PARTITION BY HASH (user_name);
+
+    FOR i IN 0 .. p_partitions - 1 LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF phone_book FOR VALUES WITH (MODULUS %s, REMAINDER %s)',
+            'phone_book_p' || i, p_partitions, i
+        );
+    END LOOP;
+
+    INSERT INTO phone_book(user_id, user_name, phone_num)
+    SELECT user_id, user_name, phone_num FROM phone_book_unpartitioned;
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    DROP TABLE phone_book_unpartitioned;
+
+    -- Indexes are built after the copy, which is faster than maintaining them
+    FOREACH v_statement IN ARRAY coalesce(v_indexes, '{}') LOOP
+        EXECUTE v_statement;
+    END LOOP;
+    CREATE INDEX phone_book_user_id_idx ON phone_book (user_id);
+    FOREACH v_statement IN ARRAY coalesce(v_triggers, '{}') LOOP
+        EXECUTE v_statement;
+    END LOOP;
+
+    EXECUTE format('ALTER SEQUENCE %s OWNED BY phone_book.user_id', v_sequence);
+    ANALYZE phone_book;
+    RAISE NOTICE 'Moved % row(s) into % hash partitions of phone_book.', v_rows, p_partitions;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 8. Change feed: every INSERT, UPDATE and DELETE on phone_book is copied
+-- into phone_book_changes (migration 004) by statement-level triggers that
+-- read the transition tables, so bulk_insert_users or a bulk delete costs
+-- one trigger call and one INSERT ... SELECT, not one per row. Each
+-- statement then sends one short NOTIFY on `phone_book_feed`:
+-- "<op> <rows> <first change_id> <last change_id>". Upserts show up as I or
+-- U, depending on which rows already existed; a TRUNCATE is logged as a
+-- single T row, after which consumers have to resynchronise.
+CREATE OR REPLACE FUNCTION record_phone_book_changes()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_op CHAR(1) := left(TG_OP, 1);
+    v_rows BIGINT;
+    v_first BIGINT;
+    v_last BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        WITH logged AS (
+            INSERT INTO phone_book_changes(op, user_id, user_name, phone_num)
+            SELECT v_op, o.user_id, o.user_name, o.phone_num
+            FROM old_rows o
+            ORDER BY o.user_id
+            RETURNING change_id
+        )
+        SELECT count(*), min(change_id), max(change_id) INTO v_rows, v_first, v_last FROM logged;
+    ELSIF TG_OP = 'TRUNCATE' THEN
+        INSERT INTO phone_book_changes(op) VALUES (v_op)
+        RETURNING 1, change_id, change_id INTO v_rows, v_first, v_last;
+    ELSE
+        WITH logged AS (
+            INSERT INTO phone_book_changes(op, user_id, user_name, phone_num)
+            SELECT v_op, n.user_id, n.user_name, n.phone_num
+            FROM new_rows n
+            ORDER BY n.user_id
+            RETURNING change_id
+        )
+        SELECT count(*), min(change_id), max(change_id) INTO v_rows, v_first, v_last FROM logged;
+    END IF;
+
+    IF v_rows > 0 THEN
+        PERFORM pg_notify('phone_book_feed', format('%s %s %s %s', v_op, v_rows, v_first, v_last));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables allow only one event per trigger
+CREATE OR REPLACE TRIGGER phone_book_feed_insert
+AFTER INSERT ON phone_book
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION record_phone_book_changes();
+
+CREATE OR REPLACE TRIGGER phone_book_feed_update
+AFTER UPDATE ON phone_book
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION record_phone_book_changes();
+
+CREATE OR REPLACE TRIGGER phone_book_feed_delete
+AFTER DELETE ON phone_book
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION record_phone_book_changes();
+
+CREATE OR REPLACE TRIGGER phone_book_feed_truncate
+AFTER TRUNCATE ON phone_book
+FOR EACH STATEMENT EXECUTE FUNCTION record_phone_book_changes();
+
+-- Drop logged changes older than p_keep; run it once every consumer has
+-- read past them. Returns the number of rows removed.
+CREATE OR REPLACE FUNCTION purge_phone_book_changes(p_keep INTERVAL DEFAULT '7 days')
+RETURNS BIGINT AS $$
+    WITH purged AS (
+        DELETE FROM phone_book_changes
+        WHERE changed_at < now() - p_keep
+        RETURNING 1
+    )
+    SELECT count(*) FROM purged;
+$$ LANGUAGE sql;
+
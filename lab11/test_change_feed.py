@@ -0,0 +1,92 @@
+import io
+import json
+
+import pytest
+
+import change_feed
+from change_feed import Delivery, load_position
+
+
+CHANGES = [((f'0/{i:X}', i), {'change_id': i, 'op': 'INSERT'}) for i in range(1, 5)]
+
+
+class Pipe(io.StringIO):
+    """stdout whose reader goes away after reading `lines` lines.
+
+    Like a real pipe, a failed write drops what was buffered, so a flush
+    after the break succeeds without delivering anything.
+    """
+
+    def __init__(self, lines, buffered=2):
+        super().__init__()
+        self.lines = lines
+        self.buffered = buffered
+        self.received = []
+
+    def write(self, s):
+        n = super().write(s)
+        if self.getvalue().count('\n') >= self.buffered:
+            self._send()
+        return n
+
+    def flush(self):
+        self._send()
+
+    def _send(self):
+        lines = self.getvalue().splitlines()
+        self.seek(0)
+        self.truncate()
+        if len(self.received) + len(lines) > self.lines:
+            raise BrokenPipeError(32, 'Broken pipe')
+        self.received += lines
+
+
+def run_feed(out, position, path):
+    """The loop from main() over CHANGES, caught up (flushed) after change 2."""
+    delivery = Delivery(out, position, path)
+    try:
+        for position, change in CHANGES:
+            if position[1] <= delivery.written[1]:
+                continue
+            delivery.write(position, change)
+            if position[1] == 2:
+                delivery.flush()
+    except BrokenPipeError:
+        pass
+    finally:
+        delivery.close()
+    return delivery
+
+
+def test_broken_pipe_keeps_last_flushed_position(tmp_path):
+    path = str(tmp_path / 'position')
+    delivery = run_feed(Pipe(lines=3), change_feed.START, path)
+    # Changes 3 and 4 filled the buffer, whose write failed mid-batch
+    assert delivery.broken
+    assert delivery.written == CHANGES[2][0]
+    assert load_position(path) == CHANGES[1][0]
+
+
+def test_undelivered_changes_are_resent(tmp_path):
+    path = str(tmp_path / 'position')
+    first = Pipe(lines=3)
+    run_feed(first, change_feed.START, path)
+    second = Pipe(lines=10)
+    run_feed(second, load_position(path), path)
+
+    delivered = [json.loads(line)['change_id'] for line in first.received + second.received]
+    assert delivered == [1, 2, 3, 4]
+    assert load_position(path) == CHANGES[3][0]
+
+
+def test_clean_stop_saves_everything_written(tmp_path):
+    path = str(tmp_path / 'position')
+    with pytest.raises(KeyboardInterrupt):
+        delivery = Delivery(Pipe(lines=10), change_feed.START, path)
+        try:
+            for position, change in CHANGES[:3]:
+                delivery.write(position, change)
+            raise KeyboardInterrupt
+        finally:
+            delivery.close()
+    assert load_position(path) == CHANGES[2][0]
@@ -0,0 +1,48 @@
+import psycopg2
+import pytest
+
+import metrics
+from config import host, user, password, db_name
+from csv_import import import_csv_parallel
+from db import ConnectionPool
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    # Counters of our own, so nothing is written to metrics_file at exit
+    monkeypatch.setattr(metrics, '_operations', {})
+    try:
+        conn = psycopg2.connect(host=host, user=user, password=password, database=db_name)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"no database: {e}")
+    conn.autocommit = True
+    yield conn
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM phone_book WHERE user_name LIKE 'CSV Import Test %%'")
+    conn.close()
+
+
+class OneConnectionPool(ConnectionPool):
+    """pool_max_size = 1, with that connection already held by the caller."""
+
+    def __init__(self):
+        super().__init__(0, 1)
+
+    def connection(self, timeout=None):
+        raise AssertionError("no second connection to hand out")
+
+
+def test_pool_of_one_imports_over_the_callers_connection(conn, tmp_path):
+    path = tmp_path / 'contacts.csv'
+    path.write_text("user_name,phone_num\n"
+                    "CSV Import Test 1,+1-555-000-0001\n"
+                    "CSV Import Test 2,+1-555-000-0002\n"
+                    "CSV Import Test 3,not a phone\n")
+
+    result = import_csv_parallel(conn, OneConnectionPool(), str(path), workers=4)
+
+    assert result['workers'] == 0
+    assert (result['rows'], result['merged'], result['rejected']) == (3, 2, 1)
+    with conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM phone_book WHERE user_name LIKE 'CSV Import Test %%'")
+        assert cur.fetchone()[0] == 2
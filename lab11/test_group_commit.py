@@ -0,0 +1,61 @@
+import threading
+
+import psycopg2
+import pytest
+
+import contacts
+import db
+import metrics
+from db import connection, transaction
+
+
+@pytest.fixture
+def group_commit(monkeypatch):
+    monkeypatch.setattr(db, 'group_commit', True)
+    # Counters of our own, so nothing is written to metrics_file at exit
+    monkeypatch.setattr(metrics, '_operations', {})
+    try:
+        pool = db.get_pool()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"no database: {e}")
+    try:
+        with pool.connection() as conn:
+            yield conn
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM phone_book WHERE user_name LIKE 'Group Commit Test %%'")
+    finally:
+        db.close_pool()
+
+
+def count(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM phone_book WHERE user_name LIKE 'Group Commit Test %%'")
+        return cur.fetchone()[0]
+
+
+def test_concurrent_upserts_share_commits(group_commit):
+    def worker(n):
+        with connection() as conn:
+            for i in range(20):
+                contacts.upsert_contact(conn, f"Group Commit Test {n}-{i}", f"+1-555-{n:03d}-{i:04d}")
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    committer = db.get_group_committer()
+    assert committer.statements == 160
+    assert committer.batches <= committer.statements
+    assert count(group_commit) == 160
+
+
+def test_upsert_inside_a_transaction_stays_on_its_connection(group_commit):
+    committer = db.get_group_committer()
+    with pytest.raises(RuntimeError):
+        with transaction(group_commit):
+            contacts.upsert_contact(group_commit, "Group Commit Test rolled back", "+1-555-000-0001")
+            raise RuntimeError
+    assert committer.statements == 0
+    assert count(group_commit) == 0
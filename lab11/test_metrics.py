@@ -0,0 +1,55 @@
+import glob
+
+import psycopg2
+import pytest
+from psycopg2 import sql
+
+import metrics
+from config import host, user, password, db_name
+
+
+@pytest.fixture
+def conn():
+    try:
+        conn = psycopg2.connect(host=host, user=user, password=password, database=db_name)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"no database: {e}")
+    yield conn
+    conn.close()
+
+
+def test_leading_comments_are_skipped():
+    assert metrics.operation_of("-- Migration 005: x\n\n-- more\nCREATE INDEX i ON t (c)") == 'create'
+    assert metrics.operation_of("/* one\n   two */ ALTER TABLE t ADD c INT") == 'alter'
+    assert metrics.operation_of("  -- why\n/* a */ -- b\nCALL upsert_user(%s, %s)") == 'upsert'
+    assert metrics.operation_of("-- nothing but a comment") == 'other'
+
+
+def test_migrations_are_labelled_by_their_first_statement():
+    for path in sorted(glob.glob('migrations/*.sql')) + ['sql_functions.sql']:
+        with open(path) as f:
+            assert metrics.operation_of(f.read()) in ('create', 'alter'), path
+
+
+def test_composed_is_rendered_with_the_cursor(conn):
+    query = sql.SQL("SELECT * FROM {}({})").format(
+        sql.Identifier('find_contacts_by_pattern'), sql.Literal('Ann'))
+    with conn.cursor() as cur:
+        assert metrics.operation_of(query, cur) == 'search'
+    assert metrics.operation_of(sql.SQL("COPY {} FROM STDIN").format(sql.Identifier('t')),
+                                conn) == 'copy'
+
+
+def test_composed_without_a_connection_uses_its_sql_parts():
+    query = sql.SQL("/* import */ COPY {} (line_no) FROM STDIN").format(sql.Identifier('t'))
+    assert metrics.operation_of(query) == 'copy'
+
+
+def test_instrumented_cursor_labels_composed_statements(conn, monkeypatch):
+    # Counters of our own, so nothing is written to metrics_file at exit
+    monkeypatch.setattr(metrics, '_operations', {})
+    with conn.cursor(cursor_factory=metrics.InstrumentedCursor) as cur:
+        cur.execute(sql.SQL("-- probe\nSELECT {}").format(sql.Literal(1)))
+    labels = metrics.summary()
+    assert 'select' in labels
+    assert 'composed' not in labels and 'other' not in labels